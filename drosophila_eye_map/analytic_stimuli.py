@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Receptor responses to drum gratings, bars and edges without rendering
+
+The stimuli are patterns on a drum (a cylinder, or equivalently a
+sphere) around an axis, as in most experiments: the luminance depends
+only on the azimuth psi around the axis. For the axis (0,0,1), psi is
+the longitude of the eye map. Near a receptor at distance rho (the
+sine of the angle) from the axis, psi changes by 1/rho per radian of
+visual angle across the drum, so the Gaussian acceptance function
+(full width at half maximum delta_rho) averages the pattern along psi
+with a standard deviation of sigma/rho. This gives closed forms for
+
+ * sinusoidal gratings, attenuated by the Gaussian modulation
+   transfer function exp(-(2*pi*f/rho)**2*sigma**2/2) (Snyder 1979),
+ * bars and edges, blurred into differences of normal distribution
+   functions.
+
+The approximation is to first order in the receptor's neighbourhood,
+accurate for delta_rho much smaller than the pattern period and the
+distance to the axis. All methods broadcast their stimulus parameters
+(spatial frequency, axis, velocity, time, ...) against each other and
+return an array of shape broadcast_shape+(n_receptors,)::
+
+    stimuli = AnalyticStimuli(receptor_dirs, delta_rho_q)
+    t = numpy.arange(1000)[:,numpy.newaxis]*dt   # (1000,1)
+    f = numpy.array([1,2,4,8])/(2*numpy.pi)       # (4,) cycles per radian
+    r = stimuli.grating(f, velocity=1.0, t=t)     # (1000,4,n_receptors)
+
+Velocities are in radians of azimuth per unit of time; positive
+velocities move the pattern towards increasing psi.
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.special
+
+from coords import normalize_dirs
+
+FOUR_LN2 = 4*numpy.log(2.0) # as in kernels.py
+
+def get_drum_basis(axis):
+    """return orthonormal vectors (e1,e2) spanning the plane normal to axis
+
+    axis has shape (...,3). psi = arctan2(d.e2, d.e1) is the azimuth
+    of a direction d around the axis, with e1 the part of (1,0,0)
+    normal to the axis (or of (0,1,0) for axes along x) and
+    e2 = axis x e1, so that psi is the longitude for the axis (0,0,1).
+    """
+    axis = normalize_dirs(axis, dtype=numpy.float64)
+    ref = numpy.zeros_like(axis)
+    along_x = numpy.abs(axis[...,0]) > 0.9
+    ref[...,0] = numpy.where(along_x, 0.0, 1.0)
+    ref[...,1] = numpy.where(along_x, 1.0, 0.0)
+    e1 = ref - numpy.sum(ref*axis, axis=-1)[...,numpy.newaxis]*axis
+    e1 = normalize_dirs(e1, out=e1)
+    e2 = numpy.cross(axis, e1)
+    return e1, e2
+
+def wrap_angle(angle):
+    """return angle wrapped to [-pi,pi)"""
+    return numpy.mod(angle+numpy.pi, 2*numpy.pi) - numpy.pi
+
+class AnalyticStimuli:
+    """Gaussian-weighted receptor responses to drum stimuli
+
+    receptor_dirs are the receptor directions and delta_rho the full
+    width at half maximum of their Gaussian acceptance functions
+    (scalar or one value per receptor, in radians, as for
+    kernels.GaussianKernel).
+    """
+    def __init__(self, receptor_dirs, delta_rho):
+        self.receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+        self.n_receptors = len(self.receptor_dirs)
+        delta_rho = numpy.asarray(delta_rho, dtype=numpy.float64)
+        self.sigma = numpy.broadcast_to(delta_rho/numpy.sqrt(2*FOUR_LN2),
+                                        (self.n_receptors,))
+
+    def drum_coords(self, axis=(0.0,0.0,1.0)):
+        """return (psi, rho) of all receptors for drum axes (...,3)
+
+        psi is the azimuth of each receptor around the axis and rho its
+        distance from the axis (the sine of the angle to it), both of
+        shape axis.shape[:-1]+(n_receptors,).
+        """
+        axis = normalize_dirs(axis, dtype=numpy.float64)
+        e1, e2 = get_drum_basis(axis)
+        d = self.receptor_dirs.T
+        psi = numpy.arctan2(numpy.dot(e2, d), numpy.dot(e1, d))
+        rho = numpy.sqrt(numpy.maximum(1-numpy.dot(axis, d)**2, 0.0))
+        return psi, rho
+
+    def _position(self, axis, position, velocity, t):
+        # broadcast the stimulus parameters and return them with a
+        # receptor axis, with the drum coordinates
+        psi, rho = self.drum_coords(axis)
+        position = numpy.asarray(position, dtype=numpy.float64) + \
+                   numpy.asarray(velocity, dtype=numpy.float64)*numpy.asarray(t)
+        return psi, rho, position[...,numpy.newaxis]
+
+    def grating(self, spatial_freq, axis=(0.0,0.0,1.0), phase=0.0,
+                velocity=0.0, t=0.0, mean=0.5, contrast=1.0):
+        """return responses to sinusoidal drum gratings
+
+        The luminance is mean*(1+contrast*cos(2*pi*spatial_freq*
+        (psi-velocity*t)+phase)). spatial_freq is in cycles per radian
+        of azimuth (for a seamless drum, 2*pi*spatial_freq should be an
+        integer, the number of periods), and the temporal frequency is
+        spatial_freq*velocity.
+        """
+        psi, rho, shift = self._position(axis, 0.0, velocity, t)
+        k = 2*numpy.pi*numpy.asarray(spatial_freq, dtype=numpy.float64)[...,numpy.newaxis]
+        phase = numpy.asarray(phase, dtype=numpy.float64)[...,numpy.newaxis]
+        on_axis = rho == 0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            local_k = k/rho
+            mtf = numpy.exp(-0.5*(local_k*self.sigma)**2)
+        # on the axis, all azimuths are averaged: only a uniform
+        # (k==0) pattern passes
+        mtf = numpy.where(on_axis, numpy.where(k == 0, 1.0, 0.0), mtf)
+        mean = numpy.asarray(mean, dtype=numpy.float64)[...,numpy.newaxis]
+        contrast = numpy.asarray(contrast, dtype=numpy.float64)[...,numpy.newaxis]
+        return mean*(1+contrast*mtf*numpy.cos(k*(psi-shift)+phase))
+
+    def bar(self, center, width, axis=(0.0,0.0,1.0), velocity=0.0, t=0.0,
+            low=0.0, high=1.0):
+        """return responses to bars on a drum
+
+        The luminance is high for azimuths within width/2 of
+        center+velocity*t and low elsewhere. width must be less than
+        2*pi by several blur widths.
+        """
+        psi, rho, position = self._position(axis, center, velocity, t)
+        half_width = 0.5*numpy.asarray(width, dtype=numpy.float64)[...,numpy.newaxis]
+        # angular distances across the drum, in units of sigma
+        scale = rho/self.sigma
+        c = wrap_angle(psi-position)
+        inside = (scipy.special.ndtr((c+half_width)*scale) -
+                  scipy.special.ndtr((c-half_width)*scale))
+        # on the axis, all azimuths are averaged
+        inside = numpy.where(rho == 0,
+                             numpy.clip(half_width/numpy.pi, 0.0, 1.0), inside)
+        low = numpy.asarray(low, dtype=numpy.float64)[...,numpy.newaxis]
+        high = numpy.asarray(high, dtype=numpy.float64)[...,numpy.newaxis]
+        return low + (high-low)*inside
+
+    def edge(self, position, axis=(0.0,0.0,1.0), velocity=0.0, t=0.0,
+             low=0.0, high=1.0):
+        """return responses to an edge on a drum
+
+        The luminance is high on the half of the drum with azimuths
+        from position+velocity*t-pi to position+velocity*t and low on
+        the other half, so that a positive velocity moves the edge at
+        position into the low half. (The drum necessarily has a second
+        edge on the opposite side, at position+pi.)
+        """
+        position = numpy.asarray(position, dtype=numpy.float64)
+        return self.bar(position-numpy.pi/2, numpy.pi, axis=axis,
+                        velocity=velocity, t=t, low=low, high=high)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmark the cube map samplers on the precomputed weight matrix
+
+Prints the time per call (best of several repeats) of each sampler for
+a range of batch sizes (number of cube maps sampled per call), e.g.::
+
+    python benchmark_sampling.py --batch-sizes 1,16,256
+
+The "matvec" rows time the sparse matrix product alone, on pixels
+already laid out as the product needs them, which isolates the
+effect of the memory layout of the weight matrix from that of copying
+the frames.
+"""
+from __future__ import division, print_function
+
+import timeit
+from collections import OrderedDict
+
+import numpy
+import scipy.sparse
+
+import precomputed_buchner71 as precomputed_buchner_1971
+from sampler import CubemapSampler, ReorderedSampler, EllpackSampler
+
+def get_benchmarks(weights, receptor_dirs, receptor_dir_slicer):
+    """return an OrderedDict of name -> function(frames) to time
+
+    Each function takes frames of shape (batch_size, n_pixels) and is
+    preceded by a setup call that may prepare the input layout.
+    """
+    csr = CubemapSampler(weights)
+    reordered = ReorderedSampler(weights, receptor_dirs, receptor_dir_slicer)
+    ellpack = EllpackSampler.from_weights(weights)
+
+    benchmarks = OrderedDict()
+    benchmarks['csr'] = lambda frames: csr.sample(frames)
+    benchmarks['reordered'] = lambda frames: reordered.sample(frames)
+    benchmarks['ellpack'] = lambda frames: ellpack.sample(frames)
+
+    def prepare_csr(frames):
+        return numpy.ascontiguousarray(frames.T)
+    def prepare_reordered(frames):
+        return numpy.ascontiguousarray(frames.T[reordered.pixel_perm])
+    benchmarks['csr matvec'] = (prepare_csr, csr.weights.dot)
+    benchmarks['reordered matvec'] = (prepare_reordered, reordered.weights.dot)
+    return benchmarks
+
+def time_call(func, arg, repeat=5, min_time=0.2):
+    """return the best time (in seconds) of one call of func(arg)"""
+    func(arg) # warm up
+    timer = timeit.Timer(lambda: func(arg))
+    number = 1
+    while timer.timeit(number) < min_time/repeat and number < 10000:
+        number *= 2
+    return min(timer.repeat(repeat, number))/number
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-sizes', default='1,4,16,64,256,1024',
+                        help='comma separated batch sizes (default: %(default)s)')
+    parser.add_argument('--dtype', default='float32',
+                        help='data type of the frames (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of repeats, the best is reported')
+    args = parser.parse_args()
+
+    weights = scipy.sparse.csr_matrix(precomputed_buchner_1971.receptor_weight_matrix_64)
+    receptor_dirs = precomputed_buchner_1971.receptor_dirs
+    receptor_dir_slicer = precomputed_buchner_1971.receptor_dir_slicer
+    n_receptors, n_pixels = weights.shape
+    print('weight matrix: %d receptors x %d pixels, %d nonzeros (%.1f per receptor)'%(
+        n_receptors, n_pixels, weights.nnz, weights.nnz/n_receptors))
+    print('ellpack: %d entries per receptor (%.0f%% padding)'%(
+        numpy.max(numpy.diff(weights.indptr)),
+        100*(1-weights.nnz/(n_receptors*numpy.max(numpy.diff(weights.indptr))))))
+
+    benchmarks = get_benchmarks(weights, receptor_dirs, receptor_dir_slicer)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    rng = numpy.random.RandomState(0)
+
+    print('%-20s'%'batch size' + ''.join(['%12d'%b for b in batch_sizes]))
+    times = OrderedDict((name, []) for name in benchmarks)
+    for batch_size in batch_sizes:
+        frames = rng.rand(batch_size, n_pixels).astype(args.dtype)
+        for name, benchmark in benchmarks.items():
+            if isinstance(benchmark, tuple):
+                prepare, func = benchmark
+                arg = prepare(frames)
+            else:
+                func, arg = benchmark, frames
+            times[name].append(time_call(func, arg, repeat=args.repeat))
+    for name in benchmarks:
+        print('%-20s'%(name+' (ms)') + ''.join(['%12.3f'%(t*1e3) for t in times[name]]))
+    reference = times['csr']
+    for name in benchmarks:
+        if name == 'csr' or name.endswith('matvec'):
+            continue
+        print('%-20s'%(name+' speedup') + ''.join(
+            ['%12.2f'%(r/t) for r, t in zip(reference, times[name])]))
+    print('%-20s'%'matvec speedup' + ''.join(
+        ['%12.2f'%(r/t) for r, t in zip(times['csr matvec'], times['reordered matvec'])]))
+
+if __name__=='__main__':
+    main()
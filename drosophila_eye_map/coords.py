@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Vectorized coordinate transforms on the sphere
+
+All functions take array inputs of any (broadcastable) shape and
+operate elementwise, so that converting a trajectory or a whole set of
+receptor directions is a single call. Angles are in radians unless a
+function takes ``degrees=True``.
+
+The computations are done in the floating point type of the inputs
+(float32 inputs stay float32, anything else becomes float64) or in
+``dtype`` if given, e.g. ``dtype=numpy.float32`` to halve memory use
+and bandwidth for large batches. Results are written into ``out`` if
+given, a tuple of arrays for functions returning several arrays (as
+with numpy ufuncs). Except where noted, ``out`` must not share memory
+with the inputs.
+
+Conversions from Cartesian coordinates use arctan2, so that they are
+defined for any (not necessarily unit length) vector without the
+clamping needed by arcsin.
+"""
+from __future__ import division, print_function
+
+import numpy
+
+D2R = numpy.pi/180.0
+R2D = 180.0/numpy.pi
+
+def get_float_dtype(*arrays,**kwargs):
+    """return the floating point type computations on arrays should use
+
+    This is kwargs['dtype'] if given and not None, float32 if all
+    arrays are float32 and float64 otherwise.
+    """
+    dtype = kwargs.get('dtype')
+    if dtype is not None:
+        return numpy.dtype(dtype)
+    dtype = numpy.result_type(*[numpy.asarray(a) for a in arrays])
+    if dtype == numpy.float32:
+        return dtype
+    return numpy.dtype(numpy.float64)
+
+def _get_out(out,n,shape,dtype):
+    if out is None:
+        return tuple(numpy.empty(shape,dtype=dtype) for i in range(n))
+    if len(out) != n:
+        raise ValueError('out must be a tuple of %d arrays'%n)
+    return out
+
+def get_rot_mat(theta,x,y,z):
+    # see http://en.wikipedia.org/wiki/Rotation_matrix
+    cos = numpy.cos(theta)
+    sin = numpy.sin(theta)
+    M = numpy.array([[cos+(1-cos)*x**2, (1-cos)*x*y+sin*z, (1-cos)*x*z-sin*y],
+                     [(1-cos)*y*x-sin*z, cos+(1-cos)*y**2, (1-cos)*y*z+sin*x],
+                     [(1-cos)*z*x+sin*y, (1-cos)*z*y-sin*x, cos+(1-cos)*z**2]])
+    return M
+
+def rotation_to_quaternion(M,dtype=None):
+    """convert rotation matrices (...,3,3) to unit quaternions (...,4)
+
+    The quaternions are (w,x,y,z) as cgtypes.quat, with w>=0, and
+    rotate as the matrices do: a vector v is rotated to dot(M,v) as by
+    rotate_dirs.
+    """
+    dtype = get_float_dtype(M,dtype=dtype)
+    M = numpy.asarray(M,dtype=dtype)
+    if M.shape[-2:] != (3,3):
+        raise ValueError('rotation matrices must have shape (...,3,3)')
+    m = [[M[...,i,j] for j in range(3)] for i in range(3)]
+    # 4*q_i*q_j for all pairs of components (w,x,y,z). The row of the
+    # largest component is used, as it is the most accurate.
+    q = numpy.stack([
+        numpy.stack([1+m[0][0]+m[1][1]+m[2][2], m[2][1]-m[1][2],
+                     m[0][2]-m[2][0], m[1][0]-m[0][1]],axis=-1),
+        numpy.stack([m[2][1]-m[1][2], 1+m[0][0]-m[1][1]-m[2][2],
+                     m[0][1]+m[1][0], m[0][2]+m[2][0]],axis=-1),
+        numpy.stack([m[0][2]-m[2][0], m[0][1]+m[1][0],
+                     1-m[0][0]+m[1][1]-m[2][2], m[1][2]+m[2][1]],axis=-1),
+        numpy.stack([m[1][0]-m[0][1], m[0][2]+m[2][0],
+                     m[1][2]+m[2][1], 1-m[0][0]-m[1][1]+m[2][2]],axis=-1),
+        ],axis=-2)
+    diag = numpy.stack([q[...,i,i] for i in range(4)],axis=-1)
+    best = numpy.argmax(diag,axis=-1)[...,numpy.newaxis,numpy.newaxis]
+    q = numpy.take_along_axis(q,best,axis=-2)[...,0,:]
+    q /= numpy.sqrt(numpy.sum(q**2,axis=-1))[...,numpy.newaxis]
+    q *= numpy.where(q[...,0:1] < 0, -1, 1)
+    return q
+
+def quaternion_to_rotation(q,dtype=None):
+    """convert quaternions (...,4) as (w,x,y,z) to rotation matrices (...,3,3)
+
+    The quaternions need not be normalized.
+    """
+    dtype = get_float_dtype(q,dtype=dtype)
+    q = numpy.asarray(q,dtype=dtype)
+    if q.shape[-1] != 4:
+        raise ValueError('quaternions must have a last dimension of length 4')
+    q = q/numpy.sqrt(numpy.sum(q**2,axis=-1))[...,numpy.newaxis]
+    w,x,y,z = q[...,0],q[...,1],q[...,2],q[...,3]
+    M = numpy.empty(q.shape[:-1]+(3,3),dtype=dtype)
+    M[...,0,0] = 1-2*(y*y+z*z)
+    M[...,0,1] = 2*(x*y-w*z)
+    M[...,0,2] = 2*(x*z+w*y)
+    M[...,1,0] = 2*(x*y+w*z)
+    M[...,1,1] = 1-2*(x*x+z*z)
+    M[...,1,2] = 2*(y*z-w*x)
+    M[...,2,0] = 2*(x*z-w*y)
+    M[...,2,1] = 2*(y*z+w*x)
+    M[...,2,2] = 1-2*(x*x+y*y)
+    return M
+
+def long_lat2xyz(long,lat,R=1.0,out=None,dtype=None):
+    """convert longitude and latitude to Cartesian coordinates x,y,z"""
+    dtype = get_float_dtype(long,lat,dtype=dtype)
+    long = numpy.asarray(long,dtype=dtype)
+    lat = numpy.asarray(lat,dtype=dtype)
+    R = numpy.asarray(R,dtype=dtype)
+    shape = numpy.broadcast(long,lat,R).shape
+    x,y,z = _get_out(out,3,shape,dtype)
+
+    # the sine of the colatitude is the cosine of the latitude
+    R_cos_lat = R*numpy.cos(lat)
+    numpy.multiply(R_cos_lat,numpy.cos(long),out=x)
+    numpy.multiply(R_cos_lat,numpy.sin(long),out=y)
+    numpy.multiply(R,numpy.sin(lat),out=z)
+    return x,y,z
+
+def xyz2long_lat(xn,yn,zn,out=None,dtype=None):
+    """convert Cartesian coordinates to longitude, latitude and radius
+
+    out may be (xn,yn,zn) to convert in place.
+    """
+    dtype = get_float_dtype(xn,yn,zn,dtype=dtype)
+    xn = numpy.asarray(xn,dtype=dtype)
+    yn = numpy.asarray(yn,dtype=dtype)
+    zn = numpy.asarray(zn,dtype=dtype)
+    shape = numpy.broadcast(xn,yn,zn).shape
+    longn,latn,rho = _get_out(out,3,shape,dtype)
+
+    rho_xy = numpy.hypot(xn,yn)
+    numpy.arctan2(yn,xn,out=longn)
+    numpy.arctan2(zn,rho_xy,out=latn)
+    numpy.hypot(rho_xy,zn,out=rho)
+    return longn,latn,rho
+
+def rotate_xyz(M,x,y,z,out=None,dtype=None):
+    """rotate the points x,y,z by the 3x3 matrix M
+
+    out may be (x,y,z) to rotate in place.
+    """
+    dtype = get_float_dtype(x,y,z,dtype=dtype)
+    xyz = numpy.array(numpy.broadcast_arrays(x,y,z),dtype=dtype)
+    rotated = numpy.tensordot(numpy.asarray(M,dtype=dtype),xyz,axes=1)
+    if out is None:
+        return rotated[0],rotated[1],rotated[2]
+    xn,yn,zn = _get_out(out,3,None,None)
+    xn[...] = rotated[0]
+    yn[...] = rotated[1]
+    zn[...] = rotated[2]
+    return xn,yn,zn
+
+class LongLatRotator:
+    def __init__(self,rotmatrix):
+        self.rotmatrix = rotmatrix
+    def __call__(self,long,lat,R=1.0,out=None,dtype=None):
+        x3,y3,z3 = long_lat2xyz(long,lat,R,dtype=dtype)
+
+        # next, transform to new 3D cartesian
+        rotate_xyz(self.rotmatrix,x3,y3,z3,out=(x3,y3,z3))
+
+        # finally, transform back to long, lat
+        if out is None:
+            out = x3,y3,z3
+        return xyz2long_lat(x3,y3,z3,out=out)
+
+def xform_long_lat_2_stereographic(long,lat,R=1.0,out=None,dtype=None):
+    dtype = get_float_dtype(long,lat,dtype=dtype)
+    long = numpy.asarray(long,dtype=dtype)
+    lat = numpy.asarray(lat,dtype=dtype)
+    R = numpy.asarray(R,dtype=dtype)
+    shape = numpy.broadcast(long,lat,R).shape
+    x,y = _get_out(out,2,shape,dtype)
+
+    theta_P = long
+    rho_P = 2*R*numpy.tan((numpy.pi/2-lat)/2.0)
+
+    numpy.multiply(rho_P,numpy.cos(theta_P),out=x)
+    numpy.multiply(rho_P,numpy.sin(theta_P),out=y)
+    return x,y
+
+def xform_stereographic_2_long_lat(x,y,R=1.0,out=None,dtype=None):
+    dtype = get_float_dtype(x,y,dtype=dtype)
+    x = numpy.asarray(x,dtype=dtype)
+    y = numpy.asarray(y,dtype=dtype)
+    R = numpy.asarray(R)
+    shape = numpy.broadcast(x,y,R).shape
+    long,lat = _get_out(out,2,shape,dtype)
+
+    # convert to 2D polar
+    rho = numpy.hypot(x,y)
+    numpy.arctan2(y,x,out=long)
+
+    # convert to spherical
+    colat = numpy.arctan(rho/(2*R))
+    colat *= 2
+    numpy.subtract(numpy.pi/2,colat,out=lat)
+
+    return long, lat, R
+
+###########################################################
+# directions as arrays of shape (...,3)
+
+def normalize_dirs(dirs,out=None,dtype=None):
+    """scale direction vectors (...,3) to unit length
+
+    dirs may be a sequence of cgtypes.vec3. out may be dirs to
+    normalize in place.
+    """
+    dtype = get_float_dtype(dirs,dtype=dtype)
+    dirs = numpy.asarray(dirs,dtype=dtype)
+    if dirs.shape[-1] != 3:
+        raise ValueError('directions must have a last dimension of length 3')
+    norm = numpy.sqrt(numpy.sum(dirs**2,axis=-1))[...,numpy.newaxis]
+    return numpy.divide(dirs,norm,out=out)
+
+def lonlat2dirs(lon,lat,degrees=False,out=None,dtype=None):
+    """convert longitude and latitude to unit direction vectors (...,3)"""
+    dtype = get_float_dtype(lon,lat,dtype=dtype)
+    lon = numpy.asarray(lon,dtype=dtype)
+    lat = numpy.asarray(lat,dtype=dtype)
+    if degrees:
+        lon = lon*D2R
+        lat = lat*D2R
+    if out is None:
+        out = numpy.empty(numpy.broadcast(lon,lat).shape+(3,),dtype=dtype)
+    long_lat2xyz(lon,lat,out=(out[...,0],out[...,1],out[...,2]))
+    return out
+
+def dirs2lonlat(dirs,degrees=False,out=None,dtype=None):
+    """convert direction vectors (...,3) to longitude and latitude (...,2)
+
+    The vectors need not be normalized.
+    """
+    dtype = get_float_dtype(dirs,dtype=dtype)
+    dirs = numpy.asarray(dirs,dtype=dtype)
+    if dirs.shape[-1] != 3:
+        raise ValueError('directions must have a last dimension of length 3')
+    if out is None:
+        out = numpy.empty(dirs.shape[:-1]+(2,),dtype=dtype)
+    lon,lat = out[...,0],out[...,1]
+    numpy.arctan2(dirs[...,1],dirs[...,0],out=lon)
+    numpy.arctan2(dirs[...,2],numpy.hypot(dirs[...,0],dirs[...,1]),out=lat)
+    if degrees:
+        out *= R2D
+    return out
+
+def rotate_dirs(dirs,M,out=None,dtype=None):
+    """rotate direction vectors (...,3) by the 3x3 matrix M
+
+    out may be dirs to rotate in place.
+    """
+    dtype = get_float_dtype(dirs,dtype=dtype)
+    dirs = numpy.asarray(dirs,dtype=dtype)
+    M = numpy.asarray(M,dtype=dtype)
+    return numpy.matmul(dirs,M.T,out=out)
+
+def tangent_basis(dirs,out=None,dtype=None):
+    """return the local east and north unit vectors at directions (...,3)
+
+    east points towards increasing longitude and north towards
+    increasing latitude. At the poles, where these are undefined, the
+    basis of longitude 0 is returned. Returns (east, north), each of
+    shape (...,3).
+    """
+    dtype = get_float_dtype(dirs,dtype=dtype)
+    lonlat = dirs2lonlat(dirs,dtype=dtype)
+    lon,lat = lonlat[...,0],lonlat[...,1]
+    east,north = _get_out(out,2,lonlat.shape[:-1]+(3,),dtype)
+    sin_lat = numpy.sin(lat)
+    numpy.negative(numpy.sin(lon),out=east[...,0])
+    numpy.cos(lon,out=east[...,1])
+    east[...,2] = 0.0
+    numpy.multiply(east[...,1],-sin_lat,out=north[...,0])
+    numpy.multiply(east[...,0],sin_lat,out=north[...,1])
+    numpy.cos(lat,out=north[...,2])
+    return east,north
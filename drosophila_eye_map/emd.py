@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Elementary motion detectors (Hassenstein-Reichardt) on the eye map
+
+One correlation-type detector is placed on every pair of neighboring
+receptors (every edge of the eye map triangulation). Each detector
+multiplies the delayed (low-pass filtered) signal of one receptor with
+the undelayed signal of the other and subtracts the mirror symmetric
+product, so it responds positively to motion from ``pre`` towards
+``post`` and negatively to the opposite direction::
+
+    pre, post = get_detector_pairs(triangles, len(receptor_dirs))
+    emd = ReichardtDetector(pre, post, dt=0.001, tau_lp=0.035)
+    responses = emd.run(receptor_signals)      # (T, n_receptors) offline
+    emd.reset()
+    for frame in frames:                       # or frame by frame
+        response = emd.process(frame)          # (n_receptors,) -> (n_pairs,)
+
+The temporal filters act on the receptor signals (not on the pairs)
+and all state updates are vectorized over receptors. Filter state
+persists between calls of process(), so that processing a sequence in
+chunks gives the same result as processing it at once.
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.signal
+
+from receptor_graph import get_edges
+from coords import normalize_dirs
+from temporal import get_lowpass_coeffs
+
+def get_detector_pairs(triangles, n_receptors, directed=False):
+    """return index arrays (pre, post) of neighboring receptor pairs
+
+    Without directed, there is one pair per triangle edge (pre < post),
+    which suffices for the full (opponent) detector. With directed, both
+    orientations of each edge are returned, e.g. for half detectors.
+    """
+    edges, counts = get_edges(triangles, n_receptors)
+    pre = edges[:,0]
+    post = edges[:,1]
+    if directed:
+        pre, post = numpy.concatenate([pre, post]), numpy.concatenate([post, pre])
+    return pre, post
+
+def get_pair_directions(receptor_dirs, pre, post):
+    """return the preferred direction of each detector
+
+    Returns (midpoints, directions), both of shape (n_pairs,3): the
+    unit vector between the two receptors and the unit tangent vector
+    there pointing from pre towards post.
+    """
+    dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+    midpoints = normalize_dirs(dirs[pre]+dirs[post])
+    diff = dirs[post]-dirs[pre]
+    # remove the (tiny) radial component
+    diff -= numpy.sum(diff*midpoints, axis=1)[:,numpy.newaxis]*midpoints
+    return midpoints, normalize_dirs(diff)
+
+class FirstOrderFilter:
+    """streaming first order low-pass filter over many channels
+
+    The state (one value per channel) is kept between calls of
+    process().
+    """
+    def __init__(self, dt, tau, n_channels):
+        self.b, self.a = get_lowpass_coeffs(dt, tau)
+        self.n_channels = n_channels
+        self.zi = None
+
+    def reset(self, x0=None):
+        """start from rest, or from the steady state for input x0"""
+        if x0 is None:
+            self.zi = numpy.zeros((1, self.n_channels))
+        else:
+            zi = scipy.signal.lfilter_zi(self.b, self.a)
+            self.zi = zi[:,numpy.newaxis]*numpy.asarray(x0, dtype=numpy.float64)
+
+    def process(self, x):
+        """filter x of shape (T, n_channels) along the first axis"""
+        if self.zi is None:
+            self.reset()
+        y, self.zi = scipy.signal.lfilter(self.b, self.a, x, axis=0, zi=self.zi)
+        return y
+
+class ReichardtDetector:
+    """Hassenstein-Reichardt detectors on pairs of receptors
+
+    tau_lp is the time constant of the delay filter. If tau_hp is
+    given, the receptor signals are first high-pass filtered with this
+    time constant (as in many fly models) to remove the mean
+    luminance. With steady_start (the default), the filters are
+    initialized to the steady state of the first input frame rather
+    than to zero, which avoids the onset transient.
+    """
+    def __init__(self, pre, post, dt, tau_lp, tau_hp=None, steady_start=True):
+        self.pre = numpy.asarray(pre, dtype=numpy.intp)
+        self.post = numpy.asarray(post, dtype=numpy.intp)
+        if self.pre.shape != self.post.shape:
+            raise ValueError('pre and post must have the same shape')
+        self.n_receptors = int(max(numpy.max(self.pre), numpy.max(self.post)))+1
+        self.steady_start = steady_start
+        self.lowpass = FirstOrderFilter(dt, tau_lp, self.n_receptors)
+        if tau_hp is None:
+            self.highpass = None
+        else:
+            self.highpass = FirstOrderFilter(dt, tau_hp, self.n_receptors)
+        self.reset()
+
+    def reset(self):
+        """forget the filter state, e.g. before a new sequence"""
+        self._started = False
+
+    def _start(self, x0):
+        if not self.steady_start:
+            x0 = None
+            hp0 = None
+        elif self.highpass is not None:
+            hp0 = numpy.zeros_like(x0) # high-passed constant input
+        else:
+            hp0 = x0
+        if self.highpass is not None:
+            self.highpass.reset(x0)
+        self.lowpass.reset(hp0)
+        self._started = True
+
+    def process(self, x):
+        """return the detector responses to receptor signals x
+
+        x has shape (T, n_receptors), or (n_receptors,) for a single
+        frame. Returns (T, n_pairs) or (n_pairs,), respectively. The
+        filter state is kept for the next call.
+        """
+        x = numpy.asarray(x, dtype=numpy.float64)
+        single_frame = x.ndim == 1
+        if single_frame:
+            x = x[numpy.newaxis,:]
+        # receptors beyond the highest paired index are not needed
+        x = x[:,:self.n_receptors]
+        if not len(x):
+            return numpy.zeros((0,len(self.pre)))
+        if not self._started:
+            self._start(x[0])
+        if self.highpass is not None:
+            x = x - self.highpass.process(x)
+        delayed = self.lowpass.process(x)
+        response = delayed[:,self.pre]*x[:,self.post] - x[:,self.pre]*delayed[:,self.post]
+        if single_frame:
+            response = response[0]
+        return response
+
+    def run(self, x):
+        """process a whole sequence (T, n_receptors) from a fresh start"""
+        self.reset()
+        return self.process(x)
@@ -34,21 +34,23 @@
 This GUI program is used to inspect the precomputed_buchner_1971.py
 file to make sure its results are what is expected.
 
-WARNING: all dependencies are in this program -- will not load
-anything other than precomputed_buchner_1971.py from current
-directory or an installed drosophila_eye_map package.  (The reason
-is that because this program might be used outside the normal
-environment of a drosophila_eye_map package directory, it carries
-all its dependencies with it.) This could be a problem if, for
-example, the cube_order ever changes.
+WARNING: nearly all dependencies are in this program -- will not load
+anything other than precomputed_buchner_1971.py, projections.py and
+coords.py from current directory or an installed drosophila_eye_map
+package.
+(The reason is that because this program might be used outside the
+normal environment of a drosophila_eye_map package directory, it
+carries its other dependencies with it.) This could be a problem if,
+for example, the cube_order ever changes.
 """
 from __future__ import division, print_function
 
 import numpy as np
-import math
+import scipy.sparse
+from collections import OrderedDict
 
 import precomputed_buchner71 as precomputed_buchner_1971
-from mpl_toolkits.basemap import Basemap # basemap > 0.9.9.1
+from projections import Stereographic
 
 import matplotlib
 rcParams = matplotlib.rcParams
@@ -56,6 +58,8 @@ rcParams['font.size'] = 10
 rcParams['font.family'] = 'serif'
 #rcParams['font.serif'] = 'Times'
 #rcParams['font.sans-serif'] = 'Arial'
+# 'h' toggles hover mode (see App.on_key), not the home view
+rcParams['keymap.home'] = [k for k in rcParams['keymap.home'] if k != 'h']
 if 0:
     from matplotlib import verbose
     verbose.level = 'debug-annoying'
@@ -64,18 +68,6 @@ import matplotlib.pyplot as plt
 
 cube_order = ['posx', 'negx', 'posy', 'negy', 'posz', 'negz']
 
-def xyz2lonlat(x,y,z):
-    R2D = 180.0/math.pi
-    try:
-        lat = math.asin(z)*R2D
-    except ValueError as err:
-        if z>1 and z < 1.1:
-            lat = math.asin(1.0)*R2D
-        else:
-            raise
-    lon1 = math.atan2(y,x)*R2D
-    return lon1,lat
-
 def unflatten_cubemap( rank1 ):
     rank1 = np.asarray(rank1)
     assert rank1.ndim==1
@@ -92,79 +84,121 @@ def unflatten_cubemap( rank1 ):
         cubemap[dir]=this_face_pixels
     return cubemap
 
-def do_projection( proj, lon_lats):
-    xys = np.array([proj( lon, lat ) for (lon,lat) in lon_lats ])
-
-    x = xys[:,0]
-    y = xys[:,1]
-
-    return x,y
-
 class App:
     def on_pick(self,event):
-        self.show_index(event.ind[0]) # only show first point
+        self.show_index(self.good_idx[event.ind[0]]) # only show first point
+
+    def on_motion(self,event):
+        if not self.hover or event.inaxes is not self.picker_axes:
+            return
+        # find the nearest ommatidium in display coordinates
+        xy = self.picker_axes.transData.transform(
+            np.column_stack([self.x[self.good_idx],self.y[self.good_idx]]))
+        dist2 = (xy[:,0]-event.x)**2 + (xy[:,1]-event.y)**2
+        nearest = np.argmin(dist2)
+        if dist2[nearest] > self.hover_tolerance**2:
+            return
+        ind = self.good_idx[nearest]
+        if ind != self.current_index:
+            self.show_index(ind)
+
+    def on_key(self,event):
+        if event.key == 'h':
+            self.hover = not self.hover
+            print('hover mode', 'on' if self.hover else 'off')
+
+    def on_draw(self,event):
+        # After a full redraw, save the background (everything except
+        # the animated artists) of each axes with animated artists for
+        # blitting, and draw those on top.
+        canvas = self.fig.canvas
+        self.backgrounds = dict( (ax, canvas.copy_from_bbox(ax.bbox))
+                                 for ax in self.animated_artists )
+        for ax in self.animated_artists:
+            self.draw_animated(ax)
+
+    def draw_animated(self,ax):
+        for artist in self.animated_artists[ax]:
+            self.fig.draw_artist(artist)
+
+    def get_cubemap(self,ind):
+        """return the weight map of left eye receptor ind as a cubemap
+
+        Only this receptor's row of the sparse weight matrix is
+        expanded. Recently used cubemaps are kept in a small LRU cache.
+        """
+        try:
+            cubemap = self.cubemap_cache.pop(ind)
+        except KeyError:
+            row = self.left_rows[ind]
+            start, stop = self.weights.indptr[row:row+2]
+            vec = np.zeros( (self.weights.shape[1],), dtype=self.weights.dtype )
+            vec[self.weights.indices[start:stop]] = self.weights.data[start:stop]
+            cubemap = unflatten_cubemap( vec )
+            if len(self.cubemap_cache) >= self.cubemap_cache_size:
+                self.cubemap_cache.popitem(last=False) # discard oldest
+        self.cubemap_cache[ind] = cubemap
+        return cubemap
 
     def show_index(self,ind):
-        vec = self.left_weights[ind,:]
-
-        cubemap = unflatten_cubemap( vec )
+        self.current_index = ind
+        cubemap = self.get_cubemap(ind)
 
+        # update the existing artists rather than creating new ones
         for dir in cube_order:
-            self.cubeax[dir].imshow( cubemap[dir],
-                                     aspect='auto',
-                                     vmin=0.0,
-                                     vmax=0.1,
-                                     origin='lower',
-                                     )
-
-        ax = self.picker_axes
-
-        if self.highlight is None:
-            self.highlight, = ax.plot([self.x[ind]],[self.y[ind]],'ro',
-                                      ms=4.0,
-                                      markeredgecolor='k',
-                                      picker=0, # don't pick this red dot
-                                      )
-        else:
-            self.highlight.set_xdata( [self.x[ind]] )
-            self.highlight.set_ydata( [self.y[ind]] )
-        plt.draw()
-
-    def __init__(self):
-        self.highlight = None
+            self.cubeim[dir].set_data( cubemap[dir] )
+        self.highlight.set_xdata( [self.x[ind]] )
+        self.highlight.set_ydata( [self.y[ind]] )
+
+        canvas = self.fig.canvas
+        if self.backgrounds is None or not getattr(canvas,'supports_blit',False):
+            canvas.draw_idle()
+            return
+        # only the cube face axes and the picker axes are redrawn
+        for ax in self.animated_artists:
+            canvas.restore_region(self.backgrounds[ax])
+            self.draw_animated(ax)
+            canvas.blit(ax.bbox)
+
+    def __init__(self,cubemap_cache_size=64,hover=False,hover_tolerance=5):
+        self.hover = hover
+        self.hover_tolerance = hover_tolerance # pixels
+        self.current_index = None
+        self.backgrounds = None
+        self.cubemap_cache = OrderedDict()
+        self.cubemap_cache_size = cubemap_cache_size
         # modified from make_buchner_interommatidial_distance_figure
 
         rdirs = precomputed_buchner_1971.receptor_dirs
         rdir_slicer = precomputed_buchner_1971.receptor_dir_slicer
         triangles = precomputed_buchner_1971.triangles
         weights = precomputed_buchner_1971.receptor_weight_matrix_64
-        weights = np.asarray(weights.todense())
+        # keep sparse, rows are expanded on demand in get_cubemap()
+        self.weights = scipy.sparse.csr_matrix(weights)
 
         self.left_rdirs = rdirs[rdir_slicer['left']]
-        self.left_weights = weights[rdir_slicer['left']]
-
-        lon_lats = [xyz2lonlat(*rdir) for rdir in self.left_rdirs]
+        self.left_rows = np.arange(len(rdirs))[rdir_slicer['left']]
 
-        stere = Basemap(projection='stere',
-                        resolution=None,
-                        lat_ts = 0.0,
-                        lat_0 = 0,
-                        lon_0 = 90,
-                        llcrnrlon = -45,
-                        urcrnrlon = -135,
-                        llcrnrlat= -30,
-                        urcrnrlat = 30,
-                        )
+        stere = Stereographic(lat_ts = 0.0,
+                              lat_0 = 0,
+                              lon_0 = 90,
+                              llcrnrlon = -45,
+                              urcrnrlon = -135,
+                              llcrnrlat= -30,
+                              urcrnrlat = 30,
+                              )
 
-        self.x,self.y = do_projection(stere,lon_lats)
+        self.x,self.y = stere.project_dirs(self.left_rdirs)
 
         # pcolor figure -- stereographic projection
         self.fig = plt.figure(figsize=(8,12))
         ax = plt.subplot(2,1,1)
-        ax.set_title('click on an ommatidium to show weightmap')
+        ax.set_title('click on an ommatidium to show weightmap '
+                     '("h" toggles hover mode)')
         self.picker_axes = ax
 
-        good = self.x < 1e29 # basemap seems to set bad values to 1e30
+        good = self.x < 1e29 # bad values are set to 1e30
+        self.good_idx = np.nonzero(good)[0]
         ax.plot(self.x[good],self.y[good],'wo',
                 ms=4.0,
                 markeredgecolor='k',
@@ -237,15 +271,53 @@ class App:
             title = title.replace('neg','-')
             self.cubeax[dir].text(0,0,title,color='white')
 
+        # Create the artists that change only once. They are animated, so
+        # they are not part of the saved background but get blitted
+        # on top of it.
+        self.animated_artists = OrderedDict() # axes -> artists
+        res = int(np.sqrt(self.weights.shape[1]//6))
+        self.cubeim = {}
+        for dir in cube_order:
+            cax = self.cubeax[dir]
+            self.cubeim[dir] = cax.imshow( np.zeros((res,res)),
+                                           aspect='auto',
+                                           vmin=0.0,
+                                           vmax=0.1,
+                                           origin='lower',
+                                           animated=True,
+                                           )
+            self.animated_artists[cax] = [self.cubeim[dir]]
+            # keep the face label on top of the image
+            for label in cax.texts:
+                label.set_animated(True)
+                self.animated_artists[cax].append(label)
+
+        self.highlight, = self.picker_axes.plot([self.x[0]],[self.y[0]],'ro',
+                                                ms=4.0,
+                                                markeredgecolor='k',
+                                                picker=0, # don't pick this red dot
+                                                animated=True,
+                                                )
+        self.animated_artists[self.picker_axes] = [self.highlight]
+
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
         self.show_index(0)
 
     def mainloop(self):
         self.fig.canvas.mpl_connect('pick_event', self.on_pick)
+        self.fig.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.fig.canvas.mpl_connect('key_press_event', self.on_key)
 
         plt.show()
 
 def main():
-    app = App()
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hover', action='store_true', default=False,
+                        help='show the weightmap of the ommatidium under the '
+                        'mouse without clicking (toggle with "h")')
+    args = parser.parse_args()
+    app = App(hover=args.hover)
     app.mainloop()
 
 if __name__=='__main__':
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Interpolation of per-receptor fields to arbitrary view directions
+
+The receptor triangulation (``triangles`` of precomputed_buchner71.py)
+is used on the sphere. Point location is done once for a set of query
+directions and stored as a sparse matrix of barycentric weights, so
+that each per-receptor field (interommatidial distance, acceptance
+angle, activations, ...) costs a single matrix-vector product::
+
+    interp = SphericalInterpolator(receptor_dirs, triangles, query_dirs)
+    dist_map = interp(dists)
+    activation_maps = interp(activations.T)   # (n_receptors, T) fields
+
+Barycentric coordinates are computed in the gnomonic sense: a query
+direction q is written as q = a*A + b*B + c*C for the triangle vertices
+A, B and C, and is inside the spherical triangle if a, b and c are all
+non-negative. The weights are a, b and c divided by their sum.
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.sparse
+import scipy.spatial
+
+from receptor_query import as_unit_vectors
+
+def barycentric_weight_matrix(receptor_dirs, triangles, query_dirs,
+                              k=12, eps=1e-9):
+    """locate query directions in the spherical triangulation
+
+    receptor_dirs is a sequence of N directions, triangles a sequence
+    of vertex index triples (triangles referring to vertices beyond
+    receptor_dirs are ignored, e.g. the other eye's triangles when
+    only one eye's directions are given) and query_dirs an array of
+    shape (Q,3).
+
+    Returns (weights, inside), where weights is a sparse (Q,N) CSR
+    matrix with the barycentric weights of each query direction in the
+    row and inside is a boolean (Q,) array, False for directions not
+    covered by any triangle (whose rows are empty).
+
+    To be fast for many queries, only the triangles with the k nearest
+    centroids are tested first. The remaining queries are then tested
+    against all triangles whose bounding cap contains them.
+    """
+    verts = as_unit_vectors(receptor_dirs)
+    n_verts = len(verts)
+    triangles = numpy.asarray(triangles, dtype=numpy.intp).reshape((-1,3))
+    triangles = triangles[numpy.all(triangles < n_verts, axis=1)]
+    query_dirs = numpy.asarray(query_dirs, dtype=numpy.float64).reshape((-1,3))
+    n_query = len(query_dirs)
+
+    # matrices with the vertices as columns, and their inverses
+    tri_mats = numpy.transpose(verts[triangles], (0,2,1))
+    dets = numpy.linalg.det(tri_mats)
+    ok = numpy.abs(dets) > eps # drop degenerate triangles
+    triangles = triangles[ok]
+    inv_mats = numpy.linalg.inv(tri_mats[ok])
+
+    # a direction inside a triangle is no farther from its centroid
+    # than the farthest vertex
+    centroids = as_unit_vectors(numpy.sum(verts[triangles], axis=1))
+    radius2 = numpy.max(numpy.sum(
+        (verts[triangles]-centroids[:,numpy.newaxis,:])**2, axis=2), axis=1)
+    max_chord = numpy.sqrt(numpy.max(radius2))
+
+    tri_idx = -numpy.ones((n_query,), dtype=numpy.intp)
+    lambdas = numpy.zeros((n_query,3))
+
+    valid = numpy.all(numpy.isfinite(query_dirs), axis=1)
+    valid_idx = numpy.nonzero(valid)[0]
+    q = as_unit_vectors(query_dirs[valid_idx])
+
+    def test(query_idx, q, candidates):
+        # test each query against one candidate triangle each
+        lam = numpy.einsum('qij,qj->qi', inv_mats[candidates], q)
+        # (if a query is inside several triangles, i.e. on an edge,
+        # the last one wins)
+        inside = numpy.all(lam >= -eps, axis=1)
+        tri_idx[query_idx[inside]] = candidates[inside]
+        lambdas[query_idx[inside]] = lam[inside]
+        return inside
+
+    # first pass: triangles with the nearest centroids
+    tree = scipy.spatial.cKDTree(centroids)
+    k = min(k, len(centroids))
+    chord, candidates = tree.query(q, k=k)
+    candidates = candidates.reshape((len(q),k))
+    chord = chord.reshape((len(q),k))
+    todo = numpy.ones((len(q),), dtype=bool)
+    for j in range(k):
+        idx = numpy.nonzero(todo)[0]
+        if not len(idx):
+            break
+        found = test(valid_idx[idx], q[idx], candidates[idx,j])
+        todo[idx[found]] = False
+
+    # second pass: all triangles close enough to the remaining queries
+    idx = numpy.nonzero(todo & (chord[:,0] <= max_chord))[0]
+    chunk_size = 4096
+    for start in range(0, len(idx), chunk_size):
+        this_idx = idx[start:start+chunk_size]
+        lists = tree.query_ball_point(q[this_idx], r=max_chord)
+        counts = numpy.array([len(l) for l in lists], dtype=numpy.intp)
+        if not numpy.sum(counts):
+            continue
+        pair_q = numpy.repeat(this_idx, counts)
+        pair_t = numpy.concatenate([l for l in lists if len(l)]).astype(numpy.intp)
+        close = numpy.sum((q[pair_q]-centroids[pair_t])**2, axis=1) <= radius2[pair_t]
+        test(valid_idx[pair_q[close]], q[pair_q[close]], pair_t[close])
+
+    inside = tri_idx >= 0
+    rows = numpy.repeat(numpy.nonzero(inside)[0], 3)
+    cols = triangles[tri_idx[inside]].ravel()
+    lam = lambdas[inside]
+    lam = lam/numpy.sum(lam, axis=1)[:,numpy.newaxis]
+    weights = scipy.sparse.csr_matrix((lam.ravel(), (rows, cols)),
+                                      shape=(n_query, n_verts))
+    return weights, inside
+
+class SphericalInterpolator:
+    """map per-receptor fields to a fixed set of view directions
+
+    query_dirs has shape (...,3). Calling the interpolator with a
+    field of shape (N,) or (N,F) returns an array of shape (...) or
+    (...,F), which is NaN for directions outside the triangulation.
+    """
+    def __init__(self, receptor_dirs, triangles, query_dirs, **kwargs):
+        query_dirs = numpy.asarray(query_dirs, dtype=numpy.float64)
+        self.query_shape = query_dirs.shape[:-1]
+        self.weights, self.inside = barycentric_weight_matrix(
+            receptor_dirs, triangles, query_dirs.reshape((-1,3)), **kwargs)
+
+    def __call__(self, field):
+        field = numpy.asarray(field, dtype=numpy.float64)
+        if field.shape[0] != self.weights.shape[1]:
+            raise ValueError('expected a field with %d values'%(
+                self.weights.shape[1],))
+        result = self.weights.dot(field)
+        result[~self.inside] = numpy.nan
+        return result.reshape(self.query_shape+field.shape[1:])
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Receptor acceptance functions and weight matrix construction
+
+A kernel gives the angular sensitivity of every receptor. It is
+evaluated on whole arrays of receptor-direction pairs at once::
+
+    weights = kernel(receptor_idx, zeta, x, y)
+
+where receptor_idx selects the receptor (for per-receptor parameters)
+and zeta is the angle between the receptor direction and the sample
+direction. x and y are the same offset in the receptor's local
+tangent plane, along the east and north directions of
+coords.tangent_basis (azimuthal equidistant coordinates, so that
+zeta**2 == x**2 + y**2). All angles are in radians. kernel.support()
+gives the angle beyond which the weight of each receptor is
+negligible.
+
+make_weight_matrix() builds the sparse (n_receptors, 6*res*res) cube
+map weight matrix of any kernel by evaluating it only on the pixels
+within the support of each receptor::
+
+    kernel = GaussianKernel(delta_rho)
+    weights = make_weight_matrix(receptor_dirs, kernel, res=64)
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.sparse
+import scipy.spatial
+import scipy.special
+
+from coords import normalize_dirs, tangent_basis
+
+cube_order = ['posx','negx','posy','negy','posz','negz'] # as in util.py
+
+FOUR_LN2 = 4*numpy.log(2.0)
+
+def _per_receptor(param, receptor_idx):
+    param = numpy.asarray(param, dtype=numpy.float64)
+    if param.ndim == 0:
+        return param
+    return param[receptor_idx]
+
+class Kernel:
+    """base class of the acceptance functions"""
+    def __call__(self, receptor_idx, zeta, x, y):
+        raise NotImplementedError('abstract method')
+
+    def support(self):
+        """return the support radius (scalar or per receptor) in radians"""
+        raise NotImplementedError('abstract method')
+
+class GaussianKernel(Kernel):
+    """isotropic Gaussian with full width at half maximum delta_rho
+
+    From Snyder (1979) as cited in Burton & Laughlin (2003). This is
+    the acceptance function used for the precomputed weight matrix.
+    delta_rho is a scalar or one value per receptor. The support
+    extends to where the kernel has decayed to cutoff.
+    """
+    def __init__(self, delta_rho, cutoff=1e-12):
+        self.delta_rho = numpy.asarray(delta_rho, dtype=numpy.float64)
+        self.cutoff = cutoff
+
+    def __call__(self, receptor_idx, zeta, x, y):
+        delta_rho = _per_receptor(self.delta_rho, receptor_idx)
+        return numpy.exp(-FOUR_LN2*zeta**2/delta_rho**2)
+
+    def support(self):
+        return self.delta_rho*numpy.sqrt(-numpy.log(self.cutoff)/FOUR_LN2)
+
+class AiryKernel(Kernel):
+    """Airy disc (diffraction by a circular lens) with FWHM delta_rho
+
+    The intensity (2*J1(u)/u)**2 is scaled so that its full width at
+    half maximum is delta_rho. The support includes n_rings rings.
+    """
+    HALF_MAX_U = 1.6163399 # (2*J1(u)/u)**2 == 0.5
+    def __init__(self, delta_rho, n_rings=3):
+        self.delta_rho = numpy.asarray(delta_rho, dtype=numpy.float64)
+        self.n_rings = n_rings
+
+    def __call__(self, receptor_idx, zeta, x, y):
+        delta_rho = _per_receptor(self.delta_rho, receptor_idx)
+        u = (2*self.HALF_MAX_U/delta_rho)*zeta
+        u = numpy.where(u==0, 1e-300, u)
+        return (2*scipy.special.j1(u)/u)**2
+
+    def support(self):
+        # the n-th ring ends at the (n+1)-th zero of J1
+        last_zero = scipy.special.jn_zeros(1, self.n_rings+1)[-1]
+        return last_zero*self.delta_rho/(2*self.HALF_MAX_U)
+
+class EllipticalGaussianKernel(Kernel):
+    """anisotropic Gaussian with separate horizontal and vertical widths
+
+    delta_rho_h and delta_rho_v are the full widths at half maximum
+    along the local east (horizontal) and north (vertical) directions.
+    The ellipse is rotated by orientation (radians, from east towards
+    north). All parameters are scalars or one value per receptor.
+    """
+    def __init__(self, delta_rho_h, delta_rho_v, orientation=0.0, cutoff=1e-12):
+        self.delta_rho_h = numpy.asarray(delta_rho_h, dtype=numpy.float64)
+        self.delta_rho_v = numpy.asarray(delta_rho_v, dtype=numpy.float64)
+        self.orientation = numpy.asarray(orientation, dtype=numpy.float64)
+        self.cutoff = cutoff
+
+    def __call__(self, receptor_idx, zeta, x, y):
+        delta_rho_h = _per_receptor(self.delta_rho_h, receptor_idx)
+        delta_rho_v = _per_receptor(self.delta_rho_v, receptor_idx)
+        orientation = _per_receptor(self.orientation, receptor_idx)
+        cos = numpy.cos(orientation)
+        sin = numpy.sin(orientation)
+        u = cos*x + sin*y
+        v = -sin*x + cos*y
+        return numpy.exp(-FOUR_LN2*((u/delta_rho_h)**2 + (v/delta_rho_v)**2))
+
+    def support(self):
+        widest = numpy.maximum(self.delta_rho_h, self.delta_rho_v)
+        return widest*numpy.sqrt(-numpy.log(self.cutoff)/FOUR_LN2)
+
+class TabulatedKernel(Kernel):
+    """radially symmetric kernel from a measured angular sensitivity
+
+    angles (increasing, radians) gives where the sensitivity was
+    measured, values the sensitivity there, either one profile of
+    shape (n_angles,) for all receptors or one per receptor of shape
+    (n_receptors, n_angles). The sensitivity is interpolated linearly
+    and is zero beyond the last angle.
+    """
+    def __init__(self, angles, values):
+        self.angles = numpy.asarray(angles, dtype=numpy.float64)
+        self.values = numpy.asarray(values, dtype=numpy.float64)
+        if self.angles.ndim != 1 or self.values.shape[-1] != len(self.angles):
+            raise ValueError('values must have the same last dimension as angles')
+        if numpy.any(numpy.diff(self.angles) <= 0):
+            raise ValueError('angles must be increasing')
+
+    def __call__(self, receptor_idx, zeta, x, y):
+        angles = self.angles
+        i = numpy.clip(numpy.searchsorted(angles, zeta), 1, len(angles)-1)
+        frac = (zeta-angles[i-1])/(angles[i]-angles[i-1])
+        if self.values.ndim == 1:
+            lo = self.values[i-1]
+            hi = self.values[i]
+        else:
+            lo = self.values[receptor_idx, i-1]
+            hi = self.values[receptor_idx, i]
+        result = lo + numpy.clip(frac, 0.0, 1.0)*(hi-lo)
+        return numpy.where(zeta > angles[-1], 0.0, result)
+
+    def support(self):
+        return self.angles[-1]
+
+###########################################################
+
+def cube_pixel_dirs(res):
+    """return the unit direction of every cube map pixel, (6,res,res,3)
+
+    The faces are in cube_order and the pixels are laid out as in the
+    weight maps of util.make_receptor_sensitivities, so that
+    cube_pixel_dirs(res).reshape((-1,3)) matches flattened cube maps.
+    """
+    half_res = res//2
+    vals = (numpy.arange(res)-half_res)/half_res
+    # on the +x face, row i has z=vals[i] and column j has y=vals[res-1-j]
+    z, y = numpy.meshgrid(vals, vals[::-1], indexing='ij')
+    one = numpy.ones_like(z)
+    faces = {'posx':(one, y, z),
+             'negx':(-one, -y, z),
+             'posy':(-y, one, z),
+             'negy':(y, -one, z),
+             'posz':(-z, y, one),
+             'negz':(z, y, -one),
+             }
+    dirs = numpy.array([numpy.stack(faces[name], axis=-1) for name in cube_order])
+    return normalize_dirs(dirs, out=dirs)
+
+def get_pair_geometry(receptor_dirs, sample_dirs, basis=None):
+    """return (zeta, x, y) of pairs of receptor and sample directions
+
+    receptor_dirs and sample_dirs are unit vectors of the same shape
+    (...,3), see the module docstring for the meaning of the results.
+    basis optionally gives the (east, north) tangent vectors of the
+    receptors (of the same shape) to use instead of
+    coords.tangent_basis, e.g. the rotated basis of rotated receptors.
+    """
+    if basis is None:
+        east, north = tangent_basis(receptor_dirs)
+    else:
+        east, north = basis
+    cos_zeta = numpy.sum(receptor_dirs*sample_dirs, axis=-1)
+    x = numpy.sum(east*sample_dirs, axis=-1)
+    y = numpy.sum(north*sample_dirs, axis=-1)
+    sin_zeta = numpy.hypot(x, y)
+    zeta = numpy.arctan2(sin_zeta, cos_zeta)
+    # scale the tangent components to angles
+    scale = numpy.where(sin_zeta > 0, zeta/numpy.where(sin_zeta > 0, sin_zeta, 1.0), 1.0)
+    return zeta, x*scale, y*scale
+
+def make_weight_matrix(receptor_dirs, kernel, res=64, clip_thresh=None,
+                       dtype=numpy.float32, basis=None):
+    """return the (n_receptors, 6*res*res) CSR cube map weight matrix
+
+    Each receptor's kernel is evaluated on the pixels within its
+    support and normalized to unit gain (the sum over all pixels, as
+    in util.make_receptor_sensitivities). Weights below clip_thresh
+    (if given) are then dropped. basis optionally gives the (east,
+    north) tangent vectors (each (n_receptors,3)) in which anisotropic
+    kernels are oriented, see get_pair_geometry.
+    """
+    receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+    n_receptors = len(receptor_dirs)
+    pixel_dirs = cube_pixel_dirs(res).reshape((-1,3))
+    n_pixels = len(pixel_dirs)
+
+    # candidate pixels: within the support radius (as chord length)
+    support = numpy.broadcast_to(kernel.support(), (n_receptors,))
+    chord = 2*numpy.sin(numpy.minimum(support, numpy.pi)/2) + 1e-12
+    tree = scipy.spatial.cKDTree(pixel_dirs)
+    candidates = tree.query_ball_point(receptor_dirs, chord)
+    counts = numpy.array([len(c) for c in candidates], dtype=numpy.intp)
+    cols = numpy.concatenate([numpy.asarray(c, dtype=numpy.intp) for c in candidates])
+    rows = numpy.repeat(numpy.arange(n_receptors), counts)
+
+    if basis is not None:
+        basis = tuple(numpy.asarray(b, dtype=numpy.float64)[rows] for b in basis)
+    zeta, x, y = get_pair_geometry(receptor_dirs[rows], pixel_dirs[cols], basis)
+    values = kernel(rows, zeta, x, y)
+
+    # normalize to unit gain
+    gain = numpy.bincount(rows, weights=values, minlength=n_receptors)
+    if numpy.any(gain <= 0):
+        raise ValueError('receptor(s) %s see no pixel'%(numpy.nonzero(gain<=0)[0],))
+    values = values/gain[rows]
+
+    if clip_thresh is not None:
+        keep = values >= clip_thresh
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+    weights = scipy.sparse.csr_matrix((values.astype(dtype), (rows, cols)),
+                                      shape=(n_receptors, n_pixels))
+    weights.sort_indices()
+    return weights
+
+def make_weight_maps(receptor_dirs, kernel, res=64, chunk_size=64):
+    """return the dense weight maps (n_receptors,6,res,res) of a kernel
+
+    Unlike make_weight_matrix, the kernel is evaluated on every pixel.
+    The receptors are processed in chunks of chunk_size to bound memory
+    use.
+    """
+    receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+    n_receptors = len(receptor_dirs)
+    pixel_dirs = cube_pixel_dirs(res).reshape((-1,3))
+    maps = numpy.empty((n_receptors, len(pixel_dirs)))
+    for start in range(0, n_receptors, chunk_size):
+        idx = numpy.arange(start, min(start+chunk_size, n_receptors))
+        zeta, x, y = get_pair_geometry(receptor_dirs[idx][:,numpy.newaxis,:],
+                                       pixel_dirs[numpy.newaxis,:,:])
+        values = kernel(idx[:,numpy.newaxis], zeta, x, y)
+        maps[idx] = values/numpy.sum(values, axis=1)[:,numpy.newaxis]
+    return maps.reshape((n_receptors,6,res,res))
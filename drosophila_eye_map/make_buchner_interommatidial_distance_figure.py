@@ -29,32 +29,57 @@
 #
 # Author: Andrew D. Straw
 from __future__ import division, print_function
+import os, itertools, importlib, multiprocessing
 import numpy as np
-import matplotlib.delaunay as dlny
 
 import precomputed_buchner71 as precomputed_buchner_1971
-from util import get_mean_interommatidial_distance, xyz2lonlat
-from mpl_toolkits.basemap import Basemap # basemap > 0.9.9.1
+from util import get_mean_interommatidial_distance
+from projections import Stereographic, Orthographic
+from interpolation import SphericalInterpolator
 
-def do_projection( proj, lon_lats, dists, xres = 120, yres = 100 ):
-    xys = np.array([proj( lon, lat ) for (lon,lat) in lon_lats ])
+def get_grid_interpolator( proj, dirs, triangles, xres = 120, yres = 100 ):
+    """return projected points, grid and interpolator to the grid
 
-    x = xys[:,0]
-    y = xys[:,1]
+    The grid spans the projected receptor directions. The interpolator
+    maps any per-receptor field onto it (on the sphere, using the
+    receptor triangles).
+    """
+    x,y = proj.project_dirs(dirs)
 
-    good = x < 1e29 # basemap seems to set bad values to 1e30
+    good = x < 1e29 # bad values are set to 1e30
     x=x[good]
     y=y[good]
-    dists=dists[good]
-
-    tri = dlny.Triangulation(x, y)
-    interp = tri.nn_interpolator(dists)
 
     X,Y = np.mgrid[ min(y):max(y):yres*1j, min(x):max(x):xres*1j]
-    vals = interp[ min(y):max(y):yres*1j, min(x):max(x):xres*1j]
+    grid_dirs = proj.inverse_dirs(Y,X) # note: Y holds x and X holds y
+    interp = SphericalInterpolator(dirs,triangles,grid_dirs)
+    return x,y,X,Y,interp
+
+def do_projection( proj, dirs, dists, triangles, xres = 120, yres = 100 ):
+    x,y,X,Y,interp = get_grid_interpolator(proj,dirs,triangles,xres=xres,yres=yres)
+    vals = interp(dists)
     Z = np.ma.masked_array(vals,mask=np.isnan(vals))
     return x,y,X,Y,Z
 
+def make_projection(name):
+    """return the projection of the figures by name ('stere' or 'ortho')"""
+    if name == 'stere':
+        return Stereographic(lat_ts = 0.0,
+                             lat_0 = 0,
+                             lon_0 = 90,
+                             llcrnrlon = -45,
+                             urcrnrlon = -135,
+                             llcrnrlat= -30,
+                             urcrnrlat = 30,
+                             )
+    elif name == 'ortho':
+        # Match projection of
+        # http://jeb.biologists.org/cgi/content/full/209/21/4339/FIG1
+        return Orthographic(lat_0=10,
+                            lon_0=20,
+                            )
+    raise ValueError('unknown projection %r'%(name,))
+
 def main():
     rdirs = precomputed_buchner_1971.receptor_dirs
     rdir_slicer = precomputed_buchner_1971.receptor_dir_slicer
@@ -64,20 +89,11 @@ def main():
     R2D = 180.0/np.pi
     dists = dists*R2D
 
-    lon_lats = [xyz2lonlat(*rdir) for rdir in rdirs[rdir_slicer['left']]]
+    left_dirs = np.asarray(rdirs[rdir_slicer['left']])
 
-    stere = Basemap(projection='stere',
-                    resolution=None,
-                    lat_ts = 0.0,
-                    lat_0 = 0,
-                    lon_0 = 90,
-                    llcrnrlon = -45,
-                    urcrnrlon = -135,
-                    llcrnrlat= -30,
-                    urcrnrlat = 30,
-                    )
+    stere = make_projection('stere')
 
-    x,y,X,Y,Z = do_projection(stere,lon_lats,dists)
+    x,y,X,Y,Z = do_projection(stere,left_dirs,dists,triangles)
 
     import matplotlib
     rcParams = matplotlib.rcParams
@@ -170,15 +186,9 @@ def main():
     # contour figure -- orthographic projection
     fig2 = plt.figure(2)
 
-    # Match projection of
-    # http://jeb.biologists.org/cgi/content/full/209/21/4339/FIG1
-    ortho = Basemap(projection='ortho',
-                    lat_0=10,
-                    lon_0=20,
-                    resolution=None,
-                    )
+    ortho = make_projection('ortho')
 
-    x,y,X,Y,Z = do_projection(ortho,lon_lats,dists,xres=500,yres=500)
+    x,y,X,Y,Z = do_projection(ortho,left_dirs,dists,triangles,xres=500,yres=500)
 
     ax = plt.subplot(1,1,1)
     CS = plt.contour(Y,X,Z,
@@ -219,5 +229,141 @@ def main():
 
     plt.show()
 
+## batch mode ###################
+
+# Per-process cache, so that consecutive jobs of a worker only redo
+# the drawing. Keys are dataset names or (dataset, projection,
+# resolution) tuples.
+_worker_cache = {}
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def get_dataset(dataset):
+    """return left eye directions, triangles and mean interommatidial
+    distances (deg)"""
+    if dataset not in _worker_cache:
+        precomputed = importlib.import_module(dataset)
+        rdirs = precomputed.receptor_dirs
+        rdir_slicer = precomputed.receptor_dir_slicer
+        triangles = precomputed.triangles
+        left_rdirs = rdirs[rdir_slicer['left']]
+        dists = np.array(get_mean_interommatidial_distance(
+            left_rdirs, triangles ))
+        _worker_cache[dataset] = (np.asarray(left_rdirs), triangles,
+                                  dists*180.0/np.pi)
+    return _worker_cache[dataset]
+
+def get_projected(dataset, projection, resolution):
+    """return the projection and its projected, interpolated grid"""
+    key = dataset, projection, resolution
+    if key not in _worker_cache:
+        left_dirs, triangles, dists = get_dataset(dataset)
+        proj = make_projection(projection)
+        xres, yres = resolution
+        x,y,X,Y,interp = get_grid_interpolator(proj,left_dirs,triangles,
+                                               xres=xres,yres=yres)
+        vals = interp(dists)
+        Z = np.ma.masked_array(vals,mask=np.isnan(vals))
+        _worker_cache[key] = proj, (x,y,X,Y,Z)
+    return _worker_cache[key]
+
+def render_job(job, outdir='.', formats=('png',)):
+    """render one (dataset, projection, resolution, colormap) job
+
+    resolution is a (xres, yres) tuple. Returns the saved filenames.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dataset, projection, resolution, cmap = job
+    proj, (x,y,X,Y,Z) = get_projected(dataset, projection, tuple(resolution))
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1,1,1)
+    mappable = ax.pcolormesh(Y,X,Z,shading='nearest',cmap=cmap)
+    ax.plot(x,y,'wo',ms=4.0)
+
+    if projection == 'ortho':
+        delat = delon = 10.
+    else:
+        delat, delon = 20., 45.
+    circles = np.arange(0.,90.,delat).tolist()+\
+              np.arange(-delat,-90,-delat).tolist()
+    proj.drawparallels(circles,ax=ax)
+    proj.drawmeridians(np.arange(-180,180,delon),ax=ax)
+    if projection == 'ortho':
+        proj.drawmapboundary(ax=ax)
+    cbar = fig.colorbar(mappable,ax=ax)
+    cbar.ax.set_ylabel('mean inter-ommatidial distance (deg)')
+
+    base = 'interommatidial_distance_%s_%s_%dx%d_%s'%(
+        dataset, projection, resolution[0], resolution[1], cmap)
+    fnames = []
+    for fmt in formats:
+        fname = os.path.join(outdir, base+'.'+fmt)
+        fig.savefig(fname)
+        fnames.append(fname)
+    return fnames
+
+def _render_job_star(args):
+    return render_job(*args)
+
+def render_batch(jobs, outdir='.', formats=('png',), processes=None):
+    """render many jobs headless in a process pool
+
+    Jobs are sorted so that jobs sharing the same dataset, projection
+    and resolution tend to go to the same worker and reuse its cached
+    projection and interpolation. Returns the saved filenames.
+    """
+    jobs = sorted(jobs)
+    args = [(job, outdir, formats) for job in jobs]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        chunksize = max(1, len(args)//processes)
+        results = pool.map(_render_job_star, args, chunksize=chunksize)
+    finally:
+        pool.close()
+        pool.join()
+    return [fname for fnames in results for fname in fnames]
+
+def get_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='plot the interommatidial distance figure, or render '
+        'it in batch')
+    parser.add_argument('--batch', action='store_true', default=False,
+                        help='render figures to files instead of showing one')
+    batch = parser.add_argument_group('batch options (with --batch)')
+    batch.add_argument('--datasets', nargs='+',
+                       default=['precomputed_buchner71'],
+                       help='names of precomputed eye map modules')
+    batch.add_argument('--projections', nargs='+', default=['stere','ortho'],
+                       choices=['stere','ortho'])
+    batch.add_argument('--resolutions', nargs='+', default=['120x100'],
+                       help='interpolation grid sizes as XRESxYRES')
+    batch.add_argument('--cmaps', nargs='+', default=['jet_r'])
+    batch.add_argument('--formats', nargs='+', default=['png'])
+    batch.add_argument('--outdir', default='.')
+    batch.add_argument('--processes', type=int, default=None)
+    return parser
+
+def batch_main(args):
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions]
+    jobs = list(itertools.product(args.datasets, args.projections,
+                                  resolutions, args.cmaps))
+    fnames = render_batch(jobs, outdir=args.outdir, formats=args.formats,
+                          processes=args.processes)
+    for fname in fnames:
+        print('saved',fname)
+
 if __name__ == '__main__':
-    main()
+    args = get_parser().parse_args()
+    if args.batch:
+        batch_main(args)
+    else:
+        main()
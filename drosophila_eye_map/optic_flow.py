@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Analytic optic flow at every receptor for batches of self-motion states
+
+For a head translating with velocity v and rotating with angular
+velocity omega (both in head, i.e. receptor_dirs, coordinates), the
+image of a point at distance D in unit direction d moves with
+
+    d' = -omega x d - (v - (v.d) d)/D
+
+(Koenderink & van Doorn, 1987). OpticFlow precomputes the tangent
+basis of every receptor (east and north, see coords.tangent_basis) and
+evaluates the flow of whole trajectories as two matrix products::
+
+    flow = OpticFlow(receptor_dirs)
+    uv = flow.flow(translation=v, rotation=omega, distances=D) # (T,n,2)
+
+uv[...,0] is the flow towards the east (increasing longitude) and
+uv[...,1] towards the north, in radians per unit of time of the
+velocities.
+"""
+from __future__ import division, print_function
+
+import numpy
+
+from coords import normalize_dirs, tangent_basis
+
+class OpticFlow:
+    """optic flow in the tangent frame of every receptor"""
+    def __init__(self, receptor_dirs, dtype=numpy.float64):
+        self.receptor_dirs = normalize_dirs(receptor_dirs, dtype=dtype)
+        self.n_receptors = len(self.receptor_dirs)
+        self.dtype = self.receptor_dirs.dtype
+        east, north = tangent_basis(self.receptor_dirs)
+        # the translational flow is the component of -v/D along east
+        # and north (both are orthogonal to d). For the rotation,
+        # -(omega x d).e = -omega.(d x e) with d x east == north and
+        # d x north == -east.
+        # Both are stored as (3,n*2) matrices, so that the flow of T
+        # states is one (T,3)x(3,n*2) product, already in (T,n,2) order.
+        self.translation_basis = -numpy.stack([east, north], axis=1).reshape((-1,3)).T
+        self.rotation_basis = numpy.stack([-north, east], axis=1).reshape((-1,3)).T
+
+    def _as_velocities(self, velocities):
+        velocities = numpy.asarray(velocities, dtype=self.dtype)
+        if velocities.shape[-1] != 3:
+            raise ValueError('velocities must have a last dimension of length 3')
+        return velocities.reshape((-1,3))
+
+    def flow(self, translation=None, rotation=None, distances=1.0):
+        """return the flow (T,n_receptors,2) for T self-motion states
+
+        translation and rotation are arrays of shape (T,3) or (3,), or
+        None for no translation or rotation. distances are the
+        distances of the objects seen by the receptors, broadcastable
+        to (T,n_receptors), e.g. a scalar, one value per receptor or
+        one per state and receptor. Infinite distances give no
+        translational flow.
+        """
+        if translation is None and rotation is None:
+            raise ValueError('need translation and/or rotation')
+        n_states = max(len(self._as_velocities(x)) for x in (translation,rotation)
+                       if x is not None)
+        result = None
+        if translation is not None:
+            with numpy.errstate(divide='ignore'):
+                nearness = 1.0/numpy.asarray(distances, dtype=self.dtype)
+            if nearness.ndim == 2:
+                n_states = max(n_states, len(nearness))
+            nearness = numpy.broadcast_to(nearness, (n_states,self.n_receptors))
+            v = numpy.broadcast_to(self._as_velocities(translation), (n_states,3))
+            result = numpy.dot(v, self.translation_basis).reshape(
+                (len(v),self.n_receptors,2))
+            result *= nearness[:,:,numpy.newaxis]
+        if rotation is not None:
+            omega = numpy.broadcast_to(self._as_velocities(rotation), (n_states,3))
+            rot = numpy.dot(omega, self.rotation_basis).reshape(
+                (len(omega),self.n_receptors,2))
+            if result is None:
+                result = rot
+            else:
+                result += rot
+        return result
+
+    def to_vectors(self, uv):
+        """return flow (...,n_receptors,2) as 3D vectors (...,n_receptors,3)"""
+        uv = numpy.asarray(uv)
+        basis = -self.translation_basis.T.reshape((self.n_receptors,2,3))
+        return (uv[...,0:1]*basis[:,0,:] + uv[...,1:2]*basis[:,1,:])
+
+def get_optic_flow(receptor_dirs, translation=None, rotation=None, distances=1.0):
+    """return the flow (T,n_receptors,2) of receptor_dirs, see OpticFlow.flow"""
+    return OpticFlow(receptor_dirs).flow(translation=translation,
+                                         rotation=rotation,
+                                         distances=distances)
@@ -29,25 +29,28 @@
 #
 # Author: Andrew D. Straw
 
-# This function copied from util.py.
+# This function copied from util.py and receptor_graph.py.
 def get_mean_interommatidial_distance(receptor_dirs, triangles):
     """returns values in radians"""
-    # this is not efficient...
-    mean_thetas = []
-    for iv, v in enumerate(receptor_dirs):
-        neighbors = set()
-        for tri in triangles:
-            if iv in tri:
-                for it in tri:
-                    neighbors.add(it)
-        neighbors = list(neighbors)
-        neighbors.remove(iv)
-        neighbor_dirs = [receptor_dirs[int(n)] for n in neighbors]
-        cos_theta_neighbors = [numpy.dot(n, v) for n in neighbor_dirs]
-        theta_neighbors = [numpy.arccos(c) for c in cos_theta_neighbors]
-        mean_theta = numpy.mean(theta_neighbors)
-        mean_thetas.append(mean_theta)
-    return mean_thetas
+    n_receptors = len(receptor_dirs)
+    triangles = numpy.asarray(triangles, dtype=numpy.intp).reshape((-1,3))
+    valid = numpy.all((triangles >= 0) & (triangles < n_receptors), axis=1)
+    triangles = triangles[valid]
+    pairs = numpy.concatenate([triangles[:,[0,1]],
+                               triangles[:,[1,2]],
+                               triangles[:,[2,0]]])
+    pairs.sort(axis=1)
+    edges = numpy.unique(pairs, axis=0)
+    dirs = numpy.asarray(receptor_dirs, dtype=numpy.float64)
+    dirs = dirs/numpy.sqrt(numpy.sum(dirs**2, axis=1))[:,numpy.newaxis]
+    a = dirs[edges[:,0]]
+    b = dirs[edges[:,1]]
+    angles = numpy.arctan2(numpy.sqrt(numpy.sum(numpy.cross(a,b)**2, axis=1)),
+                           numpy.sum(a*b, axis=1))
+    sums = numpy.bincount(edges.ravel(), weights=numpy.repeat(angles, 2),
+                          minlength=n_receptors)
+    counts = numpy.bincount(edges.ravel(), minlength=n_receptors)
+    return sums/counts
 
 if __name__ == '__main__':
 
@@ -70,6 +73,38 @@ if __name__ == '__main__':
     if 1:
         import vtk
         from vtk.util.colors import red, purple, banana
+        from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+
+        if vtk.vtkIdTypeArray().GetDataTypeSize() == 4:
+            vtk_id_dtype = numpy.int32
+        else:
+            vtk_id_dtype = numpy.int64
+
+        def make_vtk_points(verts):
+            """make vtkPoints from an (N,3) array in a single copy"""
+            verts = numpy.ascontiguousarray(verts, dtype=numpy.float64)
+            points = vtk.vtkPoints()
+            points.SetData(numpy_to_vtk(verts, deep=True))
+            return points
+
+        def make_vtk_cells(cells):
+            """make a vtkCellArray from a sequence of point id sequences"""
+            counts = numpy.array([len(c) for c in cells], dtype=vtk_id_dtype)
+            # legacy layout: n_0, id_0_0, ..., id_0_n0, n_1, id_1_0, ...
+            flat = numpy.empty((len(counts)+numpy.sum(counts),), dtype=vtk_id_dtype)
+            starts = numpy.cumsum(counts+1)-(counts+1)
+            is_count = numpy.zeros(flat.shape, dtype=bool)
+            is_count[starts] = True
+            flat[is_count] = counts
+            flat[~is_count] = numpy.concatenate([numpy.asarray(c, dtype=vtk_id_dtype)
+                                                 for c in cells])
+            cell_array = vtk.vtkCellArray()
+            legacy = numpy_to_vtkIdTypeArray(flat, deep=True)
+            if hasattr(cell_array, 'ImportLegacyFormat'): # VTK >= 9
+                cell_array.ImportLegacyFormat(legacy)
+            else:
+                cell_array.SetCells(len(counts), legacy)
+            return cell_array
 
         def init_vtk():
 
@@ -124,50 +159,49 @@ if __name__ == '__main__':
             dists = get_mean_interommatidial_distance(receptor_dirs, triangles)
             pi = 3.1415926535897931
             R2D = 180.0/pi
-            for v, dist in zip(receptor_dirs, dists):
-                atext = vtk.vtkVectorText()
-                atext.SetText("%.1f"%(dist*R2D,))
-                textMapper = vtk.vtkPolyDataMapper()
-                textMapper.SetInputConnection(atext.GetOutputPort())
-                textActor = vtk.vtkFollower()
-                textActor.SetMapper(textMapper)
-                scale = 0.03
-                textActor.SetScale(scale, scale, scale)
-                mult = 1.02
-                textActor.AddPosition(v.x*mult, v.y*mult, v.z*mult)
-                for renderer in renderers:
-                    renderer.AddActor(textActor)
+            mult = 1.02
+
+            # All labels are drawn by a single label placement mapper
+            # from one point set, rather than an actor per label.
+            label_data = vtk.vtkPolyData()
+            label_data.SetPoints(make_vtk_points(numpy.asarray(receptor_dirs)*mult))
+            labels = vtk.vtkStringArray()
+            labels.SetName('iod')
+            labels.SetNumberOfValues(len(dists))
+            for i, dist in enumerate(dists):
+                labels.SetValue(i, "%.1f"%(dist*R2D,))
+            label_data.GetPointData().AddArray(labels)
+
+            for renderer in renderers:
+                # only label points that are not hidden behind the eye
+                visible = vtk.vtkSelectVisiblePoints()
+                visible.SetInputData(label_data)
+                visible.SetRenderer(renderer)
+
+                hierarchy = vtk.vtkPointSetToLabelHierarchy()
+                hierarchy.SetInputConnection(visible.GetOutputPort())
+                hierarchy.SetLabelArrayName('iod')
+                hierarchy.GetTextProperty().SetFontSize(10)
+                hierarchy.GetTextProperty().SetColor(1.0, 1.0, 1.0)
+
+                labelMapper = vtk.vtkLabelPlacementMapper()
+                labelMapper.SetInputConnection(hierarchy.GetOutputPort())
+
+                labelActor = vtk.vtkActor2D()
+                labelActor.SetMapper(labelMapper)
+                renderer.AddActor(labelActor)
 
 
         def vtk_draw(receptor_dirs, triangles, hex_faces, renderers):
-            tri_points = vtk.vtkPoints()
-            tri_cells = vtk.vtkCellArray()
-
-            body_line_points = vtk.vtkPoints()
-            body_lines = vtk.vtkCellArray()
-            body_point_num = 0
+            tri_points = make_vtk_points(numpy.asarray(receptor_dirs))
+            tri_cells = make_vtk_cells(numpy.asarray(triangles))
 
-            for v in receptor_dirs:
-                #if v.z > 0:
-                if 1:
-                    tri_points.InsertNextPoint(v.x, v.y, v.z)
-
-            for tri in triangles:
-                tri_cells.InsertNextCell(3)
-                tri_cells.InsertCellPoint(tri[0])
-                tri_cells.InsertCellPoint(tri[1])
-                tri_cells.InsertCellPoint(tri[2])
-
-            for face in hex_faces:
-                body_lines.InsertNextCell(len(face)+1)
-                for v in face:
-                    body_line_points.InsertNextPoint(v.x, v.y, v.z)
-                    body_lines.InsertCellPoint(body_point_num)
-                    body_point_num += 1
-                v = face[0] # connect to beginning
-                body_line_points.InsertNextPoint(v.x, v.y, v.z)
-                body_lines.InsertCellPoint(body_point_num)
-                body_point_num += 1
+            # each hex face is a closed polyline with its own points
+            closed_faces = [numpy.asarray(list(face)+[face[0]]) for face in hex_faces]
+            body_line_points = make_vtk_points(numpy.concatenate(closed_faces))
+            n_face_points = numpy.cumsum([0]+[len(face) for face in closed_faces])
+            body_lines = make_vtk_cells([numpy.arange(start, stop) for start, stop
+                                         in zip(n_face_points[:-1], n_face_points[1:])])
 
             if 1:
                 profileData = vtk.vtkPolyData()
@@ -185,6 +219,7 @@ if __name__ == '__main__':
 
                 for renderer in renderers:
                     renderer.AddActor(profile)
+                surface = profileData, profileMapper
             else:
                 points_poly_data = vtk.vtkPolyData()
                 points_poly_data.SetPoints(tri_points)
@@ -210,6 +245,7 @@ if __name__ == '__main__':
 
                 for renderer in renderers:
                     renderer.AddActor(headGlyphActor)
+                surface = points_poly_data, head_glyph_mapper
 
             if 1:
                 profileData = vtk.vtkPolyData()
@@ -238,9 +274,125 @@ if __name__ == '__main__':
                 for renderer in renderers:
                     renderer.AddActor(profile)
 
+            # the receptor surface, to be coloured by set_receptor_colors()
+            return surface
+
+        def set_receptor_colors(surface, values, scalar_range=None):
+            """colour the receptor surface by one value per receptor
+
+            The scalar array is created on the first call and its
+            values are overwritten in place afterwards, so that the
+            same pipeline renders every frame.
+            """
+            poly_data, mapper = surface
+            values = numpy.asarray(values, dtype=numpy.float32)
+            scalars = poly_data.GetPointData().GetScalars()
+            if scalars is None:
+                # keep a reference to the buffer, VTK only holds a pointer to it
+                surface_buffers[id(poly_data)] = buf = values.copy()
+                poly_data.GetPointData().SetScalars(numpy_to_vtk(buf, deep=False))
+                mapper.SetLookupTable(vtk.vtkLookupTable())
+                mapper.ScalarVisibilityOn()
+            else:
+                surface_buffers[id(poly_data)][:] = values
+                scalars.Modified()
+            if scalar_range is None:
+                scalar_range = numpy.min(values), numpy.max(values)
+            mapper.SetScalarRange(float(scalar_range[0]), float(scalar_range[1]))
+            poly_data.Modified()
+
+        surface_buffers = {}
+
+        def render_offscreen(renWin, renderers, outdir, n_orbit=1,
+                             receptor_colors=None, surface=None,
+                             fname_pattern='frame%04d.png'):
+            """render frames to image files without opening a window
+
+            If receptor_colors (shape n_frames x n_receptors) is given,
+            frame i colours the receptors with receptor_colors[i], all
+            frames on the same colour scale. The camera is rotated by
+            360/n_orbit degrees about the view up vector between
+            frames. Without colours, n_orbit frames of one full orbit
+            are written.
+            """
+            import os
+            if not os.path.exists(outdir):
+                os.makedirs(outdir)
+
+            if receptor_colors is not None:
+                receptor_colors = numpy.asarray(receptor_colors)
+                if receptor_colors.ndim == 1:
+                    receptor_colors = receptor_colors[numpy.newaxis,:]
+                if surface is None:
+                    raise ValueError('receptor_colors given, but no surface to colour')
+                n_frames = len(receptor_colors)
+                scalar_range = (numpy.nanmin(receptor_colors),
+                                numpy.nanmax(receptor_colors))
+            else:
+                n_frames = n_orbit
+            azimuth_step = 360.0/n_orbit
+
+            renWin.SetOffScreenRendering(1)
+
+            # one image grabber and writer for all frames
+            w2i = vtk.vtkWindowToImageFilter()
+            w2i.SetInput(renWin)
+            w2i.ReadFrontBufferOff()
+            writer = vtk.vtkPNGWriter()
+            writer.SetInputConnection(w2i.GetOutputPort())
+
+            fnames = []
+            for i in range(n_frames):
+                if receptor_colors is not None:
+                    set_receptor_colors(surface, receptor_colors[i], scalar_range)
+                if i > 0:
+                    for renderer in renderers:
+                        renderer.GetActiveCamera().Azimuth(azimuth_step)
+                        renderer.ResetCameraClippingRange()
+                renWin.Render()
+                w2i.Modified()
+                fname = os.path.join(outdir, fname_pattern%i)
+                writer.SetFileName(fname)
+                writer.Write()
+                fnames.append(fname)
+            return fnames
+
+        import argparse
+        parser = argparse.ArgumentParser(
+            description='show the receptor map in 3D or render it to image files')
+        parser.add_argument('--offscreen', metavar='OUTDIR', default=None,
+                            help='render PNG frames into OUTDIR without '
+                            'opening a window (works on headless machines '
+                            'with an offscreen capable VTK build)')
+        parser.add_argument('--orbit', type=int, default=1, metavar='N',
+                            help='rotate the camera by 360/N degrees between '
+                            'frames (N frames if no --colors)')
+        parser.add_argument('--colors', default=None, metavar='FILE.npy',
+                            help='array of shape (n_frames, n_receptors) '
+                            'giving one colouring of the receptors per frame')
+        parser.add_argument('--size', default='1024x768', metavar='WxH',
+                            help='image size for --offscreen')
+        parser.add_argument('--no-labels', action='store_true', default=False,
+                            help='do not label the interommatidial distances')
+        args = parser.parse_args()
+
+        surface = None
         try:
-            vtk_draw(receptor_dirs, triangles, hex_faces, renderers)
+            surface = vtk_draw(receptor_dirs, triangles, hex_faces, renderers)
         except NameError as err:
             print('this script is meant to be embedded into precomputed_buchner71.py, not run standalone', file=sys.stderr)
-        vtk_label_iod(receptor_dirs, triangles, renderers)
-        interact_with_renWin(renWin, renderers)
+        if not args.no_labels:
+            vtk_label_iod(receptor_dirs, triangles, renderers)
+        if args.offscreen is None:
+            interact_with_renWin(renWin, renderers)
+        else:
+            width, height = map(int, args.size.split('x'))
+            renWin.SetSize(width, height)
+            receptor_colors = None
+            if args.colors is not None:
+                receptor_colors = numpy.load(args.colors)
+            fnames = render_offscreen(renWin, renderers, args.offscreen,
+                                      n_orbit=args.orbit,
+                                      receptor_colors=receptor_colors,
+                                      surface=surface)
+            print('saved %d frames to %s'%(len(fnames), args.offscreen))
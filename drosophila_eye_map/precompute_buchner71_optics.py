@@ -42,9 +42,14 @@ import numpy
 import scipy.sparse
 array=numpy.array
 from matplotlib import delaunay
-from util import get_mean_interommatidial_distance, flatten_cubemap, \
-     make_receptor_sensitivities,  make_repr_able, save_as_python, cube_order
-import sys, os, csv
+from util import make_repr_able, save_as_python, cube_order, \
+     sparsify_weights, get_ellpack
+from kernels import GaussianKernel, make_weight_matrix
+from sample_table import make_sample_table
+from receptor_graph import get_adjacency, mean_neighbor_angle
+from coords import get_rot_mat, long_lat2xyz, LongLatRotator, \
+     xform_stereographic_2_long_lat
+import os, csv, argparse
 
 # These data are the coordinates of the ommatidial axes as
 # hand-clicked on the Heisenberg/Buchner figure. See the
@@ -519,75 +524,6 @@ y= array([  7.43281164e-01,   5.76640362e-01,   4.37773027e-01,
         -1.72048897e+00,  -1.04403846e+00,  -1.10596702e+00])
 
 
-###########################################################
-
-def get_rot_mat(theta,x,y,z):
-    # see http://en.wikipedia.org/wiki/Rotation_matrix
-    cos = numpy.cos(theta)
-    sin = numpy.sin(theta)
-    M = numpy.array([[cos+(1-cos)*x**2, (1-cos)*x*y+sin*z, (1-cos)*x*z-sin*y],
-                     [(1-cos)*y*x-sin*z, cos+(1-cos)*y**2, (1-cos)*y*z+sin*x],
-                     [(1-cos)*z*x+sin*y, (1-cos)*z*y-sin*x, cos+(1-cos)*z**2]])
-    return M
-def long_lat2xyz(long,lat,R=1.0):
-    sin,cos,pi = numpy.sin, numpy.cos, numpy.pi
-
-    colat = pi/2 - lat
-
-    x3 = R*sin(colat)*cos(long)
-    y3 = R*sin(colat)*sin(long)
-    z3 = R*cos(colat)
-    return x3,y3,z3
-
-def xyz2long_lat(xn,yn,zn):
-    rho = numpy.sqrt( xn**2 + yn**2 + zn**2 )
-    longn = numpy.arctan2(yn,xn)
-    colatn = numpy.arctan2( numpy.sqrt(xn**2 + yn**2), zn )
-
-    latn = numpy.pi/2-colatn
-    return longn, latn, rho
-
-class LongLatRotator:
-    def __init__(self,rotmatrix):
-        self.rotmatrix = rotmatrix
-    def __call__(self,long,lat,R=1.0):
-        x3,y3,z3 = long_lat2xyz(long,lat,R)
-
-        # next, transform to new 3D cartesian
-        M = self.rotmatrix
-        xn = M[0,0]*x3 + M[0,1]*y3 + M[0,2]*z3
-        yn = M[1,0]*x3 + M[1,1]*y3 + M[1,2]*z3
-        zn = M[2,0]*x3 + M[2,1]*y3 + M[2,2]*z3
-
-        # finally, transform back to long, lat
-        longn, latn, rho = xyz2long_lat(xn,yn,zn)
-        return longn,latn,rho
-
-def xform_long_lat_2_stereographic(long,lat,R=1.0):
-    theta_P = long
-    rho_P = 2*R*numpy.tan((numpy.pi/2-lat)/2.0)
-
-    x=rho_P*numpy.cos(theta_P)
-    y=rho_P*numpy.sin(theta_P)
-
-    return x,y
-
-def xform_stereographic_2_long_lat(x,y,R=1.0):
-    x=numpy.asarray(x)
-    y=numpy.asarray(y)
-    R=numpy.asarray(R)
-    # convert to 2D polar
-    rho = numpy.sqrt(x**2+y**2)
-    theta = numpy.arctan2(y,x)
-
-    # convert to spherical
-    colat = 2*numpy.arctan(rho/(2*R))
-    lat = numpy.pi/2-colat
-
-    long = theta
-
-    return long, lat, R
-
 ###########################################################
 def voronoi( tri ):
     return numpy.array(
@@ -706,7 +642,18 @@ def plot_stuff():
     pylab.show()
 
 ###########################################################
-def main():
+def main(max_rel_error=None, ellpack=False):
+    """compute the eye map and save it as precomputed_buchner71.py
+
+    If max_rel_error is None, weights below a fixed threshold are
+    clipped. Otherwise, each receptor keeps only its largest weights
+    such that at most max_rel_error of its total weight is discarded,
+    and its weights are renormalized to unit gain.
+
+    If ellpack is True, the weight matrix is also saved in padded
+    format as receptor_weight_indices_64 and receptor_weight_values_64
+    (see util.get_ellpack).
+    """
     Mforward = get_rot_mat(-numpy.pi/2,1,0,0)
     scale = numpy.eye(3)
     scale[2,2]=-1
@@ -778,43 +725,45 @@ def main():
     ###############################
 
     print('calculating interommatidial distances')
-    delta_phi = get_mean_interommatidial_distance(receptor_dirs,triangles)
+    receptor_adjacency = get_adjacency(receptor_dirs,triangles)
+    delta_phi = mean_neighbor_angle(receptor_adjacency)
     delta_rho_q = numpy.asarray(delta_phi) * 1.1 # rough approximation. follows from caption of Fig. 18, Buchner, 1984 (in Ali)
 
     # make optical lowpass filters
 
-    print('calculating weight_maps...')
-    weight_maps_64 = make_receptor_sensitivities( receptor_dirs,
-                                                  delta_rho_q=delta_rho_q,
-                                                  res=64 )
+    receptor_kernel = GaussianKernel(delta_rho_q)
+
+    print('calculating weight matrix...')
+    weights_64 = make_weight_matrix( receptor_dirs, receptor_kernel, res=64,
+                                     dtype=numpy.float64 )
     print('done')
 
     clip_thresh=1e-5
     floattype=numpy.float32
-    tmp_weights = flatten_cubemap( weight_maps_64[0] ) # get first one to take size
-
-    n_receptors = len(receptor_dirs)
-    len_wm = len(tmp_weights)
-
-    print('allocating memory...')
-    bigmat_64 = numpy.zeros( (n_receptors, len_wm), dtype=floattype )
-    print('done')
-
-    print('flattening, clipping, casting...')
-    for i, weight_cubemap in enumerate(weight_maps_64):
-        weights = flatten_cubemap( weight_cubemap )
-        if clip_thresh is not None:
-            weights = numpy.choose(weights<clip_thresh,(weights,0))
-        bigmat_64[i,:] = weights.astype( bigmat_64.dtype )
+    M,N = weights_64.shape
+
+    print('clipping, casting...')
+    nnz_before = weights_64.nnz
+    worst_rel_error = 0.0
+    if max_rel_error is not None:
+        for i in range(M):
+            row = weights_64.data[weights_64.indptr[i]:weights_64.indptr[i+1]]
+            row[:], rel_error = sparsify_weights(row, max_rel_error)
+            worst_rel_error = max(worst_rel_error, rel_error)
+    elif clip_thresh is not None:
+        weights_64.data[weights_64.data<clip_thresh] = 0
+    weights_64.eliminate_zeros()
+    spmat_64 = scipy.sparse.csc_matrix(weights_64.astype(floattype))
     print('done')
+    if max_rel_error is not None:
+        print('worst discarded weight fraction %g (budget %g)'%(
+            worst_rel_error, max_rel_error))
 
-    print('worst gain (should be unity)',min(numpy.sum( bigmat_64, axis=1)))
-    print('filling spmat_64...')
-    sys.stdout.flush()
-    spmat_64 = scipy.sparse.csc_matrix(bigmat_64)
-    print('done')
+    print('worst gain (should be unity)',min(numpy.asarray(spmat_64.sum(axis=1)).ravel()))
 
-    M,N = bigmat_64.shape
+    print('nnz within kernel support: %d'%nnz_before)
+    print('nnz after sparsification: %d (%.1f per receptor)'%(
+        spmat_64.nnz, spmat_64.nnz/M))
     print('Compressed to %d of %d'%(len(spmat_64.data),M*N))
 
     ######################
@@ -843,6 +792,15 @@ def main():
     st = [ tuple(t) for t in triangles]
     save_as_python(fd, st,  'triangles', fname_extra='_buchner_1971' )
     save_as_python(fd, list(map(make_repr_able,hex_faces)), 'hex_faces', fname_extra='_buchner_1971' )
+    save_as_python(fd, receptor_adjacency, 'receptor_adjacency', fname_extra='_buchner71' )
+    sample_dirs, sample_weights = make_sample_table(receptor_dirs, delta_rho_q)
+    save_as_python(fd, sample_dirs, 'receptor_sample_dirs', fname_extra='_buchner71' )
+    save_as_python(fd, sample_weights, 'receptor_sample_weights', fname_extra='_buchner71' )
+    if ellpack:
+        ellpack_indices, ellpack_values = get_ellpack(spmat_64)
+        print('ellpack: %d weights per receptor'%ellpack_indices.shape[1])
+        save_as_python(fd, ellpack_indices, 'receptor_weight_indices_64', fname_extra='_buchner71' )
+        save_as_python(fd, ellpack_values, 'receptor_weight_values_64', fname_extra='_buchner71' )
     fd.write( '\n')
     fd.write( '\n')
     fd.write( '\n')
@@ -852,5 +810,17 @@ def main():
     fd.close()
 
 if __name__=='__main__':
+    parser = argparse.ArgumentParser(
+        description='precompute the Buchner (1971) eye map and weight matrix')
+    parser.add_argument('--max-rel-error', type=float, default=None,
+                        help='instead of clipping small weights at a fixed '
+                        'threshold, keep the fewest weights per receptor '
+                        'such that at most this fraction of its total weight '
+                        'is discarded (e.g. 0.01), then renormalize to unit '
+                        'gain')
+    parser.add_argument('--ellpack', action='store_true', default=False,
+                        help='also save the weights as padded (n_receptors, K) '
+                        'index and weight arrays for sampler.EllpackSampler')
+    args = parser.parse_args()
     #plot_stuff()
-    main()
+    main(max_rel_error=args.max_rel_error, ellpack=args.ellpack)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Vectorized map projections of directions on the unit sphere
+
+These replace the per-point Basemap calls of the plotting scripts. A
+projection is constructed with the same framing arguments as the
+corresponding Basemap (``lon_0``, ``lat_0``, ``lat_ts`` and the corner
+longitudes and latitudes) and projects whole arrays at once, either
+from longitude and latitude in degrees (``proj(lon, lat)``) or
+directly from direction vectors of shape (N,3)
+(``proj.project_dirs(dirs)``). As with Basemap, points that cannot be
+projected are set to 1e30. The Basemap drawing methods used by the
+scripts (``drawparallels``, ``drawmeridians`` and ``drawmapboundary``)
+are also provided.
+
+The projections are computed by rotating the projection center to the
+pole (see coords.LongLatRotator) and applying the polar stereographic
+(coords.xform_long_lat_2_stereographic) or orthographic projection.
+"""
+from __future__ import division, print_function
+
+import numpy
+
+from coords import D2R, LongLatRotator, xform_long_lat_2_stereographic, \
+     xform_stereographic_2_long_lat, lonlat2dirs, dirs2lonlat, rotate_dirs
+
+HUGE = 1e30 # value for points that cannot be projected, like Basemap
+
+def get_center_rot_mat(lon_0,lat_0):
+    """rotation matrix taking (lon_0,lat_0) (degrees) to the north pole
+
+    The rows are the east, north and center directions at (lon_0,lat_0),
+    so that after rotation east is +x and north is +y.
+    """
+    lon_0 = lon_0*D2R
+    lat_0 = lat_0*D2R
+    east = [-numpy.sin(lon_0), numpy.cos(lon_0), 0.0]
+    north = [-numpy.sin(lat_0)*numpy.cos(lon_0),
+             -numpy.sin(lat_0)*numpy.sin(lon_0),
+             numpy.cos(lat_0)]
+    center = [numpy.cos(lat_0)*numpy.cos(lon_0),
+              numpy.cos(lat_0)*numpy.sin(lon_0),
+              numpy.sin(lat_0)]
+    return numpy.array([east,north,center])
+
+class Projection:
+    """base class of the azimuthal projections"""
+    def __init__(self,lon_0,lat_0,R=1.0):
+        self.lon_0 = lon_0
+        self.lat_0 = lat_0
+        self.R = R
+        self.rotmatrix = get_center_rot_mat(lon_0,lat_0)
+        self.to_polar = LongLatRotator(self.rotmatrix)
+
+    def __call__(self,lon,lat):
+        """project longitude and latitude (in degrees, arrays allowed)"""
+        long,lat,rho = self.to_polar(numpy.asarray(lon)*D2R,
+                                     numpy.asarray(lat)*D2R)
+        return self._project_polar(long,lat)
+
+    def project_dirs(self,dirs):
+        """project direction vectors of shape (...,3)
+
+        dirs is e.g. a list of receptor_dirs. They need not be normalized.
+        Returns x,y arrays of shape (...).
+        """
+        rotated = rotate_dirs(dirs,self.rotmatrix,dtype=numpy.float64)
+        lonlat = dirs2lonlat(rotated)
+        return self._project_polar(lonlat[...,0],lonlat[...,1])
+
+    def inverse_dirs(self,x,y):
+        """return unit direction vectors (...,3) of projected points
+
+        Points outside the projected sphere are NaN.
+        """
+        long,lat = self._unproject_polar(numpy.asarray(x,dtype=numpy.float64),
+                                         numpy.asarray(y,dtype=numpy.float64))
+        rotated = lonlat2dirs(long,lat)
+        # the rotation matrix is orthonormal, its inverse is its transpose
+        return rotate_dirs(rotated,self.rotmatrix.T,out=rotated)
+
+    def set_axes_limits(self,ax):
+        ax.set_xlim(self.xmin,self.xmax)
+        ax.set_ylim(self.ymin,self.ymax)
+        ax.set_aspect('equal')
+
+    def _draw_line(self,ax,x,y,color,linewidth,dashes,linestyle):
+        x = numpy.where(x<HUGE/10,x,numpy.nan) # break lines at bad values
+        y = numpy.where(y<HUGE/10,y,numpy.nan)
+        kwargs = dict(color=color,linewidth=linewidth,scalex=False,scaley=False)
+        if linestyle is not None:
+            kwargs['linestyle'] = linestyle
+        if dashes is not None and len(dashes):
+            kwargs['dashes'] = dashes
+        return ax.plot(x,y,**kwargs)
+
+    def drawparallels(self,circles,ax=None,color='k',linewidth=1.0,
+                      dashes=[1,1],linestyle=None,n_points=361):
+        """draw lines of constant latitude (degrees) like Basemap"""
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
+        lon = numpy.linspace(-180.0,180.0,n_points)
+        lines = []
+        for lat in circles:
+            x,y = self(lon,lat*numpy.ones_like(lon))
+            lines.extend(self._draw_line(ax,x,y,color,linewidth,dashes,linestyle))
+        self.set_axes_limits(ax)
+        return lines
+
+    def drawmeridians(self,meridians,ax=None,color='k',linewidth=1.0,
+                      dashes=[1,1],linestyle=None,n_points=181):
+        """draw lines of constant longitude (degrees) like Basemap"""
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
+        lat = numpy.linspace(-90.0,90.0,n_points)
+        lines = []
+        for lon in meridians:
+            x,y = self(lon*numpy.ones_like(lat),lat)
+            lines.extend(self._draw_line(ax,x,y,color,linewidth,dashes,linestyle))
+        self.set_axes_limits(ax)
+        return lines
+
+class Stereographic(Projection):
+    """stereographic projection centered on (lon_0,lat_0)
+
+    The plotted region is the rectangle spanned by the projected lower
+    left and upper right corners, as with Basemap. As in proj4, lat_ts
+    (latitude of true scale) only has an effect on the polar aspect.
+    """
+    def __init__(self,lon_0=0.0,lat_0=0.0,lat_ts=None,
+                 llcrnrlon=None,llcrnrlat=None,urcrnrlon=None,urcrnrlat=None,
+                 R=1.0):
+        Projection.__init__(self,lon_0,lat_0,R=R)
+        self.k_0 = 1.0
+        if lat_ts is not None and abs(lat_0)==90.0:
+            self.k_0 = (1.0+numpy.sin(abs(lat_ts)*D2R))/2.0
+        if llcrnrlon is None:
+            # default to the hemisphere around the center
+            self.xmin = self.ymin = -2*R*self.k_0
+            self.xmax = self.ymax = 2*R*self.k_0
+        else:
+            x,y = self([llcrnrlon,urcrnrlon],[llcrnrlat,urcrnrlat])
+            self.xmin,self.xmax = min(x),max(x)
+            self.ymin,self.ymax = min(y),max(y)
+
+    def _project_polar(self,long,lat):
+        x,y = xform_long_lat_2_stereographic(long,lat,R=self.R*self.k_0)
+        bad = ~numpy.isfinite(x) | ~numpy.isfinite(y) | (numpy.abs(x)>HUGE) | (numpy.abs(y)>HUGE)
+        x = numpy.where(bad,HUGE,x)
+        y = numpy.where(bad,HUGE,y)
+        return x,y
+
+    def _unproject_polar(self,x,y):
+        long,lat,R = xform_stereographic_2_long_lat(x,y,R=self.R*self.k_0)
+        return long,lat
+
+class Orthographic(Projection):
+    """orthographic projection of the hemisphere centered on (lon_0,lat_0)"""
+    def __init__(self,lon_0=0.0,lat_0=0.0,R=1.0):
+        Projection.__init__(self,lon_0,lat_0,R=R)
+        self.xmin = self.ymin = -R
+        self.xmax = self.ymax = R
+
+    def _project_polar(self,long,lat):
+        # the projection center is at the pole, so the distance from
+        # the center in the plane is R*cos(lat)
+        rho = self.R*numpy.cos(lat)
+        hidden = lat < 0
+        x = numpy.where(hidden,HUGE,rho*numpy.cos(long))
+        y = numpy.where(hidden,HUGE,rho*numpy.sin(long))
+        return x,y
+
+    def _unproject_polar(self,x,y):
+        rho = numpy.sqrt(x**2+y**2)/self.R
+        with numpy.errstate(invalid='ignore'):
+            lat = numpy.where(rho<=1.0,numpy.arccos(numpy.minimum(rho,1.0)),numpy.nan)
+        long = numpy.arctan2(y,x)
+        return long,lat
+
+    def drawmapboundary(self,ax=None,color='k',linewidth=1.0,n_points=361):
+        """draw the limb of the sphere"""
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
+        theta = numpy.linspace(0,2*numpy.pi,n_points)
+        lines = ax.plot(self.R*numpy.cos(theta),self.R*numpy.sin(theta),
+                        color=color,linewidth=linewidth,scalex=False,scaley=False)
+        self.set_axes_limits(ax)
+        return lines
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Render receptor responses by raycasting triangle mesh scenes
+
+Instead of rendering a cube map and reducing it with the weight
+matrix, the response of each receptor is estimated from n_rays rays
+around its direction, drawn from its Gaussian acceptance function.
+The cost scales with the number of receptors and rays (and only
+logarithmically with the number of triangles) instead of with the
+cube map resolution::
+
+    bvh = BVH(vertices, faces)   # once per (static) scene
+    sampler = RaycastSampler(receptor_dirs, delta_rho, n_rays=64)
+    responses = sampler.sample(bvh, face_values, origin=position,
+                               rotation=head_rotation)
+
+The ray pattern is a quasi-random (Halton) point set mapped through
+the Gaussian and randomly shifted per receptor, so the estimate is
+deterministic for a given seed and converges faster than with
+independent random rays.
+"""
+from __future__ import division, print_function
+
+import numpy
+
+from coords import normalize_dirs, rotate_dirs, tangent_basis
+
+FOUR_LN2 = 4*numpy.log(2.0) # as in kernels.py
+
+def radical_inverse(n, base):
+    """return the first n points of the van der Corput sequence in base"""
+    idx = numpy.arange(1, n+1)
+    result = numpy.zeros(n)
+    scale = 1.0
+    while numpy.any(idx > 0):
+        scale /= base
+        idx, digit = numpy.divmod(idx, base)
+        result += digit*scale
+    return result
+
+def get_gaussian_ray_offsets(n_receptors, n_rays, sigma, seed=0):
+    """return ray offsets (n_receptors,n_rays,2) in the tangent plane
+
+    The offsets are normally distributed with standard deviation sigma
+    (scalar or one value per receptor, in radians). They are computed
+    from a 2D Halton set with a random Cranley-Patterson shift per
+    receptor, transformed with the Box-Muller method.
+    """
+    halton = numpy.column_stack([radical_inverse(n_rays, 2),
+                                 radical_inverse(n_rays, 3)])
+    rng = numpy.random.RandomState(seed)
+    shift = rng.uniform(size=(n_receptors,1,2))
+    u = numpy.mod(halton[numpy.newaxis]+shift, 1.0)
+    radius = numpy.sqrt(-2*numpy.log1p(-u[...,0])) # 1-u is in (0,1]
+    phi = 2*numpy.pi*u[...,1]
+    sigma = numpy.broadcast_to(sigma, (n_receptors,))[:,numpy.newaxis]
+    offsets = numpy.empty((n_receptors,n_rays,2))
+    offsets[...,0] = sigma*radius*numpy.cos(phi)
+    offsets[...,1] = sigma*radius*numpy.sin(phi)
+    return offsets
+
+def make_ray_dirs(receptor_dirs, delta_rho, n_rays=64, seed=0):
+    """return ray directions and weights importance sampled per receptor
+
+    delta_rho is the full width at half maximum of the Gaussian
+    acceptance function (scalar or one value per receptor, in
+    radians, as for kernels.GaussianKernel).
+
+    The offsets are azimuthal equidistant coordinates in the tangent
+    plane of each receptor (see kernels.py). Their density follows the
+    Gaussian, but the solid angle of the mapping grows as
+    sin(zeta)/zeta, so each ray is weighted by that factor. The
+    weights of each receptor sum to one.
+
+    Returns (dirs, weights) of shapes (n_receptors,n_rays,3) and
+    (n_receptors,n_rays).
+    """
+    receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+    n_receptors = len(receptor_dirs)
+    sigma = numpy.asarray(delta_rho, dtype=numpy.float64)/numpy.sqrt(2*FOUR_LN2)
+    offsets = get_gaussian_ray_offsets(n_receptors, n_rays, sigma, seed=seed)
+
+    east, north = tangent_basis(receptor_dirs)
+    zeta = numpy.hypot(offsets[...,0], offsets[...,1])
+    sinc = numpy.sinc(zeta/numpy.pi) # sin(zeta)/zeta
+    dirs = (numpy.cos(zeta)[...,numpy.newaxis]*receptor_dirs[:,numpy.newaxis,:] +
+            (sinc*offsets[...,0])[...,numpy.newaxis]*east[:,numpy.newaxis,:] +
+            (sinc*offsets[...,1])[...,numpy.newaxis]*north[:,numpy.newaxis,:])
+    weights = sinc/numpy.sum(sinc, axis=1)[:,numpy.newaxis]
+    return dirs, weights
+
+class BVH:
+    """bounding volume hierarchy of a triangle mesh
+
+    vertices is an array (n_vertices,3) and faces an integer array
+    (n_faces,3) of vertex indices. Nodes are split at the median
+    triangle centroid along their longest axis until they hold at most
+    leaf_size triangles. The tree is stored in flat arrays, so that
+    intersect() can traverse it for many rays at once.
+    """
+    def __init__(self, vertices, faces, leaf_size=4):
+        self.vertices = numpy.asarray(vertices, dtype=numpy.float64)
+        self.faces = numpy.asarray(faces, dtype=numpy.intp)
+        if self.vertices.ndim != 2 or self.vertices.shape[1] != 3:
+            raise ValueError('vertices must have shape (n_vertices,3)')
+        if self.faces.ndim != 2 or self.faces.shape[1] != 3:
+            raise ValueError('faces must have shape (n_faces,3)')
+        self.n_faces = len(self.faces)
+        if self.n_faces == 0:
+            raise ValueError('the mesh has no faces')
+        tri = self.vertices[self.faces]
+        lo = numpy.min(tri, axis=1)
+        hi = numpy.max(tri, axis=1)
+        centroids = numpy.mean(tri, axis=1)
+
+        order = numpy.arange(self.n_faces)
+        node_lo, node_hi, node_left, node_right, node_start, node_count = \
+                 [], [], [], [], [], []
+        stack = [(0, self.n_faces, -1, False)] # start, stop, parent, is_right
+        while stack:
+            start, stop, parent, is_right = stack.pop()
+            node = len(node_lo)
+            if parent >= 0:
+                if is_right:
+                    node_right[parent] = node
+                else:
+                    node_left[parent] = node
+            idx = order[start:stop]
+            node_lo.append(numpy.min(lo[idx], axis=0))
+            node_hi.append(numpy.max(hi[idx], axis=0))
+            node_left.append(-1)
+            node_right.append(-1)
+            node_start.append(start)
+            node_count.append(stop-start)
+            if stop-start <= leaf_size:
+                continue
+            c = centroids[idx]
+            axis = numpy.argmax(numpy.ptp(c, axis=0))
+            mid = (stop-start)//2
+            order[start:stop] = idx[numpy.argpartition(c[:,axis], mid)]
+            stack.append((start+mid, stop, node, True))
+            stack.append((start, start+mid, node, False))
+
+        self.node_lo = numpy.array(node_lo)
+        self.node_hi = numpy.array(node_hi)
+        self.node_left = numpy.array(node_left, dtype=numpy.intp)
+        self.node_right = numpy.array(node_right, dtype=numpy.intp)
+        self.node_start = numpy.array(node_start, dtype=numpy.intp)
+        self.node_count = numpy.array(node_count, dtype=numpy.intp)
+        self.order = order # leaf triangle slots -> face index
+        tri = tri[order]
+        self.v0 = tri[:,0]
+        self.e1 = tri[:,1]-tri[:,0]
+        self.e2 = tri[:,2]-tri[:,0]
+
+    def _box_hit(self, origins, inv_dirs, node, t_max):
+        # slab test, one axis at a time (faster than reducing (n,3)
+        # arrays). fmin/fmax ignore the nan of 0*inf for rays in a slab
+        # plane.
+        t_near = numpy.zeros(len(node))
+        t_far = t_max.copy()
+        for axis in range(3):
+            t0 = (self.node_lo[node,axis]-origins[:,axis])*inv_dirs[:,axis]
+            t1 = (self.node_hi[node,axis]-origins[:,axis])*inv_dirs[:,axis]
+            numpy.fmax(t_near, numpy.fmin(t0,t1), out=t_near)
+            numpy.fmin(t_far, numpy.fmax(t0,t1), out=t_far)
+        return t_near <= t_far
+
+    def _triangle_hit(self, origins, dirs, slot, eps):
+        # Moller-Trumbore
+        e1, e2 = self.e1[slot], self.e2[slot]
+        p = numpy.cross(dirs, e2)
+        det = numpy.sum(e1*p, axis=1)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            inv_det = 1.0/det
+            s = origins-self.v0[slot]
+            u = numpy.sum(s*p, axis=1)*inv_det
+            q = numpy.cross(s, e1)
+            v = numpy.sum(dirs*q, axis=1)*inv_det
+            t = numpy.sum(e2*q, axis=1)*inv_det
+        hit = ((numpy.abs(det) > 1e-300) & (u >= 0) & (v >= 0) &
+               (u+v <= 1) & (t > eps))
+        return hit, t, u, v
+
+    def intersect(self, origins, dirs, eps=1e-9):
+        """return the nearest intersection of each ray with the mesh
+
+        origins is (3,) or (n_rays,3), dirs is (n_rays,3). Returns (face,
+        t, u, v), each of shape (n_rays,): the index into faces of the
+        hit triangle (-1 for rays that miss), the ray parameter of the
+        hit point (inf for misses) and its barycentric coordinates
+        (the hit point is (1-u-v)*p0 + u*p1 + v*p2).
+        """
+        dirs = numpy.asarray(dirs, dtype=numpy.float64)
+        n_rays = len(dirs)
+        origins = numpy.broadcast_to(numpy.asarray(origins, dtype=numpy.float64),
+                                     (n_rays,3))
+        with numpy.errstate(divide='ignore'):
+            inv_dirs = 1.0/dirs
+        best_t = numpy.full(n_rays, numpy.inf)
+        best_slot = numpy.full(n_rays, -1, dtype=numpy.intp)
+        best_u = numpy.zeros(n_rays)
+        best_v = numpy.zeros(n_rays)
+
+        # breadth first traversal of all (ray,node) pairs at once
+        ray = numpy.arange(n_rays)
+        node = numpy.zeros(n_rays, dtype=numpy.intp)
+        while len(ray):
+            with numpy.errstate(invalid='ignore'):
+                keep = self._box_hit(origins[ray], inv_dirs[ray], node, best_t[ray])
+            ray, node = ray[keep], node[keep]
+
+            leaf = self.node_left[node] < 0
+            leaf_ray, leaf_node = ray[leaf], node[leaf]
+            if len(leaf_ray):
+                counts = self.node_count[leaf_node]
+                pair_ray = numpy.repeat(leaf_ray, counts)
+                first = numpy.cumsum(counts)-counts
+                slot = (numpy.repeat(self.node_start[leaf_node]-first, counts) +
+                        numpy.arange(len(pair_ray)))
+                hit, t, u, v = self._triangle_hit(origins[pair_ray], dirs[pair_ray],
+                                                  slot, eps)
+                hit &= t < best_t[pair_ray]
+                hit = numpy.nonzero(hit)[0]
+                if len(hit):
+                    # nearest hit per ray
+                    sort = numpy.lexsort((t[hit], pair_ray[hit]))
+                    hit = hit[sort]
+                    hit_ray = pair_ray[hit]
+                    nearest = numpy.ones(len(hit), dtype=bool)
+                    nearest[1:] = hit_ray[1:] != hit_ray[:-1]
+                    hit = hit[nearest]
+                    hit_ray = hit_ray[nearest]
+                    best_t[hit_ray] = t[hit]
+                    best_slot[hit_ray] = slot[hit]
+                    best_u[hit_ray] = u[hit]
+                    best_v[hit_ray] = v[hit]
+
+            inner_ray, inner_node = ray[~leaf], node[~leaf]
+            ray = numpy.concatenate([inner_ray, inner_ray])
+            node = numpy.concatenate([self.node_left[inner_node],
+                                      self.node_right[inner_node]])
+
+        face = numpy.where(best_slot >= 0, self.order[best_slot], -1)
+        return face, best_t, best_u, best_v
+
+class RaycastSampler:
+    """compute receptor responses by raycasting a triangle mesh
+
+    receptor_dirs are the receptor directions in eye coordinates and
+    delta_rho the full width at half maximum of their Gaussian
+    acceptance functions (see make_ray_dirs). The rays are fixed at
+    construction. batch_size bounds the number of rays traced at once.
+    """
+    def __init__(self, receptor_dirs, delta_rho, n_rays=64, seed=0,
+                 batch_size=2**16):
+        self.ray_dirs, self.ray_weights = make_ray_dirs(
+            receptor_dirs, delta_rho, n_rays=n_rays, seed=seed)
+        self.n_receptors, self.n_rays = self.ray_weights.shape
+        self.batch_size = batch_size
+
+    def cast(self, bvh, origin=(0.0,0.0,0.0), rotation=None):
+        """trace all rays from origin
+
+        rotation is a 3x3 matrix taking eye coordinates to scene
+        coordinates. Returns (face, t, u, v) as BVH.intersect, each of
+        shape (n_receptors,n_rays).
+        """
+        dirs = self.ray_dirs.reshape((-1,3))
+        if rotation is not None:
+            dirs = rotate_dirs(dirs, rotation)
+        origin = numpy.asarray(origin, dtype=numpy.float64)
+        results = [numpy.empty(len(dirs), dtype=numpy.intp)]
+        results.extend([numpy.empty(len(dirs)) for i in range(3)])
+        for start in range(0, len(dirs), self.batch_size):
+            stop = min(start+self.batch_size, len(dirs))
+            batch = bvh.intersect(origin, dirs[start:stop])
+            for result, b in zip(results, batch):
+                result[start:stop] = b
+        shape = (self.n_receptors, self.n_rays)
+        return tuple(result.reshape(shape) for result in results)
+
+    def shade(self, bvh, hits, values, per_vertex=False, background=0.0):
+        """return receptor responses from the hits returned by cast()
+
+        values holds one value per face of the mesh, or one per vertex
+        if per_vertex is True (interpolated at the hit points). Values
+        may have further (e.g. color channel) dimensions. Rays that
+        miss the mesh see background. Returns an array of shape
+        (n_receptors,)+values.shape[1:].
+        """
+        face, t, u, v = hits
+        values = numpy.asarray(values)
+        missed = face < 0
+        face = numpy.where(missed, 0, face)
+        if per_vertex:
+            if len(values) != len(bvh.vertices):
+                raise ValueError('need one value per vertex')
+            idx = bvh.faces[face]
+            bary = numpy.stack([1-u-v, u, v], axis=-1)
+            bary = bary.reshape(bary.shape+(1,)*(values.ndim-1))
+            ray_values = numpy.sum(bary*values[idx], axis=2)
+        else:
+            if len(values) != bvh.n_faces:
+                raise ValueError('need one value per face')
+            ray_values = values[face]
+        missed = missed.reshape(missed.shape+(1,)*(values.ndim-1))
+        ray_values = numpy.where(missed, background, ray_values)
+        weights = self.ray_weights.reshape(self.ray_weights.shape+(1,)*(values.ndim-1))
+        return numpy.sum(weights*ray_values, axis=1)
+
+    def sample(self, bvh, values, origin=(0.0,0.0,0.0), rotation=None,
+               per_vertex=False, background=0.0):
+        """return receptor responses (n_receptors,...) of a mesh scene
+
+        See cast() and shade().
+        """
+        hits = self.cast(bvh, origin=origin, rotation=rotation)
+        return self.shade(bvh, hits, values, per_vertex=per_vertex,
+                          background=background)
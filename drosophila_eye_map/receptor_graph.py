@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Sparse receptor adjacency graph of the eye map
+
+Two receptors are neighbors if they share an edge of the eye map
+triangulation (``triangles`` of precomputed_buchner71.py). The graph is
+kept as a symmetric scipy.sparse CSR matrix whose entries are the
+angular distances (in radians) between neighboring receptor
+directions. precompute_buchner71_optics.py saves it as
+``receptor_adjacency``::
+
+    adjacency = get_adjacency(receptor_dirs, triangles)
+    ring = k_ring(adjacency, [idx], 2)          # receptors within 2 steps
+    L = get_laplacian(adjacency)                # for lateral interactions
+    boundary = get_boundary(triangles, len(receptor_dirs))
+
+Lateral interactions of a (T, n_receptors) time series then become
+sparse matrix products, e.g. ``(L @ x.T).T`` or ``x @ L`` (L is
+symmetric).
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.sparse
+
+from coords import normalize_dirs
+
+def get_edges(triangles, n_receptors=None):
+    """return the unique undirected edges (i<j) of triangles as (E,2) array
+
+    Triangles with indices outside range(n_receptors) are ignored.
+    Also returns, for each edge, the number of triangles sharing it.
+    """
+    triangles = numpy.asarray(triangles, dtype=numpy.intp).reshape((-1,3))
+    if n_receptors is not None:
+        valid = numpy.all((triangles >= 0) & (triangles < n_receptors), axis=1)
+        triangles = triangles[valid]
+    pairs = numpy.concatenate([triangles[:,[0,1]],
+                               triangles[:,[1,2]],
+                               triangles[:,[2,0]]])
+    pairs.sort(axis=1)
+    edges, counts = numpy.unique(pairs, axis=0, return_counts=True)
+    return edges, counts
+
+def edge_angles(receptor_dirs, edges):
+    """angle (in radians) between the receptor directions of each edge"""
+    dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+    a = dirs[edges[:,0]]
+    b = dirs[edges[:,1]]
+    # arctan2 is accurate also for the small angles between neighbors
+    return numpy.arctan2(numpy.sqrt(numpy.sum(numpy.cross(a,b)**2, axis=1)),
+                         numpy.sum(a*b, axis=1))
+
+def get_adjacency(receptor_dirs, triangles):
+    """return the symmetric (N,N) CSR adjacency matrix of the receptors
+
+    Entries are the angular distances (in radians) between neighbors.
+    """
+    n_receptors = len(receptor_dirs)
+    edges, counts = get_edges(triangles, n_receptors)
+    angles = edge_angles(receptor_dirs, edges)
+    rows = numpy.concatenate([edges[:,0], edges[:,1]])
+    cols = numpy.concatenate([edges[:,1], edges[:,0]])
+    data = numpy.concatenate([angles, angles])
+    adjacency = scipy.sparse.csr_matrix((data, (rows, cols)),
+                                        shape=(n_receptors, n_receptors))
+    adjacency.sort_indices()
+    return adjacency
+
+def as_csr(adjacency):
+    # e.g. the CSC matrix returned by scipy.io.loadmat
+    return scipy.sparse.csr_matrix(adjacency)
+
+def mean_neighbor_angle(adjacency):
+    """return the mean angle (in radians) to the neighbors of each receptor
+
+    This is the mean interommatidial distance. Receptors without
+    neighbors get NaN.
+    """
+    adjacency = as_csr(adjacency)
+    n_neighbors = numpy.diff(adjacency.indptr)
+    sums = numpy.asarray(adjacency.sum(axis=1)).ravel()
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return sums/n_neighbors
+
+def get_boundary(triangles, n_receptors):
+    """return a boolean mask of the receptors at the edge of the lattice
+
+    These are the receptors whose hex face does not close on itself
+    (marked with -1 by my_voronoi in precompute_buchner71_optics.py),
+    i.e. the ends of triangle edges that belong to only one triangle.
+    """
+    edges, counts = get_edges(triangles, n_receptors)
+    boundary = numpy.zeros((n_receptors,), dtype=bool)
+    boundary[edges[counts==1].ravel()] = True
+    return boundary
+
+def k_ring(adjacency, seeds, k, include_seeds=True):
+    """return the sorted indices of receptors at most k steps from seeds
+
+    seeds is a receptor index or a sequence of them.
+    """
+    adjacency = as_csr(adjacency)
+    reached = numpy.zeros((adjacency.shape[0],), dtype=bool)
+    reached[numpy.atleast_1d(seeds)] = True
+    frontier = reached.copy()
+    for i in range(k):
+        neighbors = adjacency.dot(frontier.astype(numpy.float64)) != 0
+        frontier = neighbors & ~reached
+        if not numpy.any(frontier):
+            break
+        reached |= frontier
+    if not include_seeds:
+        reached[numpy.atleast_1d(seeds)] = False
+    return numpy.nonzero(reached)[0]
+
+def get_k_ring_matrix(adjacency, k, include_self=True):
+    """return a CSR matrix with ones where receptors are at most k steps apart
+
+    Row i selects the k-ring of receptor i, so that the product with
+    per-receptor values (e.g. ``R.dot(x)``) sums over the k-ring.
+    """
+    adjacency = as_csr(adjacency)
+    n = adjacency.shape[0]
+    step = adjacency.astype(bool).astype(numpy.int8) + \
+           scipy.sparse.identity(n, dtype=numpy.int8, format='csr')
+    reach = scipy.sparse.identity(n, dtype=numpy.int8, format='csr')
+    for i in range(k):
+        reach = (reach.dot(step) != 0).astype(numpy.int8)
+    if not include_self:
+        reach = reach - scipy.sparse.identity(n, dtype=numpy.int8, format='csr')
+        reach.eliminate_zeros()
+    reach = scipy.sparse.csr_matrix(reach, dtype=numpy.float64)
+    reach.sort_indices()
+    return reach
+
+def get_laplacian(adjacency, weighting='binary', normalized=False):
+    """return the graph Laplacian L = D - W as CSR matrix
+
+    The edge weights W are 1 for weighting='binary', the angular
+    distance for 'angle' and its inverse for 'inverse_angle'. If
+    normalized, the symmetric normalized Laplacian
+    I - D^-1/2 W D^-1/2 is returned.
+    """
+    adjacency = as_csr(adjacency)
+    W = adjacency.copy()
+    if weighting == 'binary':
+        W.data = numpy.ones_like(W.data)
+    elif weighting == 'angle':
+        pass
+    elif weighting == 'inverse_angle':
+        W.data = 1.0/W.data
+    else:
+        raise ValueError('unknown weighting %r'%(weighting,))
+    degree = numpy.asarray(W.sum(axis=1)).ravel()
+    n = W.shape[0]
+    if normalized:
+        with numpy.errstate(divide='ignore'):
+            inv_sqrt = numpy.where(degree > 0, 1.0/numpy.sqrt(degree), 0.0)
+        D = scipy.sparse.diags(inv_sqrt)
+        L = scipy.sparse.identity(n, format='csr') - D.dot(W).dot(D)
+    else:
+        L = scipy.sparse.diags(degree) - W
+    L = scipy.sparse.csr_matrix(L)
+    L.sort_indices()
+    return L
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Nearest receptor lookup for arbitrary view directions
+
+Build a ReceptorLocator once from the receptor directions (e.g. the
+``receptor_dirs`` and ``receptor_dir_slicer`` of
+precomputed_buchner71.py) and use it to map many view directions
+(gaze directions, stimulus positions, tracked points) onto ommatidia::
+
+    locator = ReceptorLocator(receptor_dirs, receptor_dir_slicer)
+    idx, angle = locator.query(dirs)                  # nearest, both eyes
+    idx, angle = locator.query(dirs, k=3, eye='left') # 3 nearest, left eye
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.spatial
+
+def as_unit_vectors(dirs):
+    """return dirs as a float array of shape (...,3) scaled to unit length
+
+    dirs may be a sequence of cgtypes.vec3 or any array-like with a
+    last dimension of length 3.
+    """
+    dirs = numpy.asarray(dirs, dtype=numpy.float64)
+    if dirs.shape[-1] != 3:
+        raise ValueError('directions must have a last dimension of length 3')
+    return dirs/numpy.sqrt(numpy.sum(dirs**2, axis=-1))[...,numpy.newaxis]
+
+def chord2angle(chord):
+    """convert chord length between unit vectors to angle (in radians)"""
+    return 2.0*numpy.arcsin(numpy.minimum(chord*0.5, 1.0))
+
+class ReceptorLocator:
+    """batched nearest and k-nearest receptor queries
+
+    A KD-tree is built on the unit receptor direction vectors. Because
+    the chord length between unit vectors is monotonic in the angle
+    between them, the Euclidean neighbors are also the angular
+    neighbors. One tree is built per eye on first use.
+    """
+    def __init__(self, receptor_dirs, receptor_dir_slicer=None):
+        self.receptor_dirs = as_unit_vectors(receptor_dirs)
+        if self.receptor_dirs.ndim != 2:
+            raise ValueError('receptor_dirs must be a sequence of 3-vectors')
+        if receptor_dir_slicer is None:
+            receptor_dir_slicer = {None:slice(0,len(self.receptor_dirs),1)}
+        self.receptor_dir_slicer = receptor_dir_slicer
+        self._trees = {}
+
+    def _get_tree(self, eye):
+        if eye not in self._trees:
+            slc = self.receptor_dir_slicer[eye]
+            indices = numpy.arange(len(self.receptor_dirs))[slc]
+            tree = scipy.spatial.cKDTree(self.receptor_dirs[indices])
+            self._trees[eye] = tree, indices
+        return self._trees[eye]
+
+    def query(self, dirs, k=1, eye=None, workers=1):
+        """find the k receptors nearest to each view direction
+
+        dirs is an array of shape (...,3) and does not need to be
+        normalized. eye is a key of receptor_dir_slicer (None, 'left'
+        or 'right' for the Buchner map) and limits the search to that
+        eye. workers is passed to scipy.spatial.cKDTree.query (-1 uses
+        all CPUs).
+
+        Returns (idx, angle). idx are indices into receptor_dirs (of
+        both eyes, regardless of eye) and angle is the angular distance
+        in radians. Both have shape (...) if k==1, else (...,k), sorted
+        by increasing distance.
+        """
+        dirs = as_unit_vectors(dirs)
+        tree, indices = self._get_tree(eye)
+        if k > len(indices):
+            raise ValueError('k is larger than the number of receptors')
+        flat = dirs.reshape((-1,3))
+        chord, tree_idx = tree.query(flat, k=k, workers=workers)
+        shape = dirs.shape[:-1]
+        if k != 1:
+            shape = shape + (k,)
+        idx = indices[tree_idx].reshape(shape)
+        angle = chord2angle(chord).reshape(shape)
+        return idx, angle
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Cache friendly orderings of receptors and cube map pixels
+
+The receptors are numbered in the order in which they were digitized
+and the pixels of each cube face row by row, so that neighboring
+receptors (and pixels) are often far apart in memory. The orderings
+here put them along space-filling curves instead:
+
+ * receptors are sorted along a Hilbert curve on the faces of a cube
+   enclosing the sphere (face by face, each eye separately), and
+ * the pixels of each face are sorted in Morton (Z-curve) order.
+
+Each ordering is a permutation ``perm`` giving the original index of
+each position, i.e. ``reordered = original[...,perm]``.
+sampler.ReorderedSampler applies them internally while keeping the
+original receptor and pixel indices in its interface.
+"""
+from __future__ import division, print_function
+
+import numpy
+
+from coords import normalize_dirs
+
+def spread_bits(v):
+    """insert a zero bit after each of the lower 16 bits of v"""
+    v = numpy.asarray(v, dtype=numpy.uint32) & 0x0000ffff
+    v = (v | (v << 8)) & 0x00ff00ff
+    v = (v | (v << 4)) & 0x0f0f0f0f
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+def morton_index(i, j):
+    """return the Morton (Z-curve) index of integer coordinates i,j < 2**16"""
+    return (spread_bits(i) << 1) | spread_bits(j)
+
+def hilbert_index(x, y, order):
+    """return the Hilbert curve index of integer coordinates x,y < 2**order"""
+    x = numpy.array(x, dtype=numpy.int64)
+    y = numpy.array(y, dtype=numpy.int64)
+    n = 2**order
+    d = numpy.zeros(numpy.broadcast(x,y).shape, dtype=numpy.int64)
+    s = n//2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s*s*((3*rx) ^ ry)
+        # rotate the quadrant
+        flip = ~ry & rx
+        x = numpy.where(flip, n-1-x, x)
+        y = numpy.where(flip, n-1-y, y)
+        swap = ~ry
+        x, y = numpy.where(swap, y, x), numpy.where(swap, x, y)
+        s //= 2
+    return d
+
+def get_sphere_curve_index(dirs, order=10):
+    """return the position of directions (...,3) along a space-filling curve
+
+    The directions are projected onto the enclosing cube (as with cube
+    maps) and numbered face by face along a Hilbert curve of the given
+    order on each face.
+    """
+    dirs = normalize_dirs(dirs, dtype=numpy.float64)
+    axis = numpy.argmax(numpy.abs(dirs), axis=-1)
+    major = numpy.take_along_axis(dirs, axis[...,numpy.newaxis], axis=-1)[...,0]
+    face = 2*axis + (major < 0)
+    # the two other coordinates, projected onto the face, in [-1,1]
+    other = numpy.array([[1,2],[0,2],[0,1]])[axis]
+    u = numpy.take_along_axis(dirs, other[...,0:1], axis=-1)[...,0]/numpy.abs(major)
+    v = numpy.take_along_axis(dirs, other[...,1:2], axis=-1)[...,0]/numpy.abs(major)
+    n = 2**order
+    iu = numpy.clip(((u+1)*0.5*n).astype(numpy.int64), 0, n-1)
+    iv = numpy.clip(((v+1)*0.5*n).astype(numpy.int64), 0, n-1)
+    return face*n*n + hilbert_index(iu, iv, order)
+
+def get_receptor_order(receptor_dirs, receptor_dir_slicer=None, order=10):
+    """return the permutation sorting receptors along a space-filling curve
+
+    If receptor_dir_slicer is given, the receptors of each eye ('left'
+    and 'right') are sorted separately and stay in their block.
+    """
+    n_receptors = len(receptor_dirs)
+    index = get_sphere_curve_index(receptor_dirs, order=order)
+    perm = numpy.arange(n_receptors)
+    blocks = [slice(0,n_receptors,1)]
+    if receptor_dir_slicer is not None:
+        eyes = [receptor_dir_slicer[eye] for eye in ('left','right')
+                if eye in receptor_dir_slicer]
+        if len(eyes):
+            blocks = eyes
+    for block in blocks:
+        block_idx = perm[block]
+        perm[block] = block_idx[numpy.argsort(index[block_idx], kind='stable')]
+    return perm
+
+def get_pixel_order(res):
+    """return the permutation putting the pixels of each face in Morton order
+
+    The permutation applies to flattened cube maps of 6*res*res pixels
+    (faces in cube_order, each row by row).
+    """
+    rows, cols = numpy.mgrid[0:res,0:res]
+    face_perm = numpy.argsort(morton_index(rows.ravel(), cols.ravel()), kind='stable')
+    return numpy.concatenate([face*res*res + face_perm for face in range(6)])
+
+def invert_permutation(perm):
+    inverse = numpy.empty_like(perm)
+    inverse[perm] = numpy.arange(len(perm))
+    return inverse
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Resolution independent receptor sampling with sample direction tables
+
+Instead of a weight matrix per input resolution and projection, each
+receptor is represented by K weighted sample directions, a quadrature
+of its acceptance function (``receptor_sample_dirs`` and
+``receptor_sample_weights`` of precomputed_buchner71.py). The table is
+looked up with bilinear interpolation in cube maps or equirectangular
+panoramas of any resolution::
+
+    sampler = TableSampler(receptor_sample_dirs, receptor_sample_weights)
+    responses = sampler.sample_cubemap(frames)    # (T,6,res,res), any res
+    responses = sampler.sample_equirect(images)   # (T,height,width)
+
+The interpolation matrix of each resolution is built from the table on
+first use and cached, so repeated sampling is a sparse matrix product
+as with the precomputed weight matrix.
+
+Cube maps use the face order and pixel layout of the weight matrix
+(see kernels.cube_pixel_dirs). Equirectangular images have longitude
+-180 degrees at the left edge, increasing to the right, and latitude
++90 degrees at the top edge. Pixel values are at pixel centers.
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.sparse
+
+from coords import normalize_dirs, tangent_basis, dirs2lonlat
+from sampler import flatten_frames, get_cube_res
+
+FOUR_LN2 = 4*numpy.log(2.0) # as in kernels.py
+
+def make_sample_table(receptor_dirs, delta_rho, n_radial=4, n_angular=8,
+                      dtype=numpy.float32):
+    """return a quadrature of the Gaussian acceptance functions
+
+    delta_rho is the full width at half maximum (scalar or one value
+    per receptor, in radians, as for kernels.GaussianKernel). The
+    quadrature is a product rule in polar coordinates of the tangent
+    plane: n_radial Gauss-Laguerre rings (in squared radius) times
+    n_angular equally spaced angles, every other ring rotated by half a
+    step. The weights include the solid angle factor sin(zeta)/zeta of
+    the azimuthal equidistant mapping (see raycast.make_ray_dirs, which
+    gives Monte Carlo tables of the same form) and sum to one per
+    receptor.
+
+    Returns (dirs, weights) of shapes (n_receptors,K,3) and
+    (n_receptors,K) with K=n_radial*n_angular.
+    """
+    receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+    n_receptors = len(receptor_dirs)
+    sigma = numpy.asarray(delta_rho, dtype=numpy.float64)/numpy.sqrt(2*FOUR_LN2)
+    sigma = numpy.broadcast_to(sigma, (n_receptors,))[:,numpy.newaxis]
+
+    # int f(r) exp(-r**2/(2 sigma**2)) r dr = sigma**2 int f exp(-s) ds
+    s, ring_weights = numpy.polynomial.laguerre.laggauss(n_radial)
+    ring = numpy.repeat(numpy.arange(n_radial), n_angular)
+    theta = 2*numpy.pi*(numpy.tile(numpy.arange(n_angular), n_radial) +
+                        0.5*(ring % 2))/n_angular
+    zeta = sigma*numpy.sqrt(2*s[ring])                   # (n_receptors,K)
+    sinc = numpy.sinc(zeta/numpy.pi)
+    weights = ring_weights[ring]*sinc
+    weights /= numpy.sum(weights, axis=1)[:,numpy.newaxis]
+
+    east, north = tangent_basis(receptor_dirs)
+    x = sinc*zeta*numpy.cos(theta)
+    y = sinc*zeta*numpy.sin(theta)
+    dirs = (numpy.cos(zeta)[...,numpy.newaxis]*receptor_dirs[:,numpy.newaxis,:] +
+            x[...,numpy.newaxis]*east[:,numpy.newaxis,:] +
+            y[...,numpy.newaxis]*north[:,numpy.newaxis,:])
+    return dirs.astype(dtype), weights.astype(dtype)
+
+def _bilinear(rows, cols, n_rows, n_cols, wrap_cols=False):
+    # return the 4 (row,col) corner pixels and weights of each point
+    r0 = numpy.floor(rows)
+    c0 = numpy.floor(cols)
+    fr = rows-r0
+    fc = cols-c0
+    r0 = r0.astype(numpy.intp)
+    c0 = c0.astype(numpy.intp)
+    corners = []
+    for dr, wr in ((0, 1-fr), (1, fr)):
+        r = numpy.clip(r0+dr, 0, n_rows-1)
+        for dc, wc in ((0, 1-fc), (1, fc)):
+            if wrap_cols:
+                c = numpy.mod(c0+dc, n_cols)
+            else:
+                c = numpy.clip(c0+dc, 0, n_cols-1)
+            corners.append((r, c, wr*wc))
+    return corners
+
+def cube_lookup(dirs, res):
+    """return bilinear lookup pixels and weights of dirs in cube maps
+
+    Returns (pixels, weights), both of shape dirs.shape[:-1]+(4,).
+    pixels index flattened cube maps (see kernels.cube_pixel_dirs). At
+    face edges, the interpolation is clamped to the face.
+    """
+    dirs = numpy.asarray(dirs, dtype=numpy.float64)
+    ax = numpy.abs(dirs)
+    major = numpy.argmax(ax, axis=-1)
+    sign = numpy.take_along_axis(dirs, major[...,numpy.newaxis], axis=-1)[...,0] < 0
+    face = 2*major + sign # index in cube_order
+    m = numpy.max(ax, axis=-1)
+    X, Y, Z = dirs[...,0]/m, dirs[...,1]/m, dirs[...,2]/m
+    # face coordinates, inverting the layout of kernels.cube_pixel_dirs
+    zr = numpy.choose(face, [Z, Z, Z, Z, -X, X])
+    yc = numpy.choose(face, [Y, -Y, -X, X, Y, Y])
+    half_res = res//2
+    rows = zr*half_res + half_res
+    cols = (res-1) - (yc*half_res + half_res)
+    corners = _bilinear(rows, cols, res, res)
+    pixels = numpy.stack([face*res*res + r*res + c for r, c, w in corners], axis=-1)
+    weights = numpy.stack([w for r, c, w in corners], axis=-1)
+    return pixels, weights
+
+def equirect_lookup(dirs, height, width):
+    """return bilinear lookup pixels and weights of dirs in panoramas
+
+    Returns (pixels, weights), both of shape dirs.shape[:-1]+(4,).
+    pixels index flattened (height,width) equirectangular images. The
+    interpolation wraps around in longitude and is clamped at the
+    poles.
+    """
+    lonlat = dirs2lonlat(dirs, dtype=numpy.float64)
+    cols = (lonlat[...,0]+numpy.pi)/(2*numpy.pi)*width - 0.5
+    rows = (numpy.pi/2-lonlat[...,1])/numpy.pi*height - 0.5
+    corners = _bilinear(rows, cols, height, width, wrap_cols=True)
+    pixels = numpy.stack([r*width + c for r, c, w in corners], axis=-1)
+    weights = numpy.stack([w for r, c, w in corners], axis=-1)
+    return pixels, weights
+
+class TableSampler:
+    """compute receptor responses from a sample direction table
+
+    dirs (n_receptors,K,3) and weights (n_receptors,K) are e.g. the
+    result of make_sample_table. The sampling matrix of each input
+    format is built on first use and kept.
+    """
+    def __init__(self, dirs, weights):
+        self.dirs = numpy.asarray(dirs)
+        self.weights = numpy.asarray(weights)
+        if self.dirs.ndim != 3 or self.dirs.shape[2] != 3:
+            raise ValueError('dirs must have shape (n_receptors,K,3)')
+        if self.weights.shape != self.dirs.shape[:2]:
+            raise ValueError('weights must have shape (n_receptors,K)')
+        self.n_receptors = self.weights.shape[0]
+        self._matrices = {}
+
+    def _make_matrix(self, pixels, lookup_weights, n_pixels):
+        values = self.weights[...,numpy.newaxis]*lookup_weights
+        rows = numpy.broadcast_to(numpy.arange(self.n_receptors)[:,numpy.newaxis,numpy.newaxis],
+                                  pixels.shape)
+        matrix = scipy.sparse.csr_matrix((values.ravel(), (rows.ravel(), pixels.ravel())),
+                                         shape=(self.n_receptors, n_pixels))
+        matrix.sum_duplicates()
+        return matrix
+
+    def get_cubemap_matrix(self, res):
+        """return the (n_receptors,6*res*res) weight matrix for cube maps"""
+        key = ('cubemap', res)
+        if key not in self._matrices:
+            pixels, w = cube_lookup(self.dirs, res)
+            self._matrices[key] = self._make_matrix(pixels, w, 6*res*res)
+        return self._matrices[key]
+
+    def get_equirect_matrix(self, height, width):
+        """return the (n_receptors,height*width) weight matrix for panoramas"""
+        key = ('equirect', height, width)
+        if key not in self._matrices:
+            pixels, w = equirect_lookup(self.dirs, height, width)
+            self._matrices[key] = self._make_matrix(pixels, w, height*width)
+        return self._matrices[key]
+
+    def _sample(self, matrix, flat, batch_shape):
+        flat = flat.reshape((-1,matrix.shape[1]))
+        responses = matrix.dot(flat.T).T
+        return responses.reshape(batch_shape+(self.n_receptors,))
+
+    def sample_cubemap(self, frames, res=None):
+        """return receptor responses (...,n_receptors) of cube maps
+
+        frames are as for sampler.CubemapSampler. res is only needed
+        for flattened cube maps of shape (...,6*res*res) and is
+        otherwise taken from the frames.
+        """
+        if res is None:
+            if isinstance(frames, dict):
+                res = len(frames['posx'])
+            else:
+                frames = numpy.asarray(frames)
+                if frames.ndim >= 3 and frames.shape[-3] == 6:
+                    res = frames.shape[-1]
+                else:
+                    res = get_cube_res(frames.shape[-1])
+        flat = flatten_frames(frames, res)
+        return self._sample(self.get_cubemap_matrix(res), flat, flat.shape[:-1])
+
+    def sample_equirect(self, images):
+        """return receptor responses (...,n_receptors) of panoramas
+
+        images is an array of shape (...,height,width).
+        """
+        images = numpy.asarray(images)
+        height, width = images.shape[-2:]
+        matrix = self.get_equirect_matrix(height, width)
+        return self._sample(matrix, images, images.shape[:-2])
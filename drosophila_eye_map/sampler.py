@@ -0,0 +1,658 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Sample cube maps with a receptor weight matrix, and the reverse
+
+Cube maps are either dictionaries keyed by the names in ``cube_order``
+(as used by ``util.flatten_cubemap``), flattened arrays of shape
+(...,6*res*res) or arrays of shape (...,6,res,res) with the faces in
+``cube_order``. The weight matrix is e.g. ``receptor_weight_matrix_64``
+of precomputed_buchner71.py, of shape (n_receptors, 6*res*res)::
+
+    sampler = CubemapSampler(receptor_weight_matrix_64)
+    responses = sampler.sample(frames)     # (T,6,64,64) -> (T,n_receptors)
+
+    incremental = IncrementalSampler(receptor_weight_matrix_64)
+    for frame in frames:                   # closed loop, one frame at a time
+        response = incremental.sample(frame)
+
+    blocked = FaceBlockedSampler(receptor_weight_matrix_64, n_threads=6)
+    responses = blocked.sample(frames, faces=['posx','negx','posy','negy','negz'])
+
+    ellpack = EllpackSampler.from_weights(receptor_weight_matrix_64)
+    responses = ellpack.sample(frames)     # no transposed copy of frames
+    ellpack = EllpackSampler(receptor_weight_indices_64,
+                             receptor_weight_values_64, n_pixels=6*64*64)
+
+    rotated = OrientationCachedSampler(receptor_dirs, GaussianKernel(delta_rho))
+    response = rotated.sample(frame, head_rotation) # weights cached per pose
+
+    adjoint = AdjointSampler(receptor_weight_matrix_64)
+    cubemaps = adjoint.render(responses)   # (T,n_receptors) -> (T,6,64,64)
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.sparse
+from collections import OrderedDict
+
+from util import flatten_cubemap, cube_order, get_ellpack
+from coords import normalize_dirs, rotate_dirs, rotation_to_quaternion, \
+     quaternion_to_rotation, tangent_basis
+from kernels import make_weight_matrix
+from reorder import get_receptor_order, get_pixel_order, invert_permutation
+
+def get_cube_res(n_pixels):
+    """return the cube face resolution for a flattened cube map size"""
+    res = int(round(numpy.sqrt(n_pixels//6)))
+    if 6*res*res != n_pixels:
+        raise ValueError('%d pixels is not a flattened cube map'%n_pixels)
+    return res
+
+def flatten_frames(frames, res):
+    """return frames as an array of shape (...,6*res*res)
+
+    frames is a cube map dictionary, an array of flattened cube maps
+    or an array of shape (...,6,res,res).
+    """
+    if isinstance(frames, dict):
+        return flatten_cubemap(frames)
+    frames = numpy.asarray(frames)
+    n_pixels = 6*res*res
+    if frames.shape[-1] == n_pixels:
+        return frames
+    if frames.shape[-3:] == (6,res,res):
+        return frames.reshape(frames.shape[:-3]+(n_pixels,))
+    raise ValueError('frames of shape %s are not %dx%d cube maps'%(
+        frames.shape, res, res))
+
+class CubemapSampler:
+    """compute receptor responses from cube maps"""
+    def __init__(self, weights):
+        self.weights = scipy.sparse.csr_matrix(weights)
+        self.n_receptors, self.n_pixels = self.weights.shape
+        self.res = get_cube_res(self.n_pixels)
+
+    def sample(self, frames):
+        """return receptor responses of shape (...,n_receptors)"""
+        flat = flatten_frames(frames, self.res)
+        batch_shape = flat.shape[:-1]
+        flat = flat.reshape((-1,self.n_pixels))
+        responses = self.weights.dot(flat.T).T
+        return responses.reshape(batch_shape+(self.n_receptors,))
+
+def get_face_index(face):
+    """return the index in cube_order of a face name or index"""
+    if isinstance(face, str):
+        return cube_order.index(face)
+    return int(face)
+
+def get_face_blocks(weights):
+    """split a weight matrix into its six per-face column blocks
+
+    Returns (blocks, face_receptors). blocks[i] is a CSR matrix with
+    the weights of face cube_order[i] for the receptors
+    face_receptors[i], the (sorted) indices of the receptors whose
+    weights touch that face.
+    """
+    weights = scipy.sparse.csc_matrix(weights)
+    n_receptors, n_pixels = weights.shape
+    n_face_pixels = n_pixels//6
+    blocks = []
+    face_receptors = []
+    for i in range(6):
+        block = weights[:,i*n_face_pixels:(i+1)*n_face_pixels].tocsr()
+        rows = numpy.nonzero(numpy.diff(block.indptr))[0]
+        blocks.append(block[rows])
+        face_receptors.append(rows)
+    return blocks, face_receptors
+
+class FaceBlockedSampler:
+    """compute receptor responses face by face
+
+    The weight matrix is stored as six per-face blocks, each holding
+    only the receptors that see the face (most receptors see only one
+    or two faces). A face contributes only to its receptors, so faces
+    can be sampled independently: in parallel (n_threads>1, the
+    sparse products release the GIL), as they arrive from the
+    renderer, or not at all if they are not rendered.
+
+    sample() computes responses from (some faces of) whole cube maps.
+    For streaming, update_face() stores the contribution of one face
+    and response() returns the sum of the stored contributions, so
+    faces that did not change need not be resampled.
+
+    With n_threads>1, the worker threads are started on first use and
+    stopped by close(), or by leaving a with statement::
+
+        with FaceBlockedSampler(weights, n_threads=6) as blocked:
+            responses = blocked.sample(frames)
+    """
+    def __init__(self, weights, n_threads=1):
+        weights = scipy.sparse.csr_matrix(weights)
+        self.n_receptors, self.n_pixels = weights.shape
+        self.res = get_cube_res(self.n_pixels)
+        self.n_face_pixels = self.res*self.res
+        self.blocks, self.face_receptors = get_face_blocks(weights)
+        self.n_threads = n_threads
+        self._pool = None
+        self.reset()
+
+    def reset(self):
+        """discard the face contributions stored by update_face()"""
+        self.face_contributions = [None]*6
+
+    def _get_pool(self):
+        if self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self.n_threads)
+        return self._pool
+
+    def close(self):
+        """stop the worker threads (they are restarted if needed)"""
+        if getattr(self, '_pool', None) is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def _face_pixels(self, pixels):
+        pixels = numpy.asarray(pixels)
+        if pixels.shape[-2:] == (self.res,self.res):
+            pixels = pixels.reshape(pixels.shape[:-2]+(self.n_face_pixels,))
+        elif pixels.shape[-1] != self.n_face_pixels:
+            raise ValueError('face of shape %s is not %dx%d'%(
+                pixels.shape, self.res, self.res))
+        return pixels
+
+    def sample_face(self, face, pixels):
+        """return the contribution of one face to its receptors
+
+        pixels has shape (...,res,res) or (...,res*res). The result has
+        shape (...,n) for the n receptors face_receptors[face].
+        """
+        i = get_face_index(face)
+        pixels = self._face_pixels(pixels)
+        batch_shape = pixels.shape[:-1]
+        flat = pixels.reshape((-1,self.n_face_pixels))
+        contribution = self.blocks[i].dot(flat.T).T
+        return contribution.reshape(batch_shape+(len(self.face_receptors[i]),))
+
+    def _accumulate(self, contributions, batch_shape, dtype):
+        result = numpy.zeros(batch_shape+(self.n_receptors,), dtype=dtype)
+        for i, contribution in contributions:
+            result[...,self.face_receptors[i]] += contribution
+        return result
+
+    def sample(self, frames, faces=None):
+        """return receptor responses of shape (...,n_receptors)
+
+        frames are cube maps as for CubemapSampler. Only the faces
+        listed in faces (names or indices, default all) are sampled,
+        the others count as black. A cube map dictionary needs to hold
+        only the listed faces; by default, the faces it holds are
+        sampled.
+        """
+        if isinstance(frames, dict):
+            if faces is None:
+                faces = [name for name in cube_order if name in frames]
+            faces = [get_face_index(face) for face in faces]
+            face_pixels = dict((i, self._face_pixels(frames[cube_order[i]]))
+                               for i in faces)
+        else:
+            frames = numpy.asarray(frames)
+            if frames.shape[-1] == self.n_pixels:
+                frames = frames.reshape(frames.shape[:-1]+(6,self.n_face_pixels))
+            elif frames.shape[-3:] == (6,self.res,self.res):
+                frames = frames.reshape(frames.shape[:-3]+(6,self.n_face_pixels))
+            else:
+                raise ValueError('frames of shape %s are not %dx%d cube maps'%(
+                    frames.shape, self.res, self.res))
+            if faces is None:
+                faces = range(6)
+            faces = [get_face_index(face) for face in faces]
+            face_pixels = dict((i, frames[...,i,:]) for i in faces)
+        if not faces:
+            raise ValueError('no faces to sample')
+
+        def work(i):
+            return i, self.sample_face(i, face_pixels[i])
+        if self.n_threads > 1 and len(faces) > 1:
+            contributions = self._get_pool().map(work, faces)
+        else:
+            contributions = [work(i) for i in faces]
+        first = face_pixels[faces[0]]
+        dtype = numpy.result_type(first.dtype, self.blocks[0].dtype)
+        return self._accumulate(contributions, first.shape[:-1], dtype)
+
+    def update_face(self, face, pixels):
+        """store the contribution of a newly rendered face"""
+        i = get_face_index(face)
+        self.face_contributions[i] = self.sample_face(i, pixels)
+
+    def clear_face(self, face):
+        """let a face count as black (e.g. if it is not rendered)"""
+        self.face_contributions[get_face_index(face)] = None
+
+    def response(self):
+        """return the responses (...,n_receptors) to the stored faces"""
+        contributions = [(i, c) for i, c in enumerate(self.face_contributions)
+                         if c is not None]
+        if not len(contributions):
+            return numpy.zeros((self.n_receptors,))
+        batch_shape = contributions[0][1].shape[:-1]
+        dtype = numpy.result_type(*[c.dtype for i, c in contributions])
+        return self._accumulate(contributions, batch_shape, dtype)
+
+class IncrementalSampler:
+    """compute receptor responses to a sequence of similar cube maps
+
+    Instead of the full sparse product for every frame, only the
+    pixels that changed since the previous frame are used to update
+    the previous response: the columns of the weight matrix (kept in
+    CSC format, i.e. indexed by pixel) of the changed pixels are
+    scaled by the pixel differences and added to the affected
+    receptors. If more than fallback_fraction of the pixels changed,
+    the full product is computed instead. The response is also
+    recomputed fully every resync_interval frames (if not None) to
+    discard accumulated rounding errors.
+    """
+    def __init__(self, weights, fallback_fraction=0.2, resync_interval=1000):
+        weights = scipy.sparse.csr_matrix(weights)
+        self.n_receptors, self.n_pixels = weights.shape
+        self.res = get_cube_res(self.n_pixels)
+        self.weights = weights
+        self.weights_csc = weights.tocsc()
+        self.weights_csc.sort_indices()
+        self.fallback_fraction = fallback_fraction
+        self.resync_interval = resync_interval
+        self.reset()
+
+    def reset(self):
+        """forget the previous frame"""
+        self.previous = None
+        self.response = None
+        self.n_full = 0
+        self.n_incremental = 0
+        self._since_full = 0
+
+    def _full(self, flat):
+        self.response = self.weights.dot(flat)
+        self.n_full += 1
+        self._since_full = 0
+
+    def sample(self, frame, changed=None, changed_tiles=None):
+        """return the receptor responses (n_receptors,) to one cube map
+
+        changed optionally gives the pixels (indices into the
+        flattened cube map, or a boolean mask) that may differ from
+        the previous frame, e.g. the dirty region known to the
+        renderer. changed_tiles gives the same as a sequence of
+        (face, rows, cols) rectangles, where face is a name or index
+        in cube_order and rows and cols are slices of the face (None
+        for the whole face), e.g. [('posx', slice(0,16), None)]. The
+        union of both is used. If neither is given, the changed pixels
+        are found by comparing the frames.
+        """
+        flat = flatten_frames(frame, self.res)
+        if flat.shape != (self.n_pixels,):
+            raise ValueError('IncrementalSampler takes one cube map at a time')
+        flat = numpy.array(flat, dtype=numpy.float64)
+        if self.previous is None or (self.resync_interval is not None and
+                                     self._since_full >= self.resync_interval):
+            self._full(flat)
+        else:
+            if changed is None and changed_tiles is None:
+                changed = numpy.nonzero(flat != self.previous)[0]
+            else:
+                # as a mask, so that repeated pixels are updated once
+                mask = numpy.zeros((6,self.res,self.res), dtype=bool)
+                if changed is not None:
+                    changed = numpy.asarray(changed)
+                    if changed.dtype == bool:
+                        mask.ravel()[:] |= changed
+                    else:
+                        mask.ravel()[changed] = True
+                for face, rows, cols in (changed_tiles or []):
+                    if rows is None:
+                        rows = slice(None)
+                    if cols is None:
+                        cols = slice(None)
+                    mask[get_face_index(face), rows, cols] = True
+                changed = numpy.nonzero(mask.ravel())[0]
+            if len(changed) > self.fallback_fraction*self.n_pixels:
+                self._full(flat)
+            elif len(changed):
+                self._update(changed, flat[changed]-self.previous[changed])
+                self.n_incremental += 1
+                self._since_full += 1
+            else:
+                self.n_incremental += 1
+                self._since_full += 1
+        self.previous = flat
+        return self.response.copy()
+
+    def _update(self, changed, delta):
+        W = self.weights_csc
+        starts = W.indptr[changed]
+        counts = W.indptr[changed+1]-starts
+        total = numpy.sum(counts)
+        if not total:
+            return
+        # indices into W.data of all entries in the changed columns
+        offsets = numpy.repeat(starts-numpy.cumsum(counts)+counts, counts)
+        entries = numpy.arange(total)+offsets
+        contributions = W.data[entries]*numpy.repeat(delta, counts)
+        self.response += numpy.bincount(W.indices[entries],
+                                        weights=contributions,
+                                        minlength=self.n_receptors)
+
+class ReorderedSampler:
+    """CubemapSampler with receptors and pixels reordered for locality
+
+    Internally, the receptors are sorted along a space-filling curve
+    and the pixels of each face in Morton order (see reorder.py), so
+    that the receptors that are processed one after the other read
+    pixels that are close in memory. The interface uses the original
+    indices: sample() takes cube maps as usual and returns responses
+    in the order of receptor_dirs. A renderer that already produces
+    pixels in the internal order (flat[...,pixel_perm]) can call
+    sample_reordered() to skip the pixel permutation.
+    """
+    def __init__(self, weights, receptor_dirs, receptor_dir_slicer=None,
+                 reorder_receptors=True, reorder_pixels=True):
+        weights = scipy.sparse.csr_matrix(weights)
+        self.n_receptors, self.n_pixels = weights.shape
+        self.res = get_cube_res(self.n_pixels)
+        if reorder_receptors:
+            self.receptor_perm = get_receptor_order(receptor_dirs,
+                                                    receptor_dir_slicer)
+        else:
+            self.receptor_perm = numpy.arange(self.n_receptors)
+        if reorder_pixels:
+            self.pixel_perm = get_pixel_order(self.res)
+        else:
+            self.pixel_perm = numpy.arange(self.n_pixels)
+        self.receptor_inverse = invert_permutation(self.receptor_perm)
+        self.weights = weights[self.receptor_perm][:,self.pixel_perm]
+        self.weights.sort_indices()
+
+    def _sample_columns(self, columns, batch_shape):
+        # columns has shape (n_pixels, n_frames) in internal pixel order
+        responses = self.weights.dot(columns)
+        responses = responses[self.receptor_inverse].T
+        return responses.reshape(batch_shape+(self.n_receptors,))
+
+    def sample_reordered(self, flat):
+        """return responses (...,n_receptors) to pixels in internal order"""
+        flat = numpy.asarray(flat)
+        columns = numpy.ascontiguousarray(flat.reshape((-1,self.n_pixels)).T)
+        return self._sample_columns(columns, flat.shape[:-1])
+
+    def sample(self, frames):
+        """return receptor responses of shape (...,n_receptors)"""
+        flat = flatten_frames(frames, self.res)
+        # permute the pixels while transposing, in a single copy
+        columns = flat.reshape((-1,self.n_pixels)).T[self.pixel_perm]
+        return self._sample_columns(columns, flat.shape[:-1])
+
+class EllpackSampler:
+    """compute receptor responses with a padded gather of pixels
+
+    The weights are stored as (n_receptors, K) arrays of pixel indices
+    and weights (see util.get_ellpack, or the optional
+    receptor_weight_indices_64 and receptor_weight_values_64 of
+    precomputed_buchner71.py). Sampling gathers the K pixels of every
+    receptor with numpy.take and reduces them with the weights. Unlike
+    the sparse product, this works directly on frames of shape
+    (batch, n_pixels) without transposing them. To bound memory use,
+    batches are processed in chunks of at most max_gather elements.
+
+    n_pixels is the size of the flattened cube maps (6*res*res). It
+    cannot be inferred from the indices, as the pixels at the end of
+    the cube map need not be used by any receptor.
+    """
+    def __init__(self, indices, values, n_pixels, max_gather=2**22):
+        self.indices = numpy.ascontiguousarray(indices, dtype=numpy.intp)
+        self.values = numpy.ascontiguousarray(values)
+        self._values_column = self.values[:,:,numpy.newaxis]
+        if self.indices.shape != self.values.shape or self.indices.ndim != 2:
+            raise ValueError('indices and values must have the same shape (n_receptors, K)')
+        self.n_receptors, self.K = self.indices.shape
+        if self.indices.size and int(numpy.max(self.indices)) >= n_pixels:
+            raise ValueError('pixel index %d out of range for %d pixels'%(
+                numpy.max(self.indices), n_pixels))
+        self.n_pixels = n_pixels
+        self.res = get_cube_res(self.n_pixels)
+        self.chunk_size = max(1, max_gather//max(1,self.n_receptors*self.K))
+        self._gather_buffer = None
+
+    @classmethod
+    def from_weights(cls, weights, **kwargs):
+        indices, values = get_ellpack(weights)
+        return cls(indices, values, n_pixels=weights.shape[1], **kwargs)
+
+    def _get_buffer(self, n_frames, dtype):
+        buf = self._gather_buffer
+        if buf is None or buf.dtype != dtype or len(buf) < n_frames:
+            shape = (min(self.chunk_size, n_frames), self.n_receptors, self.K)
+            buf = self._gather_buffer = numpy.empty(shape, dtype=dtype)
+        return buf[:n_frames]
+
+    def sample(self, frames):
+        """return receptor responses of shape (...,n_receptors)"""
+        flat = flatten_frames(frames, self.res)
+        batch_shape = flat.shape[:-1]
+        flat = flat.reshape((-1,self.n_pixels))
+        n_frames = len(flat)
+        dtype = numpy.result_type(flat.dtype, self.values.dtype)
+        responses = numpy.empty((n_frames,self.n_receptors), dtype=dtype)
+        for start in range(0, n_frames, self.chunk_size):
+            chunk = flat[start:start+self.chunk_size]
+            gathered = self._get_buffer(len(chunk), flat.dtype)
+            # the indices are valid, mode='wrap' only skips the
+            # (slower) bounds checking of the default mode
+            numpy.take(chunk, self.indices, axis=1, mode='wrap', out=gathered)
+            # one dot product per receptor and frame, as batched matmul
+            reduced = numpy.matmul(gathered.transpose(1,0,2),
+                                   self._values_column)
+            responses[start:start+len(chunk)] = reduced[:,:,0].T
+        return responses.reshape(batch_shape+(self.n_receptors,))
+
+def quantize_rotation(rotation, resolution):
+    """return the grid cell of a rotation and the rotation at its center
+
+    rotation is a 3x3 matrix. The unit quaternion of the rotation is
+    rounded to a grid with a spacing of resolution/2, so that all
+    rotations in a cell differ from the center rotation by at most
+    about resolution (in radians). Returns (key, center) where key is a
+    hashable tuple of grid coordinates and center a 3x3 matrix.
+    """
+    q = rotation_to_quaternion(rotation, dtype=numpy.float64)
+    cell = numpy.round(q/(resolution/2)).astype(numpy.int64)
+    key = tuple(int(c) for c in cell)
+    if not numpy.any(cell):
+        # only possible for resolution > 1, use the identity cell
+        cell = numpy.array([1, 0, 0, 0])
+    return key, quaternion_to_rotation(cell)
+
+class OrientationCachedSampler:
+    """compute receptor responses of a rotating head from cube maps
+
+    The cube maps are rendered in world coordinates and the head
+    rotation is given with each frame as a 3x3 matrix taking head
+    (receptor_dirs) coordinates to world coordinates. The rotation is
+    quantized (see quantize_rotation) and the weight matrix of the
+    rotated receptor directions (kernels.make_weight_matrix with
+    kernel) is built on first use of a grid cell and then cached.
+
+    The cache holds up to max_bytes of weight matrices. When it is
+    full, the least recently used matrices are discarded. hits and
+    misses count the lookups. The kernel is oriented in the tangent
+    basis of the head directions, rotated with the head, so that
+    anisotropic kernels turn with the head.
+    """
+    def __init__(self, receptor_dirs, kernel, res=64, resolution=numpy.pi/180,
+                 max_bytes=2**28, clip_thresh=1e-5, dtype=numpy.float32):
+        self.receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+        self.receptor_basis = tangent_basis(self.receptor_dirs)
+        self.kernel = kernel
+        self.res = res
+        self.n_receptors = len(self.receptor_dirs)
+        self.n_pixels = 6*res*res
+        self.resolution = resolution
+        self.max_bytes = max_bytes
+        self.clip_thresh = clip_thresh
+        self.dtype = dtype
+        self.clear()
+
+    def clear(self):
+        """empty the cache and reset the statistics"""
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        """fraction of lookups that found their weight matrix cached"""
+        n = self.hits + self.misses
+        return self.hits/n if n else 0.0
+
+    def cache_info(self):
+        """return a dict of the cache statistics"""
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, hit_rate=self.hit_rate,
+                    n_cached=len(self.cache), cache_bytes=self.cache_bytes,
+                    max_bytes=self.max_bytes)
+
+    def get_weights(self, rotation):
+        """return the (n_receptors,6*res*res) weight matrix of a rotation"""
+        key, center = quantize_rotation(rotation, self.resolution)
+        try:
+            weights = self.cache.pop(key)
+        except KeyError:
+            self.misses += 1
+            dirs = rotate_dirs(self.receptor_dirs, center)
+            basis = [rotate_dirs(b, center) for b in self.receptor_basis]
+            weights = make_weight_matrix(dirs, self.kernel, res=self.res,
+                                         clip_thresh=self.clip_thresh,
+                                         dtype=self.dtype, basis=basis)
+            n_bytes = (weights.data.nbytes + weights.indices.nbytes +
+                       weights.indptr.nbytes)
+            if n_bytes > self.max_bytes:
+                return weights # larger than the whole budget, do not cache
+            while self.cache and self.cache_bytes + n_bytes > self.max_bytes:
+                old_key, old = self.cache.popitem(last=False) # least recently used
+                self.cache_bytes -= (old.data.nbytes + old.indices.nbytes +
+                                     old.indptr.nbytes)
+                self.evictions += 1
+            self.cache_bytes += n_bytes
+        else:
+            self.hits += 1
+        self.cache[key] = weights
+        return weights
+
+    def sample(self, frames, rotation):
+        """return receptor responses (...,n_receptors) for one head rotation
+
+        All frames are sampled with the same rotation.
+        """
+        weights = self.get_weights(rotation)
+        flat = flatten_frames(frames, self.res)
+        batch_shape = flat.shape[:-1]
+        flat = flat.reshape((-1,self.n_pixels))
+        responses = weights.dot(flat.T).T
+        return responses.reshape(batch_shape+(self.n_receptors,))
+
+class AdjointSampler:
+    """project receptor activations back into cube maps
+
+    The transposed weight matrix is stored once, so that rendering a
+    batch of activation vectors is a single sparse matrix product. Each
+    pixel becomes the weighted sum of the activations of the receptors
+    that see it. With normalize=True, this is divided by the pixel's
+    total weight (the column sum of the weight matrix), which gives the
+    weighted mean activation instead. Pixels seen by no receptor are
+    zero.
+    """
+    def __init__(self, weights, normalize=False):
+        weights = scipy.sparse.csr_matrix(weights)
+        self.n_receptors, self.n_pixels = weights.shape
+        self.res = get_cube_res(self.n_pixels)
+        self.weights_T = weights.T.tocsr()
+        self.normalize = normalize
+
+        column_sums = numpy.asarray(weights.sum(axis=0)).ravel()
+        seen = column_sums > 0
+        self.inv_column_sums = numpy.zeros_like(column_sums)
+        self.inv_column_sums[seen] = 1.0/column_sums[seen]
+
+    def render(self, activations, normalize=None):
+        """return cube maps of shape (...,6,res,res)
+
+        activations has shape (...,n_receptors). If normalize is None,
+        the value given to the constructor is used.
+        """
+        if normalize is None:
+            normalize = self.normalize
+        activations = numpy.asarray(activations)
+        if activations.shape[-1] != self.n_receptors:
+            raise ValueError('expected %d receptor activations, got %d'%(
+                self.n_receptors, activations.shape[-1]))
+        batch_shape = activations.shape[:-1]
+        flat = activations.reshape((-1,self.n_receptors))
+        pixels = self.weights_T.dot(flat.T)      # (n_pixels, T)
+        if normalize:
+            pixels *= self.inv_column_sums[:,numpy.newaxis]
+        pixels = numpy.ascontiguousarray(pixels.T)
+        return pixels.reshape(batch_shape+(6,self.res,self.res))
+
+def test_face_blocked_missing_face():
+    res = 4
+    weights = scipy.sparse.random(10, 6*res*res, density=0.3, random_state=0)
+    frames = numpy.random.RandomState(0).uniform(size=(2,6,res,res))
+    faces = [name for name in cube_order if name != 'posz']
+    cubemap = dict((name, frames[:,i]) for i, name in enumerate(cube_order)
+                   if name != 'posz')
+    black = frames.copy()
+    black[:,cube_order.index('posz')] = 0
+    expected = CubemapSampler(weights).sample(black)
+    blocked = FaceBlockedSampler(weights)
+    assert numpy.allclose(blocked.sample(cubemap, faces=faces), expected)
+    assert numpy.allclose(blocked.sample(cubemap), expected)
+    assert numpy.allclose(blocked.sample(frames, faces=faces), expected)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Receptor responses in the spherical harmonic domain
+
+For smooth (band-limited) environments, a cube map can be reduced to
+its real spherical harmonic (SH) coefficients up to a band limit lmax,
+(lmax+1)**2 numbers. An isotropic acceptance function centred on a
+receptor direction is zonal, so by the Funk-Hecke theorem its
+response to an environment is a weighted sum of the SH coefficients
+with weights Y_lm(receptor_dir)*k_l, where k_l depends only on the
+band. Rotations of the environment (or of the head) act on each band
+separately, by multiplication with a (2l+1)x(2l+1) matrix::
+
+    projector = CubemapProjector(res=64, lmax=16)
+    coeffs = projector.project(frames)              # (T,289)
+    model = SHReceptorModel(receptor_dirs, GaussianKernel(delta_rho), lmax=16)
+    responses = model.sample(coeffs)                # (T,n_receptors)
+    responses = model.sample_rotated(coeffs[0], head_rotations) # (R,n_receptors)
+
+The real SH are orthonormal on the unit sphere, without the
+Condon-Shortley phase. Coefficient (l,m) is at index l*l+l+m, with
+m<0 for the sine and m>0 for the cosine terms.
+"""
+from __future__ import division, print_function
+
+import numpy
+
+from coords import normalize_dirs
+from kernels import cube_pixel_dirs
+from sampler import flatten_frames
+
+def get_n_coeffs(lmax):
+    """return the number of SH coefficients up to band lmax"""
+    return (lmax+1)**2
+
+def real_sh(dirs, lmax):
+    """evaluate the real SH up to band lmax at directions (...,3)
+
+    Returns an array of shape dirs.shape[:-1]+((lmax+1)**2,).
+    """
+    dirs = normalize_dirs(dirs, dtype=numpy.float64)
+    x, y, z = dirs[...,0], dirs[...,1], dirs[...,2]
+    sin_theta = numpy.hypot(x, y)
+    phi = numpy.arctan2(y, x)
+    result = numpy.empty(dirs.shape[:-1]+(get_n_coeffs(lmax),))
+
+    # normalized associated Legendre functions by the standard
+    # recurrences, column by column in m
+    p_mm = numpy.full(z.shape, numpy.sqrt(1/(4*numpy.pi)))
+    for m in range(lmax+1):
+        if m > 0:
+            p_mm = numpy.sqrt((2*m+1)/(2*m))*sin_theta*p_mm
+        if m == 0:
+            cos_m, sin_m = 1.0, None
+        else:
+            cos_m = numpy.sqrt(2)*numpy.cos(m*phi)
+            sin_m = numpy.sqrt(2)*numpy.sin(m*phi)
+        p_prev, p = None, p_mm
+        for l in range(m, lmax+1):
+            if l == m+1:
+                p_prev, p = p, numpy.sqrt(2*m+3)*z*p
+            elif l > m+1:
+                a = numpy.sqrt((4*l*l-1)/(l*l-m*m))
+                b = numpy.sqrt(((l-1)**2-m*m)/(4*(l-1)**2-1))
+                p_prev, p = p, a*(z*p-b*p_prev)
+            result[...,l*l+l+m] = cos_m*p
+            if m > 0:
+                result[...,l*l+l-m] = sin_m*p
+    return result
+
+def cube_solid_angles(res):
+    """return the solid angle of every cube map pixel, (6,res,res)
+
+    The pixels of the weight matrix layout are centred on the sample
+    directions of kernels.cube_pixel_dirs, which are offset by half a
+    pixel, so the pixel cells are clipped to the face and the total
+    rescaled to 4*pi.
+    """
+    half_res = res//2
+    vals = (numpy.arange(res)-half_res)/half_res
+    lo = numpy.maximum(vals-1/res, -1)
+    hi = numpy.minimum(vals+1/res, 1)
+    def F(u, v):
+        return numpy.arctan2(u*v, numpy.sqrt(1+u*u+v*v))
+    u0, v0 = numpy.meshgrid(lo, lo, indexing='ij')
+    u1, v1 = numpy.meshgrid(hi, hi, indexing='ij')
+    face = F(u1,v1)-F(u0,v1)-F(u1,v0)+F(u0,v0)
+    omega = numpy.tile(face, (6,1,1))
+    return omega*(4*numpy.pi/numpy.sum(omega))
+
+class CubemapProjector:
+    """project cube maps onto real SH up to band lmax
+
+    The projection matrix (6*res*res,(lmax+1)**2) is computed once. By
+    default, it gives the least squares fit of the SH to the pixels,
+    weighted by the pixel solid angles, which is exact for
+    band-limited environments. With least_squares=False, it is the
+    SH at the pixel directions times the pixel solid angles
+    (quadrature of the projection integrals), which is cheaper to
+    set up but less accurate because of the uneven pixel layout.
+    """
+    def __init__(self, res=64, lmax=16, least_squares=True):
+        self.res = res
+        self.lmax = lmax
+        self.n_pixels = 6*res*res
+        self.basis = real_sh(cube_pixel_dirs(res).reshape((-1,3)), lmax)
+        omega = cube_solid_angles(res).reshape((-1,1))
+        if least_squares:
+            sqrt_omega = numpy.sqrt(omega)
+            self.projection = (numpy.linalg.pinv(self.basis*sqrt_omega)*sqrt_omega.T).T
+        else:
+            self.projection = self.basis*omega
+
+    def project(self, frames):
+        """return SH coefficients (...,(lmax+1)**2) of cube maps (...,6,res,res)"""
+        flat = flatten_frames(frames, self.res)
+        return numpy.dot(flat, self.projection)
+
+    def reconstruct(self, coeffs):
+        """return the band-limited cube maps (...,6,res,res) of SH coefficients"""
+        coeffs = numpy.asarray(coeffs)
+        flat = numpy.dot(coeffs, self.basis.T)
+        return flat.reshape(coeffs.shape[:-1]+(6,self.res,self.res))
+
+def get_zonal_coeffs(kernel, lmax, n_receptors, n_nodes=None):
+    """return the Funk-Hecke coefficients k_l of an isotropic kernel
+
+    kernel is an isotropic acceptance function of kernels.py (e.g.
+    GaussianKernel or AiryKernel), evaluated as kernel(receptor_idx,
+    zeta, zeta, 0). k_l is the integral of the kernel times the
+    Legendre polynomial P_l(cos(zeta)) over the sphere, divided by the
+    integral of the kernel (unit gain, so k_0 == 1). The integrals are
+    computed with Gauss-Legendre quadrature over the support.
+
+    Returns an array (n_receptors,lmax+1).
+    """
+    if n_nodes is None:
+        n_nodes = 4*lmax+64
+    support = numpy.minimum(numpy.broadcast_to(kernel.support(), (n_receptors,)),
+                            numpy.pi)
+    t, w = numpy.polynomial.legendre.leggauss(n_nodes)
+    zeta = (t[numpy.newaxis,:]+1)/2*support[:,numpy.newaxis] # (n_receptors,n_nodes)
+    w = w[numpy.newaxis,:]*support[:,numpy.newaxis]/2
+    idx = numpy.arange(n_receptors)[:,numpy.newaxis]
+    integrand = kernel(idx, zeta, zeta, numpy.zeros_like(zeta))*numpy.sin(zeta)*w
+
+    cos_zeta = numpy.cos(zeta)
+    result = numpy.empty((n_receptors,lmax+1))
+    p_prev, p = numpy.zeros_like(zeta), numpy.ones_like(zeta)
+    for l in range(lmax+1):
+        result[:,l] = numpy.sum(integrand*p, axis=1)
+        p_prev, p = p, ((2*l+1)*cos_zeta*p - l*p_prev)/(l+1)
+    return result/result[:,:1]
+
+def fibonacci_dirs(n):
+    """return n nearly uniformly spaced unit vectors (n,3)"""
+    i = numpy.arange(n)+0.5
+    z = 1-2*i/n
+    phi = numpy.pi*(1+numpy.sqrt(5))*i
+    r = numpy.sqrt(1-z*z)
+    return numpy.column_stack([r*numpy.cos(phi), r*numpy.sin(phi), z])
+
+class SHRotator:
+    """rotate SH coefficients up to band lmax
+
+    The rotation matrix of each band is fitted from the SH at a fixed
+    set of directions and at the same directions rotated, which is
+    exact because each band is closed under rotation. The
+    pseudoinverses of the fit are computed once.
+    """
+    def __init__(self, lmax, n_dirs=None):
+        self.lmax = lmax
+        if n_dirs is None:
+            n_dirs = 2*get_n_coeffs(lmax)
+        self.dirs = fibonacci_dirs(n_dirs)
+        basis = real_sh(self.dirs, lmax)
+        self.bands = [slice(l*l, (l+1)**2) for l in range(lmax+1)]
+        self.pinv = [numpy.linalg.pinv(basis[:,band]) for band in self.bands]
+
+    def get_matrices(self, rotations):
+        """return one (R,2l+1,2l+1) array per band for rotations (R,3,3)
+
+        The band matrix D takes the coefficients of a function f to
+        those of f rotated by the rotation matrix M, f(M.T*v), as
+        D.dot(coeffs[band]).
+        """
+        rotations = numpy.asarray(rotations, dtype=numpy.float64).reshape((-1,3,3))
+        # f(M.T*v) at the fixed directions v
+        rotated = numpy.matmul(self.dirs, rotations) # rows are M.T*v
+        basis = real_sh(rotated, self.lmax)          # (R,n_dirs,n_coeffs)
+        return [numpy.matmul(pinv, basis[:,:,band])
+                for pinv, band in zip(self.pinv, self.bands)]
+
+    def rotate(self, coeffs, rotations):
+        """return coeffs (...,n_coeffs) rotated by each of rotations (R,3,3)
+
+        Returns an array of shape (R,...,n_coeffs).
+        """
+        coeffs = numpy.asarray(coeffs)
+        matrices = self.get_matrices(rotations)
+        result = numpy.empty((len(matrices[0]),)+coeffs.shape)
+        for D, band in zip(matrices, self.bands):
+            c = coeffs[...,band]
+            # (R,2l+1,2l+1) x (...,2l+1) -> (R,...,2l+1)
+            result[...,band] = numpy.einsum('rij,...j->r...i', D, c)
+        return result
+
+class SHReceptorModel:
+    """compute receptor responses from SH coefficients
+
+    receptor_dirs are the receptor directions and kernel an isotropic
+    acceptance function of kernels.py. The response matrix
+    (n_receptors,(lmax+1)**2) is k_l*Y_lm(receptor_dir) (see
+    get_zonal_coeffs).
+    """
+    def __init__(self, receptor_dirs, kernel, lmax=16):
+        self.receptor_dirs = normalize_dirs(receptor_dirs, dtype=numpy.float64)
+        self.n_receptors = len(self.receptor_dirs)
+        self.lmax = lmax
+        self.zonal = get_zonal_coeffs(kernel, lmax, self.n_receptors)
+        l = numpy.repeat(numpy.arange(lmax+1), 2*numpy.arange(lmax+1)+1)
+        self.response_matrix = real_sh(self.receptor_dirs, lmax)*self.zonal[:,l]
+        self.rotator = None
+
+    def sample(self, coeffs):
+        """return receptor responses (...,n_receptors) of coefficients"""
+        return numpy.dot(coeffs, self.response_matrix.T)
+
+    def sample_rotated(self, coeffs, rotations):
+        """return responses (R,...,n_receptors) for head rotations (R,3,3)
+
+        Each rotation takes head (receptor_dirs) coordinates to world
+        (environment) coordinates. The environment is rotated into head
+        coordinates by the transposed rotations.
+        """
+        if self.rotator is None:
+            self.rotator = SHRotator(self.lmax)
+        rotations = numpy.asarray(rotations, dtype=numpy.float64).reshape((-1,3,3))
+        rotated = self.rotator.rotate(coeffs, rotations.transpose(0,2,1))
+        return self.sample(rotated)
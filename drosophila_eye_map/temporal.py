@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017, Albert-Ludwigs-Universität Freiburg
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Streaming temporal filters for receptor signals
+
+The receptor weight matrix only models the spatial acceptance of the
+ommatidia. The filters here add the temporal response of the
+photoreceptors (or any other per-receptor linear filter) to the
+output of a sampler, frame by frame or in chunks::
+
+    lowpass = make_lowpass_filter(dt=0.001, tau=0.01, n_channels=n_receptors)
+    stage = FilteredSampler(CubemapSampler(receptor_weight_matrix_64), lowpass)
+    for frame in frames:
+        response = stage.sample(frame)       # (n_receptors,)
+
+The filter state lives in arrays allocated once by the constructor and
+is updated in place, one sample at a time, with the same operations
+whether a sequence is processed at once, in chunks or frame by frame.
+The results of these are therefore identical. Give ``out`` to
+process() to also avoid allocating the output.
+"""
+from __future__ import division, print_function
+
+import numpy
+import scipy.signal
+
+def get_lowpass_coeffs(dt, tau, order=1):
+    """return (b, a) of a cascade of order first order low-pass filters
+
+    Each stage is the exact discretization of a first order low-pass
+    filter with time constant tau for a piecewise constant input
+    sampled at intervals dt. The DC gain is one.
+    """
+    decay = numpy.exp(-dt/tau)
+    b = numpy.array([(1.0-decay)**order])
+    a = numpy.array([1.0])
+    for i in range(order):
+        a = numpy.convolve(a, [1.0, -decay])
+    return b, a
+
+def get_lognormal_taps(dt, t_peak, sigma, duration=None):
+    """return FIR taps of the log-normal photoreceptor impulse response
+
+    The impulse response exp(-log(t/t_peak)**2/(2*sigma**2)) peaks at
+    t_peak (seconds) and sigma sets its width. It is sampled at
+    t=0,dt,2*dt,... up to duration (by default, until it has decayed
+    to 1e-4 of its peak) and normalized to unit DC gain.
+    """
+    if duration is None:
+        duration = t_peak*numpy.exp(sigma*numpy.sqrt(2*numpy.log(1e4)))
+    t = numpy.arange(1, int(numpy.ceil(duration/dt))+1)*dt
+    taps = numpy.exp(-numpy.log(t/t_peak)**2/(2*sigma**2))
+    taps = numpy.concatenate([[0.0], taps])
+    return taps/numpy.sum(taps)
+
+class _StreamingFilter:
+    def _prepare(self, x, out):
+        x = numpy.asarray(x, dtype=self.dtype)
+        single_frame = x.ndim == 1
+        if single_frame:
+            x = x[numpy.newaxis,:]
+        if x.ndim != 2 or x.shape[1] != self.n_channels:
+            raise ValueError('expected input of shape (T,%d) or (%d,)'%(
+                self.n_channels, self.n_channels))
+        if out is None:
+            out = numpy.empty(x.shape, dtype=self.dtype)
+        elif single_frame:
+            out = out[numpy.newaxis,:]
+        return x, out, single_frame
+
+    def process(self, x, out=None):
+        """filter x of shape (T, n_channels), or one frame (n_channels,)
+
+        Returns the filtered signal of the same shape (in out, if
+        given). The state is kept for the next call.
+        """
+        x, result, single_frame = self._prepare(x, out)
+        for t in range(len(x)):
+            self._step(x[t], result[t])
+        if single_frame:
+            result = result[0]
+        return result
+
+class IIRFilter(_StreamingFilter):
+    """IIR filter with transfer function b/a on every channel
+
+    The filter is implemented in transposed direct form II, like
+    scipy.signal.lfilter, with a state array of shape
+    (order, n_channels).
+    """
+    def __init__(self, b, a, n_channels, dtype=numpy.float64):
+        b = numpy.atleast_1d(numpy.asarray(b, dtype=numpy.float64))
+        a = numpy.atleast_1d(numpy.asarray(a, dtype=numpy.float64))
+        if a[0] == 0:
+            raise ValueError('a[0] must not be zero')
+        b = b/a[0]
+        a = a/a[0]
+        order = max(len(a), len(b))-1
+        self.b = numpy.zeros((order+1,))
+        self.b[:len(b)] = b
+        self.a = numpy.zeros((order+1,))
+        self.a[:len(a)] = a
+        self.order = order
+        self.n_channels = n_channels
+        self.dtype = numpy.dtype(dtype)
+        self.z = numpy.zeros((order, n_channels), dtype=self.dtype)
+        self._tmp = numpy.empty((n_channels,), dtype=self.dtype)
+
+    def reset(self, x0=None):
+        """start from rest, or from the steady state for constant input x0"""
+        if x0 is None or self.order == 0:
+            self.z[:] = 0
+        else:
+            zi = scipy.signal.lfilter_zi(self.b, self.a)
+            numpy.multiply(zi[:,numpy.newaxis], x0, out=self.z)
+
+    def _step(self, xt, yt):
+        b, a, z, tmp = self.b, self.a, self.z, self._tmp
+        numpy.multiply(b[0], xt, out=yt)
+        if not self.order:
+            return
+        yt += z[0]
+        for i in range(self.order):
+            # z[i] = b[i+1]*x + z[i+1] - a[i+1]*y
+            numpy.multiply(b[i+1], xt, out=z[i])
+            if i+1 < self.order:
+                z[i] += z[i+1]
+            numpy.multiply(a[i+1], yt, out=tmp)
+            z[i] -= tmp
+
+class FIRFilter(_StreamingFilter):
+    """FIR filter with the given taps on every channel
+
+    The last len(taps) input frames are kept in a ring buffer of shape
+    (len(taps), n_channels), so each frame costs one write and one
+    matrix-vector product.
+    """
+    def __init__(self, taps, n_channels, dtype=numpy.float64):
+        taps = numpy.atleast_1d(numpy.asarray(taps, dtype=numpy.float64))
+        self.taps = taps
+        self.n_taps = len(taps)
+        self.n_channels = n_channels
+        self.dtype = numpy.dtype(dtype)
+        self.buffer = numpy.zeros((self.n_taps, n_channels), dtype=self.dtype)
+        self.pos = 0 # index of the most recent frame in buffer
+        # With the newest frame at pos, buffer row j is weighted with
+        # taps[(pos-j) % n_taps]. These weights for all pos are
+        # contiguous slices of the reversed taps repeated twice.
+        reversed_taps = taps[::-1].astype(self.dtype)
+        self._weights = numpy.concatenate([reversed_taps, reversed_taps])
+
+    def reset(self, x0=None):
+        """start from rest, or from the steady state for constant input x0"""
+        if x0 is None:
+            self.buffer[:] = 0
+        else:
+            self.buffer[:] = x0
+        self.pos = 0
+
+    def _step(self, xt, yt):
+        n = self.n_taps
+        self.pos = (self.pos+1) % n
+        self.buffer[self.pos] = xt
+        start = n-1-self.pos
+        numpy.dot(self._weights[start:start+n], self.buffer, out=yt)
+
+def make_lowpass_filter(dt, tau, n_channels, order=1, dtype=numpy.float64):
+    """return an IIRFilter of order cascaded first order low-pass stages"""
+    b, a = get_lowpass_coeffs(dt, tau, order=order)
+    return IIRFilter(b, a, n_channels, dtype=dtype)
+
+def make_lognormal_filter(dt, t_peak, sigma, n_channels, duration=None,
+                          dtype=numpy.float64):
+    """return an FIRFilter with the log-normal photoreceptor response"""
+    taps = get_lognormal_taps(dt, t_peak, sigma, duration=duration)
+    return FIRFilter(taps, n_channels, dtype=dtype)
+
+class FilteredSampler:
+    """a sampler followed by a temporal filter of the receptor signals
+
+    sampler is e.g. a sampler.CubemapSampler and temporal_filter an
+    IIRFilter or FIRFilter with one channel per receptor. sample()
+    takes one frame or a sequence of frames (in time order) and keeps
+    the filter state between calls.
+    """
+    def __init__(self, sampler, temporal_filter):
+        self.sampler = sampler
+        self.temporal_filter = temporal_filter
+
+    def reset(self, x0=None):
+        self.temporal_filter.reset(x0)
+
+    def sample(self, frames, out=None):
+        """return filtered responses, (n_receptors,) or (T, n_receptors)"""
+        responses = self.sampler.sample(frames)
+        return self.temporal_filter.process(responses, out=out)
@@ -33,6 +33,9 @@ import Image
 import pylab
 import numpy
 
+from coords import get_rot_mat, LongLatRotator, \
+     xform_long_lat_2_stereographic, xform_stereographic_2_long_lat
+
 R2D=180/numpy.pi
 D2R=1/R2D
 
@@ -74,70 +77,8 @@ else:
                im_scale[1]*(0-center[1]),
                im_scale[1]*(1-center[1]))
 
-def get_rot_mat(theta,x,y,z):
-    # see http://en.wikipedia.org/wiki/Rotation_matrix
-    cos = numpy.cos(theta)
-    sin = numpy.sin(theta)
-    M = numpy.array([[cos+(1-cos)*x**2, (1-cos)*x*y+sin*z, (1-cos)*x*z-sin*y],
-                     [(1-cos)*y*x-sin*z, cos+(1-cos)*y**2, (1-cos)*y*z+sin*x],
-                     [(1-cos)*z*x+sin*y, (1-cos)*z*y-sin*x, cos+(1-cos)*z**2]])
-    return M
-
 rot90 = get_rot_mat(-numpy.pi/2,1,0,0)
 
-def xform_long_lat_2_stereographic(long,lat,R=1.0):
-    theta_P = long
-    rho_P = 2*R*numpy.tan((numpy.pi/2-lat)/2.0)
-
-    x=rho_P*numpy.cos(theta_P)
-    y=rho_P*numpy.sin(theta_P)
-
-    return x,y
-
-def xform_stereographic_2_long_lat(x,y,R=1.0):
-    x=numpy.asarray(x)
-    y=numpy.asarray(y)
-    R=numpy.asarray(R)
-    # convert to 2D polar
-    rho = numpy.sqrt(x**2+y**2)
-    theta = numpy.arctan2(y,x)
-
-    # convert to spherical
-    colat = 2*numpy.arctan(rho/(2*R))
-    lat = numpy.pi/2-colat
-
-    long = theta
-
-    return long, lat, R
-
-class LongLatRotator:
-    def __init__(self,rotmatrix):
-        self.rotmatrix = rotmatrix
-    def __call__(self,long,lat,R=1.0):
-        sin,cos,pi = numpy.sin, numpy.cos, numpy.pi
-
-        M = self.rotmatrix
-
-        colat = pi/2 - lat
-
-        # first, transform to 3D cartesian
-        x3 = R*sin(colat)*cos(long)
-        y3 = R*sin(colat)*sin(long)
-        z3 = R*cos(colat)
-
-        # next, transform to new 3D cartesian
-        xn = M[0,0]*x3 + M[0,1]*y3 + M[0,2]*z3
-        yn = M[1,0]*x3 + M[1,1]*y3 + M[1,2]*z3
-        zn = M[2,0]*x3 + M[2,1]*y3 + M[2,2]*z3
-
-        # finally, transform back to long, lat
-        rho = numpy.sqrt( xn**2 + yn**2 + zn**2 )
-        longn = numpy.arctan2(yn,xn)
-        colatn = numpy.arctan2( numpy.sqrt(xn**2 + yn**2), zn )
-
-        latn = pi/2-colatn
-        return longn,latn,rho
-
 Mforward = get_rot_mat(-numpy.pi/2,1,0,0)
 scale = numpy.eye(3)
 scale[2,2]=-1
@@ -32,7 +32,11 @@ import cgtypes # cgkit 1.x
 import math, warnings
 import numpy
 import numpy as np
-import scipy, scipy.io
+import scipy, scipy.io, scipy.sparse
+
+from coords import dirs2lonlat
+from receptor_graph import get_adjacency, mean_neighbor_angle
+from kernels import GaussianKernel, make_weight_maps
 
 cube_order = ['posx','negx','posy','negy','posz','negz']
 
@@ -46,133 +50,106 @@ def normalize(vec):
     return numpy.asarray(vec)/denom
 
 def get_mean_interommatidial_distance( receptor_dirs, triangles ):
-    """returns values in radians"""
-    # this is not efficient...
-    mean_thetas = []
-    for iv,v in enumerate(receptor_dirs):
-        neighbors = set()
-        for tri in triangles:
-            if iv in tri:
-                for it in tri:
-                    neighbors.add(it)
-        neighbors = list(neighbors)
-        neighbors.remove( iv )
-        neighbor_dirs = [ receptor_dirs[int(n)] for n in neighbors ]
-        cos_theta_neighbors = [numpy.dot(n,v) for n in neighbor_dirs]
-        theta_neighbors = [numpy.arccos( c ) for c in cos_theta_neighbors]
-        mean_theta = numpy.mean(theta_neighbors)
-        mean_thetas.append(mean_theta)
-    return mean_thetas
-
-def make_receptor_sensitivities(all_d_q,delta_rho_q=None,res=64):
+    """returns values in radians
+
+    Triangles referring to receptors beyond receptor_dirs are ignored,
+    so the directions of one eye can be given with the triangles of
+    both. See receptor_graph.py to keep the adjacency for other uses.
+    """
+    adjacency = get_adjacency(receptor_dirs, triangles)
+    return mean_neighbor_angle(adjacency)
+
+def make_receptor_sensitivities(all_d_q,delta_rho_q=None,res=64,kernel=None):
     """
 
     all_d_q are visual element directions as a 3-vector
     delta_rho_q (angular sensitivity) is in radians
 
+    By default, the acceptance function is the Gaussian of Snyder
+    (1979) with full width at half maximum delta_rho_q. Any other
+    acceptance function of kernels.py can be given as kernel instead.
+
+    Returns one normalized weight cubemap (a dictionary of res x res
+    arrays keyed by the names in cube_order) per visual element.
     """
-    if delta_rho_q is None:
-        raise ValueError('must specify delta_rho_q (in radians)')
+    if kernel is None:
+        if delta_rho_q is None:
+            raise ValueError('must specify delta_rho_q (in radians)')
 
-    if isinstance( delta_rho_q, float):
-        all_delta_rho_qs = delta_rho_q*numpy.ones( (len(all_d_q),), dtype=numpy.float64)
-    else:
-        all_delta_rho_qs = numpy.asarray(delta_rho_q)
-        if len(all_delta_rho_qs.shape) != 1:
-            raise ValueError("delta_rho_q must be scalar or vector")
-        if all_delta_rho_qs.shape[0] != len(all_d_q):
-            raise ValueError("if delta_rho_q is a vector, "
-                             "it must have the same number of "
-                             "elements as receptors")
-
-    def G_q(zeta,delta_rho_q):
-        # gaussian
-        # From Snyder (1979) as cited in Burton & Laughlin (2003)
-        return numpy.exp( -4*math.log(2)*abs(zeta)**2 / delta_rho_q**2 )
-
-    half_res = res//2
-    vals = (numpy.arange(res)-half_res)/half_res
+        if isinstance( delta_rho_q, float):
+            all_delta_rho_qs = delta_rho_q*numpy.ones( (len(all_d_q),), dtype=numpy.float64)
+        else:
+            all_delta_rho_qs = numpy.asarray(delta_rho_q)
+            if len(all_delta_rho_qs.shape) != 1:
+                raise ValueError("delta_rho_q must be scalar or vector")
+            if all_delta_rho_qs.shape[0] != len(all_d_q):
+                raise ValueError("if delta_rho_q is a vector, "
+                                 "it must have the same number of "
+                                 "elements as receptors")
+        kernel = GaussianKernel(all_delta_rho_qs)
 
-    weight_maps = []
+    all_maps = make_weight_maps(all_d_q, kernel, res=res)
 
-    # setup vectors for initial face (posx)
-    face_vecs = {}
-    face_vecs['posx'] = []
-    x = 1
-    for z in vals:
-        this_row_vecs = []
-        for y in vals:
-            on_cube_3d = (x,y,z)
-            #print('on_cube_3d   %5.2f %5.2f %5.2f'%on_cube_3d)
-            v3norm = normalize(on_cube_3d) # get direction of each pixel
-            p_p = cgtypes.quat(0.0, v3norm[0], v3norm[1], v3norm[2])
-            this_row_vecs.append(p_p)
-        this_row_vecs.reverse()
-        face_vecs['posx'].append( this_row_vecs )
-
-    def rot_face( facedict, facename, rotq):
-        facedict[facename] = []
-        for row in facedict['posx']:
-            this_row_vecs = []
-            for col in row:
-                this_row_vecs.append( rotq*col*rotq.inverse() )
-            facedict[facename].append( this_row_vecs )
-
-    rotq = cgtypes.quat()
-    rotq = rotq.fromAngleAxis(math.pi/2.0,cgtypes.vec3(0,0,1))
-    rot_face( face_vecs, 'posy', rotq)
-
-    rotq = cgtypes.quat()
-    rotq = rotq.fromAngleAxis(math.pi,cgtypes.vec3(0,0,1))
-    rot_face( face_vecs, 'negx', rotq)
-
-    rotq = cgtypes.quat()
-    rotq = rotq.fromAngleAxis(-math.pi/2.0,cgtypes.vec3(0,0,1))
-    rot_face( face_vecs, 'negy', rotq)
-
-    rotq = cgtypes.quat()
-    rotq = rotq.fromAngleAxis(math.pi/2.0,cgtypes.vec3(0,-1,0))
-    rot_face( face_vecs, 'posz', rotq)
-
-    rotq = cgtypes.quat()
-    rotq = rotq.fromAngleAxis(math.pi/2.0,cgtypes.vec3(0,1,0))
-    rot_face( face_vecs, 'negz', rotq)
-
-    # convert from quat to vec3
-    rfv = {}
-    for key in face_vecs:
-        rows = face_vecs[key]
-        rfv[key] = []
-        for row in rows:
-            this_row = [ cgtypes.vec3(col.x, col.y, col.z) for col in row ] # convert to vec3
-            rfv[key].append( this_row )
-
-    def get_weight_map(fn, rfv, d_q, delta_rho_q):
-        angles = numpy.zeros( (vals.shape[0], vals.shape[0]), dtype=numpy.float64 )
-        for i, row_vecs in enumerate(rfv[fn]):
-            for j, ovec in enumerate(row_vecs):
-                angles[i,j] = d_q.angle(ovec)
-        wm = G_q(angles,delta_rho_q)
-        return wm
-
-    for dqi,(d_q,this_delta_rho_q) in enumerate(zip(all_d_q,all_delta_rho_qs)):
-        weight_maps_d_q = {}
-        ssf = 0.0
-
-        for fn in cube_order:
-            wm = get_weight_map(fn, rfv, d_q, this_delta_rho_q)
-            weight_maps_d_q[fn] = wm
-            ssf += numpy.sum( wm.flat )
-
-        # normalize
-        for mapname in weight_maps_d_q:
-            wm = weight_maps_d_q[mapname]
-            weight_maps_d_q[mapname] = wm/ssf
-
-        # save maps by receptor direction
-        weight_maps.append( weight_maps_d_q )
+    weight_maps = []
+    for maps in all_maps:
+        weight_maps.append( dict(zip(cube_order,maps)) )
     return weight_maps
 
+def sparsify_weights( weights, max_rel_error ):
+    """keep the fewest weights that account for all but max_rel_error
+
+    weights is a rank-1 array of non-negative weights of one receptor
+    (e.g. a flattened cubemap). The largest weights are kept until the
+    discarded weight is at most max_rel_error times the total weight,
+    all other weights are set to zero, and the result is renormalized
+    to unit gain.
+
+    Returns the sparsified weights and the fraction of the total weight
+    that was discarded.
+    """
+    weights = numpy.asarray(weights)
+    assert weights.ndim==1
+    if not (0.0 <= max_rel_error < 1.0):
+        raise ValueError('max_rel_error must be in the range [0,1)')
+
+    order = numpy.argsort(weights)[::-1] # largest first
+    csum = numpy.cumsum(weights[order], dtype=numpy.float64)
+    total = csum[-1]
+    if total <= 0:
+        raise ValueError('weights must have a positive sum')
+
+    n_keep = numpy.searchsorted(csum, (1.0-max_rel_error)*total) + 1
+    n_keep = min(n_keep, len(order))
+    kept_sum = csum[n_keep-1]
+
+    result = numpy.zeros_like(weights)
+    keep = order[:n_keep]
+    result[keep] = weights[keep]/kept_sum
+    return result, 1.0-kept_sum/total
+
+def get_ellpack( weights ):
+    """convert a sparse weight matrix to padded (ELLPACK) format
+
+    Returns (indices, values), both of shape (n_receptors, K) where K is
+    the largest number of nonzero weights of any receptor. Row i holds
+    the pixel indices (in increasing order) and weights of receptor i,
+    padded with pixel 0 and weight 0, so that a response is
+    numpy.sum(values*flat[indices], axis=1).
+    """
+    weights = scipy.sparse.csr_matrix(weights)
+    weights.sum_duplicates()
+    weights.sort_indices()
+    n_receptors = weights.shape[0]
+    counts = numpy.diff(weights.indptr)
+    K = int(numpy.max(counts)) if n_receptors else 0
+    indices = numpy.zeros((n_receptors,K), dtype=numpy.int32)
+    values = numpy.zeros((n_receptors,K), dtype=weights.dtype)
+    rows = numpy.repeat(numpy.arange(n_receptors), counts)
+    cols = numpy.arange(weights.nnz) - numpy.repeat(weights.indptr[:-1], counts)
+    indices[rows,cols] = weights.indices
+    values[rows,cols] = weights.data
+    return indices, values
+
 def flatten_cubemap( cubemap ):
     rank1 = numpy.concatenate( [ numpy.ravel(cubemap[dir]) for dir in cube_order], axis=0 )
     return rank1
@@ -312,13 +289,10 @@ def get_code_for_var( name, fname_prefix, var):
                     raise RuntimeError("failed conversion for %s (type %s)"%(repr(var),str(type(var))))
 
 def xyz2lonlat(x,y,z):
-    R2D = 180.0/math.pi
-    try:
-        lat = math.asin(z)*R2D
-    except ValueError as err:
-        if z>1 and z < 1.1:
-            lat = math.asin(1.0)*R2D
-        else:
-            raise
-    lon1 = math.atan2(y,x)*R2D
-    return lon1,lat
+    """return longitude and latitude (in degrees) of x,y,z
+
+    Arrays are accepted, see coords.dirs2lonlat.
+    """
+    lonlat = dirs2lonlat(numpy.stack(numpy.broadcast_arrays(x,y,z),axis=-1),
+                         degrees=True)
+    return lonlat[...,0][()],lonlat[...,1][()]
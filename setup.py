@@ -39,6 +39,9 @@ FNAMES = [os.path.join(*args) for args in [
     ('drosophila_eye_map', 'receptor_directions_buchner71.csv'),
     ('drosophila_eye_map', 'precomputed_buchner71.py'),
     ('drosophila_eye_map', 'receptor_weight_matrix_64_buchner71.mat'),
+    ('drosophila_eye_map', 'receptor_adjacency_buchner71.mat'),
+    ('drosophila_eye_map', 'receptor_sample_dirs_buchner71.mat'),
+    ('drosophila_eye_map', 'receptor_sample_weights_buchner71.mat'),
 ]]
 
 for fname in FNAMES:
@@ -53,7 +56,13 @@ setup(name='drosophila_eye_map',
       url='https://github.com/strawlab/drosophila_eye_map',
       version='0.5.0', # keep in sync: upload_stuff.sh, README.txt, drosophila_eye_map.__init__.py
       packages=find_packages(),
-      package_data={'drosophila_eye_map':['receptor_weight_matrix_64_buchner71.mat',]},
+      package_data={'drosophila_eye_map':['receptor_weight_matrix_64_buchner71.mat',
+                                          'receptor_adjacency_buchner71.mat',
+                                          'receptor_sample_dirs_buchner71.mat',
+                                          'receptor_sample_weights_buchner71.mat',
+                                          # only with --ellpack
+                                          'receptor_weight_indices_64_buchner71.mat',
+                                          'receptor_weight_values_64_buchner71.mat',]},
       entry_points={
           'console_scripts': [
               'drosophila_eye_map_inspect_weightmap = drosophila_eye_map.inspect_weightmap:main',